@@ -0,0 +1,8 @@
+"""
+Benchmarks of Repository.get, Repository.save, Repository.delete and Cursor
+iteration over synthetic object graphs, run with:
+
+    python -m benchmarks --backend memory --depth 1 2 --fan-out 1 10
+
+Results are written as JSON, so that runs can be compared.
+"""
@@ -0,0 +1,52 @@
+import argparse
+import itertools
+import json
+import sys
+
+from benchmarks import backends
+from benchmarks.runner import get_environment, run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmarks sticky-marshmallow's read and write paths.",
+    )
+    parser.add_argument(
+        "--backend", choices=backends.BACKENDS, default=backends.BACKEND_MONGOD
+    )
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--depth", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--fan-out", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--size", type=int, nargs="+", default=[100])
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument(
+        "--output", help="File to write the results to, stdout by default"
+    )
+    args = parser.parse_args(argv)
+
+    results = []
+    for depth, fan_out, size in itertools.product(
+        args.depth, args.fan_out, args.size
+    ):
+        results.extend(
+            run(
+                args.backend,
+                depth,
+                fan_out,
+                size,
+                args.iterations,
+                host=args.host,
+            )
+        )
+    report = {"environment": get_environment(args.backend), "results": results}
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+The databases benchmarks run against. Every database is wrapped to count the
+operations sent to the server.
+"""
+import pymongo
+from sticky_marshmallow import get_db, register_db
+
+
+BACKEND_MONGOD = "mongod"
+BACKEND_MEMORY = "memory"
+
+BACKENDS = (BACKEND_MONGOD, BACKEND_MEMORY)
+
+DEFAULT_DB = "sticky_marshmallow_benchmark"
+
+# Collection methods that result in a round trip. Reading the batches of a
+# large result after the first one (getMore) is not counted.
+OPERATIONS = (
+    "aggregate",
+    "bulk_write",
+    "count_documents",
+    "delete_many",
+    "delete_one",
+    "find",
+    "find_one",
+    "insert_many",
+    "insert_one",
+    "replace_one",
+    "update_many",
+    "update_one",
+)
+
+
+class OperationCounter:
+    def __init__(self):
+        self.count = 0
+
+    def reset(self):
+        self.count = 0
+
+
+class CountingDatabase:
+    def __init__(self, db, counter):
+        self._db = db
+        self.counter = counter
+
+    def __getitem__(self, name):
+        return CountingCollection(self._db[name], self.counter)
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+class CountingCollection:
+    def __init__(self, collection, counter):
+        self._collection = collection
+        self._counter = counter
+
+    def with_options(self, *args, **kwargs):
+        return CountingCollection(
+            self._collection.with_options(*args, **kwargs), self._counter
+        )
+
+    def __getattr__(self, name):
+        if name in OPERATIONS:
+            self._counter.count += 1
+        return getattr(self._collection, name)
+
+
+def connect(backend, host=None, db=DEFAULT_DB):
+    """
+    Registers the database of backend under the alias "benchmark_<backend>"
+    and returns it. The memory backend requires mongomock.
+    """
+    alias = f"benchmark_{backend}"
+    try:
+        return get_db(alias)
+    except KeyError:
+        pass
+    if backend == BACKEND_MONGOD:
+        client = pymongo.MongoClient(host=host)
+    elif backend == BACKEND_MEMORY:
+        try:
+            import mongomock
+        except ImportError:
+            raise RuntimeError("The memory backend requires mongomock")
+        client = mongomock.MongoClient()
+    else:
+        raise ValueError(f"Unknown backend '{backend}'")
+    register_db(CountingDatabase(client[db], OperationCounter()), alias)
+    return get_db(alias)
@@ -0,0 +1,117 @@
+import datetime
+import platform
+import time
+import tracemalloc
+
+import marshmallow
+import pymongo
+import sticky_marshmallow
+
+from benchmarks import backends
+from benchmarks.schemas import (
+    count_nodes,
+    make_graph,
+    make_repository,
+    make_schemas,
+)
+
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, p):
+    """
+    Returns the p-th percentile of sorted values by the nearest rank method.
+    """
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def measure(operation, fn, args, documents, counter):
+    """
+    Calls fn once per argument. The first call is a warm-up that is not
+    timed, but traced to measure the peak memory of one call. `documents` is
+    the number of documents read or written by each call.
+    """
+    args = list(args)
+    tracemalloc.start()
+    try:
+        fn(args[0])
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies = []
+    counter.reset()
+    for arg in args[1:]:
+        started = time.perf_counter()
+        fn(arg)
+        latencies.append(time.perf_counter() - started)
+    calls = len(latencies)
+    total = sum(latencies)
+    latencies.sort()
+    return {
+        "operation": operation,
+        "calls": calls,
+        "latency": dict(
+            {f"p{p}": percentile(latencies, p) for p in PERCENTILES},
+            min=latencies[0],
+            max=latencies[-1],
+            mean=total / calls,
+        ),
+        "ops_per_second": calls / total if total else 0.0,
+        "docs_per_second": calls * documents / total if total else 0.0,
+        "round_trips": counter.count / calls,
+        "peak_memory": peak_memory,
+    }
+
+
+def run(backend, depth, fan_out, size, iterations, host=None):
+    """
+    Benchmarks save, get, find and delete of graphs of the given shape and
+    returns one result per operation. Each operation is called `iterations`
+    times, including the warm-up call.
+    """
+    if iterations < 2:
+        raise ValueError("At least 2 iterations are needed")
+    db = backends.connect(backend, host=host)
+    schemas = make_schemas(depth, fan_out, size)
+    repositories = [
+        make_repository(schema, f"benchmark_{backend}")()
+        for schema in schemas
+    ]
+    repo = repositories[0]
+    nodes = count_nodes(depth, fan_out)
+    for repository in repositories:
+        repository.delete_many()
+
+    objs = [make_graph(depth, fan_out, size) for _ in range(iterations)]
+    results = [
+        measure("save", repo.save, objs, nodes, db.counter),
+        measure("get", repo.get, [obj.id for obj in objs], nodes, db.counter),
+        measure(
+            "find",
+            lambda _: list(repo.find()),
+            range(iterations),
+            nodes * iterations,
+            db.counter,
+        ),
+        # Only deletes the root documents
+        measure("delete", repo.delete, objs, 1, db.counter),
+    ]
+
+    for repository in repositories:
+        repository.delete_many()
+    shape = {"depth": depth, "fan_out": fan_out, "size": size}
+    return [dict(shape, **result) for result in results]
+
+
+def get_environment(backend):
+    return {
+        "backend": backend,
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "sticky_marshmallow": ".".join(map(str, sticky_marshmallow.VERSION)),
+        "marshmallow": marshmallow.__version__,
+        "pymongo": pymongo.version,
+    }
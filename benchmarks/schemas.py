@@ -0,0 +1,69 @@
+"""
+Synthetic schemas and object graphs. Each level of a graph references
+`fan_out` entities of the next level, down to `depth` levels below the root.
+"""
+from marshmallow import fields, post_load, Schema
+from sticky_marshmallow import Repository
+
+
+class Node:
+    def __init__(self, id=None, payload=None, children=None):
+        self.id = id
+        self.payload = payload
+        self.children = children
+
+
+def _get_post_load():
+    # Hooks are registered on the function, so each schema needs its own
+    def make_object(self, data, **kwargs):
+        return Node(**data)
+
+    return post_load(make_object)
+
+
+def make_schemas(depth, fan_out, size):
+    """
+    Returns the schema classes of the levels of a graph, root first. Each
+    configuration gets its own schemas and therefore its own collections.
+    """
+    schemas = []
+    child = None
+    for level in reversed(range(depth + 1)):
+        attrs = {
+            "id": fields.Str(allow_none=True),
+            "payload": fields.Str(),
+            "make_object": _get_post_load(),
+        }
+        if child is not None:
+            attrs["children"] = fields.Nested(child, many=True)
+        child = type(
+            f"BenchmarkD{depth}F{fan_out}S{size}Level{level}Schema",
+            (Schema,),
+            attrs,
+        )
+        schemas.insert(0, child)
+    return schemas
+
+
+def make_repository(schema, db_alias):
+    return type(
+        f"{schema.__name__}Repository",
+        (Repository,),
+        {"Meta": type("Meta", (), {"schema": schema, "db_alias": db_alias})},
+    )
+
+
+def make_graph(depth, fan_out, size):
+    """
+    Returns a new, unsaved root node with `size` bytes of payload per node.
+    """
+    return Node(
+        payload="x" * size,
+        children=[make_graph(depth - 1, fan_out, size) for _ in range(fan_out)]
+        if depth > 0
+        else None,
+    )
+
+
+def count_nodes(depth, fan_out):
+    return sum(fan_out ** level for level in range(depth + 1))
@@ -38,7 +38,7 @@ setup(
     include_package_data=True,
     description="sticky-marshmallow provides RDMS style persistence for marshmallow schemas",  # noqa: E501
     platforms=["any"],
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "tests"]),
     classifiers=[
         "Development Status :: 4 - Beta",
         "Intended Audience :: Developers",
@@ -0,0 +1,465 @@
+"""
+asyncio counterparts of Repository, Cursor and Core, for databases of an
+async driver such as motor.
+"""
+import asyncio
+import inspect
+import itertools
+
+from bson import ObjectId
+
+from sticky_marshmallow.cache import get_query_cache
+from sticky_marshmallow.core import Core
+from sticky_marshmallow.cursor import Cursor, JOIN_SERVER
+from sticky_marshmallow.embedding import record as record_embedding
+from sticky_marshmallow.indexes import (
+    forget_index_keys,
+    get_cached_index_keys,
+    get_missing_indexes,
+    get_pending_indexes,
+    set_index_keys,
+    warn_unindexed,
+)
+from sticky_marshmallow.instrumentation import record_query_by_id, span
+from sticky_marshmallow.pagination import DEFAULT_PAGE_SIZE, Page, split_page
+from sticky_marshmallow.plan import DELETE, get_plan
+from sticky_marshmallow.projection import Projection
+from sticky_marshmallow.repository import (
+    BaseRepository,
+    DEFAULT_BATCH_SIZE,
+    RepositoryMixin,
+)
+
+
+__all__ = ["AsyncRepository", "ensure_indexes"]
+
+
+async def ensure_indexes(repositories=None):
+    """
+    Like sticky_marshmallow.indexes.ensure_indexes, for the given async
+    repositories or all async repository classes defined so far.
+    """
+    created = {}
+    for key, (collection, models) in get_pending_indexes(
+        repositories, is_async=True
+    ).items():
+        missing = get_missing_indexes(
+            models, await collection.index_information()
+        )
+        if missing:
+            created[collection.name] = await collection.create_indexes(
+                missing
+            )
+        forget_index_keys(key)
+    return created
+
+
+class AsyncCore(Core):
+    async def _check_filter(self, filter):
+        pass
+
+    def _get_lazy_loader(self, trusted=False, track_changes=False):
+        # References beyond max_depth are left unloaded, as they can't be
+        # loaded on attribute access
+        return None
+
+    async def _find_by_ids(self, schema, ids, projection=None):
+        found, ids = self._get_cached_documents(schema, ids, projection)
+        if ids:
+            record_query_by_id(self._get_collection_name_from_schema(schema))
+            cursor = self._get_read_collection_from_schema(schema).find(
+                {"_id": {"$in": ids}},
+                None if projection is None else projection.to_mongo(schema),
+            )
+            found.update(
+                self._set_cached_documents(
+                    schema, [document async for document in cursor], projection
+                )
+            )
+        return found
+
+    async def _dereference(self, schema, document, projection=None):
+        if document is None:
+            return
+        await self._dereference_many(schema, [document], projection)
+        return document
+
+    async def _dereference_many(self, schema, documents, projection=None):
+        """
+        Like Core._dereference_many, but the referenced collections of a level
+        are queried concurrently.
+        """
+        graph = self._get_reference_graph(schema, documents, projection)
+        pending = graph.get_pending()
+        while pending is not None:
+            _, schemas, ids = pending
+            results = await asyncio.gather(
+                *[
+                    self._find_by_ids(schemas[key], key_ids, key[1])
+                    for key, key_ids in ids.items()
+                ]
+            )
+            graph.add(dict(zip(ids, results)))
+            pending = graph.get_pending()
+        return graph.assign()
+
+    async def _to_object(
+        self, schema, document, projection=None, trusted=False
+    ):
+        document = await self._dereference(schema, document, projection)
+        unresolved = self._take_unresolved(schema, [document])
+        obj = self._load(
+            self._get_load_schema(schema, projection), document, trusted
+        )
+        self._share_references(
+            schema, [obj], [document], projection, unresolved=unresolved
+        )
+        return obj
+
+
+class AsyncCursor(Cursor):
+    core_class = AsyncCore
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Checking the filter needs the indexes, which can't be awaited
+        # before the cursor is used
+        self._filter_checked = False
+
+    def __iter__(self):
+        raise TypeError(
+            f"'{self.__class__.__name__}' object is not iterable, "
+            "use 'async for' instead"
+        )
+
+    __next__ = __iter__
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._buffer:
+            self._buffer.extend(await self._next_batch(self._batch_size))
+        if not self._buffer:
+            raise StopAsyncIteration
+        return self._buffer.popleft()
+
+    async def _next_batch(self, size):
+        if not self._filter_checked:
+            self._filter_checked = True
+            await self._core._check_filter(self._filter)
+        with span("find", collection=get_plan(self._schema).collection_name):
+            if self._cached and get_query_cache() is not None:
+                return await self._next_cached_batch(size)
+            documents = []
+            if size > 0:
+                async for document in self._get_pymongo_cursor():
+                    documents.append(document)
+                    if len(documents) == size:
+                        break
+            return await self._load_documents(documents)
+
+    async def _next_cached_batch(self, size):
+        if self._cached_documents is None:
+            cache = get_query_cache()
+            key = self._get_cache_key()
+            documents = cache.get(key)
+            if documents is None:
+                documents = [
+                    document async for document in self._get_pymongo_cursor()
+                ]
+                await self._dereference_documents(documents)
+                cache.set(
+                    key,
+                    self._get_cache_collections(),
+                    documents,
+                    self._core._db_alias,
+                )
+            self._cached_documents = iter(documents)
+        return self._load_dereferenced(
+            list(itertools.islice(self._cached_documents, size))
+        )
+
+    async def _dereference_documents(self, documents):
+        await self._core._dereference_many(
+            self._schema, documents, self._projection
+        )
+
+    async def _load_documents(self, documents):
+        await self._dereference_documents(documents)
+        return self._load_dereferenced(documents)
+
+    async def page_with_total(self, estimated=False):
+        with span(
+            "page_with_total",
+            collection=get_plan(self._schema).collection_name,
+        ):
+            pipeline, counts = self._get_page_with_total_pipeline(estimated)
+            results = [
+                result async for result in self._collection.aggregate(pipeline)
+            ]
+            if counts:
+                documents, total = self._get_facet_result(results)
+            else:
+                documents = results
+                total = await self._collection.estimated_document_count()
+            return Page(await self._load_documents(documents), total=total)
+
+    async def paginate(self, after=None, page_size=DEFAULT_PAGE_SIZE):
+        with span(
+            "paginate", collection=get_plan(self._schema).collection_name
+        ):
+            cursor, sort = self._get_page_cursor(after, page_size)
+            documents, next = split_page(
+                sort,
+                [document async for document in cursor._get_pymongo_cursor()],
+                page_size,
+            )
+            return Page(await cursor._load_documents(documents), next)
+
+    def lazy(self, *fields):
+        raise TypeError(
+            "Lazy references are only supported by the synchronous Cursor"
+        )
+
+    def prefetch(self, batches=2):
+        raise TypeError(
+            "Prefetching is only supported by the synchronous Cursor"
+        )
+
+    async def close(self):
+        self._buffer.clear()
+        if self._pymongo_cursor is not None:
+            result = self._pymongo_cursor.close()
+            if inspect.isawaitable(result):
+                await result
+
+    async def iter_batches(self, n=None):
+        """
+        Yields lists of up to `n` loaded objects.
+        """
+        size = n or self._batch_size
+        while True:
+            batch = [
+                self._buffer.popleft()
+                for _ in range(min(size, len(self._buffer)))
+            ]
+            if len(batch) < size:
+                batch.extend(await self._next_batch(size - len(batch)))
+            if not batch:
+                return
+            yield batch
+
+    async def count(self):
+        return await self._collection.count_documents(self._filter)
+
+
+class AsyncRepository(RepositoryMixin, AsyncCore, metaclass=BaseRepository):
+    _is_async = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if getattr(getattr(cls, "Meta", None), "lazy", None):
+            raise ValueError(
+                "Lazy references are only supported by Repository"
+            )
+
+    async def _bulk_save(self, entities, batch_size):
+        ids = {}
+        refreshes = []
+        for height in sorted({height for _, _, height in entities}):
+            bulk_writes = list(
+                self._get_bulk_writes(entities, height, ids, batch_size)
+            )
+            results = await asyncio.gather(
+                *[
+                    self._bulk_write(collection, writes)
+                    for collection, writes in bulk_writes
+                ]
+            )
+            for writes, upserted_ids in results:
+                self._set_bulk_ids(writes, upserted_ids, ids)
+                refreshes.extend(self._get_bulk_refreshes(writes, ids))
+        await self._refresh_embedded(refreshes)
+
+    async def _bulk_write(self, collection, writes):
+        result = await collection.bulk_write(
+            self._get_bulk_operations(writes), ordered=False
+        )
+        unmatched = self._get_unmatched(writes, result)
+        resent = self._get_resent(writes, unmatched)
+        resent_result = (
+            await collection.bulk_write(
+                self._get_bulk_operations(resent), ordered=False
+            )
+            if resent
+            else None
+        )
+        return self._merge_resent(
+            writes, result, unmatched, resent, resent_result
+        )
+
+    async def _refresh_embedded(self, refreshes):
+        groups = self._group_refreshes(refreshes)
+        results = await asyncio.gather(
+            *[
+                self._get_collection_from_schema(parent_schema).bulk_write(
+                    writes, ordered=False
+                )
+                for parent_schema, writes in groups
+            ]
+        )
+        for (parent_schema, _), result in zip(groups, results):
+            self._invalidate_cached_documents(parent_schema)
+            record_embedding("refreshes")
+            record_embedding("refreshed", result.modified_count)
+
+    async def _check_filter(self, filter):
+        """
+        Warns when no index supports filter, see Meta.check_indexes.
+        """
+        if not getattr(self.Meta, "check_indexes", False):
+            return
+        db_alias = self._read_alias or self._db_alias
+        collection = self.read_collection
+        index_keys = get_cached_index_keys(db_alias, collection.name)
+        if index_keys is None:
+            index_keys = set_index_keys(
+                db_alias, collection.name, await collection.index_information()
+            )
+        warn_unindexed(collection.name, filter, index_keys)
+
+    async def _get_object(self, schema, document, projection=None):
+        obj = await self._to_object(
+            schema, document, projection, self._is_trusted()
+        )
+        if self._tracks_changes() and projection is None:
+            self._set_snapshots(schema, obj)
+        return obj
+
+    async def get(self, id=None, join=None, fields=None, **filter):
+        with self._span("get"):
+            schema = self.Meta.schema()
+            projection = None if fields is None else Projection(fields)
+            if id is not None:
+                filter["_id"] = ObjectId(id)
+            await self._check_filter(filter)
+            if join == JOIN_SERVER:
+                cursor = self.read_collection.aggregate(
+                    self._get_joined_pipeline(schema, filter, projection)
+                )
+            elif join is not None:
+                raise ValueError(f"Unknown join mode '{join}'")
+            elif list(filter) == ["_id"]:
+                document = (
+                    await self._find_by_ids(
+                        schema, [filter["_id"]], projection
+                    )
+                ).get(filter["_id"])
+                if document is None:
+                    raise self.DoesNotExist()
+                return await self._get_object(schema, document, projection)
+            else:
+                cursor = self.read_collection.find(
+                    filter,
+                    None
+                    if projection is None
+                    else projection.to_mongo(schema),
+                ).limit(2)
+            documents = [document async for document in cursor]
+            if len(documents) > 1:
+                raise self.MultipleObjectsReturned()
+            if not documents:
+                raise self.DoesNotExist()
+            return await self._get_object(schema, documents[0], projection)
+
+    def find(self, join=None, **filter):
+        schema = self.Meta.schema()
+        return AsyncCursor(
+            schema=schema,
+            collection=self.read_collection,
+            filter=filter,
+            join=join,
+            track_changes=self._tracks_changes(),
+            trusted=self._is_trusted(),
+            core=self,
+        )
+
+    async def ensure_indexes(self):
+        """
+        Creates the indexes declared in Meta.indexes and the unique index of
+        Meta.primary_key if they don't exist yet.
+        """
+        return await ensure_indexes([self])
+
+    async def save(self, obj):
+        await self.save_many([obj])
+        return obj
+
+    async def save_many(self, objs, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Saves many objects level by level, leaves first. The bulk writes of
+        the collections on one level are sent concurrently.
+        """
+        with self._span("save_many"):
+            objs = list(objs)
+            schema = self.Meta.schema()
+            entities = {}
+            for obj in objs:
+                self._collect_entities(schema, obj, entities)
+            await self._bulk_save(list(entities.values()), batch_size)
+            return objs
+
+    async def _get_cascaded_deletes(self, filter):
+        deletes = {}
+        level = [(self.Meta.schema, filter)]
+        while level:
+            documents = []
+            for schema, filter in level:
+                field_names = self._get_options(schema).get_cascaded_fields(
+                    DELETE
+                )
+                if field_names:
+                    collection = self._get_collection_from_schema(schema)
+                    documents.append(
+                        (
+                            schema,
+                            field_names,
+                            [
+                                document
+                                async for document in collection.find(
+                                    filter, field_names
+                                )
+                            ],
+                        )
+                    )
+            level = self._add_cascaded_deletes(documents, deletes)
+        return deletes
+
+    async def _delete_cascaded(self, deletes):
+        await asyncio.gather(
+            *[
+                self._get_collection_from_schema(schema).delete_many(
+                    {"_id": {"$in": list(ids)}}
+                )
+                for schema, ids in deletes.values()
+                if ids
+            ]
+        )
+        for schema, ids in deletes.values():
+            self._invalidate_cached_documents(schema, ids)
+
+    async def delete(self, obj):
+        with self._span("delete"):
+            _id = ObjectId(obj.id)
+            deletes = await self._get_cascaded_deletes({"_id": _id})
+            await self.collection.delete_one({"_id": _id})
+            self._invalidate_cached_documents(self.Meta.schema, [_id])
+            await self._delete_cascaded(deletes)
+
+    async def delete_many(self, **filter):
+        with self._span("delete_many"):
+            deletes = await self._get_cascaded_deletes(filter)
+            await self.collection.delete_many(filter)
+            self._invalidate_cached_documents(self.Meta.schema)
+            await self._delete_cascaded(deletes)
@@ -0,0 +1,234 @@
+import collections
+import copy
+import threading
+import time
+
+import bson
+
+from sticky_marshmallow.connection import DEFAULT_ALIAS
+
+__all__ = [
+    "EntityCache",
+    "get_entity_cache",
+    "get_query_cache",
+    "QueryCache",
+    "register_entity_cache",
+    "register_query_cache",
+]
+
+_entity_cache = None
+
+_query_cache = None
+
+
+def get_entity_cache():
+    return _entity_cache
+
+
+def register_entity_cache(cache):
+    """
+    Registers the cache used by all repositories. Pass None to disable it.
+    """
+    global _entity_cache
+    _entity_cache = cache
+
+
+def get_query_cache():
+    return _query_cache
+
+
+def register_query_cache(cache):
+    """
+    Registers the cache of the queries marked with Cursor.cached(). Pass
+    None to disable it.
+    """
+    global _query_cache
+    _query_cache = cache
+
+
+class EntityCache:
+    """
+    A read-through cache of raw documents keyed by (db alias, collection,
+    _id), with LRU eviction once `max_size` documents are cached and an
+    optional time to live in seconds.
+    """
+
+    def __init__(self, max_size=1000, ttl=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._documents = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._documents)
+
+    @property
+    def stats(self):
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def get(self, collection_name, _id, db_alias=DEFAULT_ALIAS):
+        return self.get_many(collection_name, [_id], db_alias).get(_id)
+
+    def get_many(self, collection_name, ids, db_alias=DEFAULT_ALIAS):
+        """
+        Returns copies of the cached documents of ids, keyed by _id.
+        """
+        found = {}
+        now = self._clock()
+        with self._lock:
+            for _id in ids:
+                key = (db_alias, collection_name, _id)
+                try:
+                    expires_at, document = self._documents[key]
+                except KeyError:
+                    self.misses += 1
+                    continue
+                if expires_at is not None and expires_at <= now:
+                    del self._documents[key]
+                    self.expirations += 1
+                    self.misses += 1
+                    continue
+                self._documents.move_to_end(key)
+                self.hits += 1
+                found[_id] = copy.deepcopy(document)
+        return found
+
+    def set(self, collection_name, document, db_alias=DEFAULT_ALIAS):
+        expires_at = None if self.ttl is None else self._clock() + self.ttl
+        key = (db_alias, collection_name, document["_id"])
+        with self._lock:
+            self._documents[key] = (expires_at, copy.deepcopy(document))
+            self._documents.move_to_end(key)
+            while len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, collection_name, _id, db_alias=DEFAULT_ALIAS):
+        with self._lock:
+            self._documents.pop((db_alias, collection_name, _id), None)
+
+    def invalidate_collection(self, collection_name, db_alias=DEFAULT_ALIAS):
+        with self._lock:
+            for key in [
+                key
+                for key in self._documents
+                if key[:2] == (db_alias, collection_name)
+            ]:
+                del self._documents[key]
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+
+class QueryCache:
+    """
+    A cache of the dereferenced documents of queries, keyed by the query,
+    with LRU eviction once the cached documents take more than `max_bytes`
+    as BSON and an optional time to live in seconds. A query is dropped when
+    any collection it reads from, including those of its references, is
+    written to.
+    """
+
+    def __init__(
+        self, max_bytes=16 * 2 ** 20, ttl=None, clock=time.monotonic
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        # Maps each key to (expires at, (db alias, collection name) pairs,
+        # size, documents)
+        self._queries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._queries)
+
+    @property
+    def stats(self):
+        return {
+            "size": len(self),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    def get(self, key):
+        """
+        Returns a copy of the documents cached for key, or None.
+        """
+        with self._lock:
+            try:
+                expires_at, _, _, documents = self._queries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires_at is not None and expires_at <= self._clock():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._queries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(documents)
+
+    def set(self, key, collection_names, documents, db_alias=DEFAULT_ALIAS):
+        size = sum(len(bson.encode(document)) for document in documents)
+        if size > self.max_bytes:
+            return
+        expires_at = None if self.ttl is None else self._clock() + self.ttl
+        documents = copy.deepcopy(documents)
+        with self._lock:
+            if key in self._queries:
+                self._remove(key)
+            self._queries[key] = (
+                expires_at,
+                frozenset(
+                    (db_alias, collection_name)
+                    for collection_name in collection_names
+                ),
+                size,
+                documents,
+            )
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._queries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        self.size_bytes -= self._queries.pop(key)[2]
+
+    def invalidate_collection(self, collection_name, db_alias=DEFAULT_ALIAS):
+        with self._lock:
+            for key in [
+                key
+                for key, (_, collection_names, _, _) in self._queries.items()
+                if (db_alias, collection_name) in collection_names
+            ]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._queries.clear()
+            self.size_bytes = 0
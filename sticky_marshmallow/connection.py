@@ -3,6 +3,7 @@ import pymongo
 
 __all__ = [
     "connect",
+    "connect_async",
     "get_db",
     "register_db",
 ]
@@ -13,10 +14,28 @@ _dbs = {}
 DEFAULT_ALIAS = "default"
 
 
-def connect(db="test", host=None):
-    connection = pymongo.MongoClient(host=host)
-    register_connection(connection)
-    register_db(connection[db])
+def connect(db="test", host=None, alias=DEFAULT_ALIAS, **kwargs):
+    """
+    Keyword arguments such as maxPoolSize, minPoolSize or readPreference are
+    passed on to pymongo.MongoClient.
+    """
+    connection = pymongo.MongoClient(host=host, **kwargs)
+    register_connection(connection, alias)
+    register_db(connection[db], alias)
+    return get_db(alias)
+
+
+def connect_async(db="test", host=None, alias=DEFAULT_ALIAS, **kwargs):
+    """
+    Connects with motor, which has to be installed separately, for use with
+    sticky_marshmallow.aio.
+    """
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    connection = AsyncIOMotorClient(host=host, **kwargs)
+    register_connection(connection, alias)
+    register_db(connection[db], alias)
+    return get_db(alias)
 
 
 def get_db(alias=DEFAULT_ALIAS):
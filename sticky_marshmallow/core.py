@@ -1,110 +1,712 @@
-import inspect
+import datetime
 
-import marshmallow
 from bson import ObjectId
-from marshmallow import fields
+from marshmallow import missing
 
-from sticky_marshmallow.connection import get_db
-from sticky_marshmallow.utils.case import snake_case
+from sticky_marshmallow.cache import get_entity_cache, get_query_cache
+from sticky_marshmallow.connection import DEFAULT_ALIAS, get_db
+from sticky_marshmallow.embedding import (
+    EmbeddedCopy,
+    get_embedded_document,
+    is_partial,
+    mark_partial,
+)
+from sticky_marshmallow.embedding import record as record_embedding
+from sticky_marshmallow.graph import JOINED, ReferenceGraph
+from sticky_marshmallow.instrumentation import record_query_by_id, span
+from sticky_marshmallow.lazy import (
+    get_lazy_schema_class,
+    is_unloaded,
+    LazyLoader,
+    LazyReference,
+    CyclicReference,
+    Unresolved,
+    unwrap,
+)
+from sticky_marshmallow.options import get_options
+from sticky_marshmallow.plan import DELETE, get_plan, NONE, REF_ONLY, SAVE
+from sticky_marshmallow.tracking import set_snapshot
+from sticky_marshmallow.trusted import get_trusted_loader
 
 
 class Core:
-    @staticmethod
-    def get_db():
-        return get_db()
+    def __init__(
+        self,
+        *args,
+        db_alias=DEFAULT_ALIAS,
+        read_alias=None,
+        read_preference=None,
+        max_depth=None,
+        **kwargs,
+    ):
+        """
+        Writes go to the database registered as db_alias. Reads go to the one
+        registered as read_alias if given, with read_preference if given.
+        References are dereferenced up to max_depth levels deep, if given.
+        """
+        super().__init__(*args, **kwargs)
+        self._db_alias = db_alias
+        self._read_alias = read_alias
+        self._read_preference = read_preference
+        self._max_depth = max_depth
+        self._collections = {}
+        self._read_collections = {}
+
+    def get_db(self):
+        return get_db(self._db_alias)
+
+    def get_read_db(self):
+        return get_db(self._read_alias or self._db_alias)
 
     @staticmethod
     def _get_collection_name_from_schema(schema):
-        # Allows both the schema class and an instance to be passed
-        if inspect.isclass(schema):
-            cls_name = schema.__name__
-        else:
-            cls_name = schema.__class__.__name__
-        collection_name = snake_case(cls_name.replace("Schema", ""))
-        return collection_name
+        return get_plan(schema).collection_name
+
+    def _get_options(self, schema):
+        return get_options(schema)
 
     def _get_collection_from_schema(self, schema):
-        return self.get_db()[self._get_collection_name_from_schema(schema)]
+        collection_name = self._get_collection_name_from_schema(schema)
+        try:
+            return self._collections[collection_name]
+        except KeyError:
+            collection = self._collections[collection_name] = self.get_db()[
+                collection_name
+            ]
+            return collection
+
+    def _get_read_collection_from_schema(self, schema):
+        collection_name = self._get_collection_name_from_schema(schema)
+        try:
+            return self._read_collections[collection_name]
+        except KeyError:
+            collection = self.get_read_db()[collection_name]
+            if self._read_preference is not None:
+                collection = collection.with_options(
+                    read_preference=self._read_preference
+                )
+            self._read_collections[collection_name] = collection
+            return collection
+
+    def _find_by_ids(self, schema, ids, projection=None):
+        found, ids = self._get_cached_documents(schema, ids, projection)
+        if ids:
+            record_query_by_id(self._get_collection_name_from_schema(schema))
+            cursor = self._get_read_collection_from_schema(schema).find(
+                {"_id": {"$in": ids}},
+                None if projection is None else projection.to_mongo(schema),
+            )
+            found.update(
+                self._set_cached_documents(schema, cursor, projection)
+            )
+        return found
+
+    def _get_cached_documents(self, schema, ids, projection=None):
+        """
+        Returns the cached documents of ids and the ids still to be fetched.
+        Projected documents bypass the cache.
+        """
+        cache = get_entity_cache()
+        if cache is None or projection is not None:
+            return {}, list(ids)
+        collection_name = self._get_collection_name_from_schema(schema)
+        # Documents read from read_alias are cached under db_alias, which
+        # writes invalidate
+        found = cache.get_many(collection_name, ids, self._db_alias)
+        return found, [_id for _id in ids if _id not in found]
+
+    def _set_cached_documents(self, schema, documents, projection=None):
+        cache = None if projection is not None else get_entity_cache()
+        found = {}
+        for document in documents:
+            if cache is not None:
+                cache.set(
+                    self._get_collection_name_from_schema(schema),
+                    document,
+                    self._db_alias,
+                )
+            found[document["_id"]] = document
+        return found
+
+    def _invalidate_cached_documents(self, schema, ids=None):
+        collection_name = self._get_collection_name_from_schema(schema)
+        query_cache = get_query_cache()
+        if query_cache is not None:
+            query_cache.invalidate_collection(collection_name, self._db_alias)
+        cache = get_entity_cache()
+        if cache is None:
+            return
+        # Without an _id, e.g. after upserting by primary key, we don't know
+        # which document was written
+        if ids is None or None in ids:
+            cache.invalidate_collection(collection_name, self._db_alias)
+        else:
+            for _id in ids:
+                cache.invalidate(collection_name, _id, self._db_alias)
+
+    @staticmethod
+    def _get_reference_ids(value):
+        values = value if isinstance(value, list) else [value]
+        return [
+            ObjectId(oid)
+            for oid in values
+            if oid is not None and not isinstance(oid, dict)
+        ]
+
+    @staticmethod
+    def _get_stored_ids(value):
+        """
+        Returns the ids of the entities referenced by a stored value,
+        including those stored with a copy, see Meta.embed.
+        """
+        values = value if isinstance(value, list) else [value]
+        return [
+            oid["_id"] if isinstance(oid, dict) else ObjectId(oid)
+            for oid in values
+            if oid is not None and (not isinstance(oid, dict) or "_id" in oid)
+        ]
 
-    def _dereference(self, schema, document):
+    def _dereference(self, schema, document, projection=None, lazy=()):
         if document is None:
             return
-        for field_name, field in self._get_reference_fields(
-            schema, document=document
-        ).items():
-            if isinstance(document[field_name], list):
-                nested_documents = [
-                    self._get_collection_from_schema(field.schema).find_one(
-                        {"_id": ObjectId(oid)}
+        self._dereference_many(schema, [document], projection, lazy)
+        return document
+
+    def _dereference_many(self, schema, documents, projection=None, lazy=()):
+        """
+        Dereferences a list of documents in place. All references of one level
+        are fetched with a single `$in` query per referenced collection before
+        descending into the next level. Each entity is fetched once, and
+        references back to an entity that refers to them are cut off, see
+        ReferenceGraph. Fields in `lazy` are left as they are.
+        """
+        graph = self._get_reference_graph(schema, documents, projection, lazy)
+        pending = graph.get_pending()
+        while pending is not None:
+            references, schemas, ids = pending
+            fetched = {}
+            for key, key_ids in ids.items():
+                with span(
+                    "dereference",
+                    collection=key[0],
+                    fields=self._get_field_names(references, key),
+                ):
+                    fetched[key] = self._find_by_ids(
+                        schemas[key], key_ids, key[1]
                     )
-                    for oid in document[field_name]
-                ]
-                document[field_name] = [
-                    self._dereference(field.schema, nested_document)
-                    for nested_document in nested_documents
-                ]
-            else:
-                nested_document = self._get_collection_from_schema(
-                    field.schema
-                ).find_one({"_id": ObjectId(document[field_name])})
-                document[field_name] = self._dereference(
-                    field.schema, nested_document
+            graph.add(fetched)
+            pending = graph.get_pending()
+        return graph.assign()
+
+    def _get_reference_graph(
+        self, schema, documents, projection=None, lazy=()
+    ):
+        return ReferenceGraph(
+            self, schema, documents, projection, lazy, self._max_depth
+        )
+
+    def _collect_references(
+        self, schema, documents, projection=None, lazy=()
+    ):
+        """
+        Returns the reference fields found in documents, and the schema of and
+        the ids to fetch from each referenced collection. These are keyed by
+        collection name and the projection of the referenced documents.
+        Fields left out by projection are not dereferenced.
+        """
+        references = []
+        schemas = {}
+        ids = {}
+        for document in documents:
+            if document is None:
+                continue
+            for field_name, field in self._get_reference_fields(
+                schema, document=document
+            ).items():
+                if (
+                    field_name not in document
+                    or field_name in lazy
+                    or (
+                        projection is not None
+                        and not projection.includes(field_name)
+                    )
+                ):
+                    continue
+                key = (
+                    self._get_collection_name_from_schema(field.schema),
+                    None
+                    if projection is None
+                    else projection.get_nested(field_name),
                 )
-        if "_id" in document:
-            _id = document.pop("_id")
-            document["id"] = str(_id)
-        return document
+                if field_name in self._get_options(schema).embed:
+                    self._record_embedded_reads(document[field_name])
+                schemas.setdefault(key, field.schema)
+                ids.setdefault(key, set()).update(
+                    self._get_reference_ids(document[field_name])
+                )
+                references.append((document, field_name, key))
+        return references, schemas, ids
 
-    def _get_schema_from_nested_field(self, field_name, field, obj=None):
-        reference_schema = field.schema
-        if obj is not None and hasattr(field.schema, "get_obj_type"):
-            nested_objs = getattr(obj, field_name)
-            if nested_objs:
-                if field.schema.many is True:
-                    nested_obj = nested_objs[0]
+    @staticmethod
+    def _record_embedded_reads(value):
+        values = value if isinstance(value, list) else [value]
+        record_embedding("reads", sum(isinstance(v, dict) for v in values))
+
+    @staticmethod
+    def _get_field_names(references, key):
+        return sorted(
+            {
+                field_name
+                for _, field_name, reference_key in references
+                if reference_key == key
+            }
+        )
+
+    @staticmethod
+    def _get_nested_items(field, value):
+        """
+        Returns the schema to save the referenced objects with, and the
+        referenced objects themselves.
+        """
+        if isinstance(value, list):
+            return field.schema.__class__(many=False), value
+        return field.schema, [value]
+
+    def _to_document(self, schema, obj, get_reference_id):
+        dates = {
+            k: v
+            for k, v in obj.__dict__.items()
+            if isinstance(v, datetime.datetime)
+        }
+        plan = get_plan(schema)
+        # Fields that may hold references are dumped item by item below, so
+        # that referenced objects are never dumped through, and lazy
+        # references that were never accessed are stored as they were loaded.
+        document = {**plan.get_dump_schema().dump(obj), **dates}
+        options = self._get_options(schema)
+        for field_name, reference in plan.references.items():
+            if not reference.may_reference:
+                continue
+            value = getattr(obj, field_name, missing)
+            if value is missing:
+                continue
+            if is_unloaded(value):
+                document[field_name] = value.stored_value
+                continue
+            value = unwrap(value)
+            if value is None:
+                document[field_name] = None
+                continue
+            nested_schema, items = self._get_nested_items(
+                reference.field, value
+            )
+            embed = options.embed.get(field_name)
+            embed_schema = (
+                reference.schema.__class__(only=embed) if embed else None
+            )
+            values = []
+            for item in items:
+                if is_unloaded(item):
+                    values.append(item.stored_value)
+                    continue
+                if not reference.is_entity(item):
+                    # Embedded items of a marshmallow_oneofschema schema are
+                    # stored as they are dumped
+                    values.append(nested_schema.dump(item))
+                    continue
+                # Objects loaded from embedded copies are only referenced, see
+                # Meta.embed
+                if not is_partial(item) and self._is_cascaded(
+                    options.cascade[field_name], reference, item
+                ):
+                    _id = get_reference_id(nested_schema, item)
                 else:
-                    nested_obj = nested_objs
-                reference_schema = field.schema.type_schemas[
-                    field.schema.get_obj_type(nested_obj)
+                    _id = ObjectId(item.id)
+                values.append(
+                    get_embedded_document(embed, _id, embed_schema.dump(item))
+                    if embed
+                    else _id
+                )
+            document[field_name] = (
+                values if isinstance(value, list) else values[0]
+            )
+        return document
+
+    @staticmethod
+    def _is_cascaded(policy, reference, item):
+        """
+        Returns whether item is written when the entity referencing it is
+        saved, given the cascade policy of its field, see Meta.cascade.
+        Items that aren't are stored by their id.
+        """
+        if policy in (SAVE, DELETE):
+            return True
+        if getattr(item, "id", None):
+            return False
+        if policy == REF_ONLY:
+            # Unsaved items are inserted to get an id to reference them by
+            return True
+        raise ValueError(
+            f"Can't reference the unsaved {item!r} in "
+            f"'{reference.field_name}', its cascade policy is '{NONE}'"
+        )
+
+    def _set_snapshots(self, schema, obj):
+        """
+        Records the document obj and the entities it references are stored
+        as, so that saving them only writes what changed.
+        """
+
+        def get_reference_id(nested_schema, item):
+            self._set_snapshots(nested_schema, item)
+            item_id = getattr(item, "id", None)
+            return ObjectId(item_id) if item_id else None
+
+        set_snapshot(obj, self._to_document(schema, obj, get_reference_id))
+        return obj
+
+    def _get_lookup_stages(self, schema, path=(), projection=None, lazy=()):
+        """
+        Returns the aggregation stages that join in the referenced documents
+        of schema, recursively. A schema that is already being joined is not
+        joined again; references left unresolved because of that are
+        dereferenced when loading.
+        """
+        plan = get_plan(schema)
+        embed = self._get_options(schema).embed
+        path = path + (plan.schema_class,)
+        stages = []
+        for field_name, reference in plan.references.items():
+            if (
+                not reference.may_reference
+                or field_name in embed
+                or field_name in lazy
+                or (
+                    projection is not None
+                    and not projection.includes(field_name)
+                )
+            ):
+                continue
+            nested_plan = get_plan(reference.schema)
+            if nested_plan.schema_class in path:
+                continue
+            nested_projection = (
+                projection.get_nested(field_name)
+                if projection is not None
+                else None
+            )
+            nested_stages = self._get_lookup_stages(
+                reference.schema, path, nested_projection
+            )
+            # Tells joined documents from embedded copies, see ReferenceGraph
+            nested_stages.append({"$addFields": {JOINED: True}})
+            if nested_projection is not None:
+                nested_stages.insert(
+                    0,
+                    {"$project": nested_projection.to_mongo(reference.schema)},
+                )
+            joined_field_name = f"_joined_{field_name}"
+            # Values that weren't joined, i.e. embedded documents of a
+            # marshmallow_oneofschema schema and dangling or cyclic ids, are
+            # kept as they are and left to dereferencing
+            if reference.many:
+                let = {"ids": {"$ifNull": [f"${field_name}", []]}}
+                pipeline = [
+                    {"$match": {"$expr": {"$in": ["$_id", "$$ids"]}}},
+                    *nested_stages,
                 ]
-        return reference_schema
+                # Maps over the stored list, which keeps its order and
+                # duplicates
+                joined_value = {
+                    "$cond": [
+                        {"$isArray": f"${field_name}"},
+                        {
+                            "$map": {
+                                "input": f"${field_name}",
+                                "as": "item",
+                                "in": self._get_joined_item(
+                                    joined_field_name, "$$item"
+                                ),
+                            }
+                        },
+                        f"${field_name}",
+                    ]
+                }
+            else:
+                let = {"id": f"${field_name}"}
+                pipeline = [
+                    {"$match": {"$expr": {"$eq": ["$_id", "$$id"]}}},
+                    *nested_stages,
+                ]
+                joined_value = self._get_joined_item(
+                    joined_field_name, {"$ifNull": [f"${field_name}", None]}
+                )
+            stages.extend(
+                [
+                    {
+                        "$lookup": {
+                            "from": nested_plan.collection_name,
+                            "let": let,
+                            "pipeline": pipeline,
+                            "as": joined_field_name,
+                        }
+                    },
+                    {"$addFields": {field_name: joined_value}},
+                    {"$project": {joined_field_name: 0}},
+                ]
+            )
+        return stages
+
+    @staticmethod
+    def _get_joined_item(joined_field_name, value):
+        """
+        Returns the expression of the document joined in for value, or value
+        itself if there is none.
+        """
+        return {
+            "$ifNull": [
+                {
+                    "$arrayElemAt": [
+                        {
+                            "$filter": {
+                                "input": f"${joined_field_name}",
+                                "as": "joined",
+                                "cond": {"$eq": ["$$joined._id", value]},
+                            }
+                        },
+                        0,
+                    ]
+                },
+                value,
+            ]
+        }
 
     def _get_reference_fields(self, schema, obj=None, document=None):
-        reference_fields = {}
-        for field_name, field, in schema._declared_fields.items():
-            if isinstance(field, fields.Nested):
-                reference_schema = self._get_schema_from_nested_field(
-                    field_name, field, obj
+        return get_plan(schema).get_reference_fields(
+            obj=obj, document=document
+        )
+
+    def _load(self, schema, document, trusted=False):
+        if trusted:
+            return get_trusted_loader(schema)(document)
+        return schema.load(document)
+
+    @staticmethod
+    def _get_load_schema(schema, projection=None, lazy=()):
+        if projection is None and not lazy:
+            return schema
+        schema_class = (
+            get_lazy_schema_class(schema, lazy) if lazy else schema.__class__
+        )
+        if projection is None:
+            return schema_class()
+        return schema_class(**projection.get_schema_kwargs(schema))
+
+    def _set_lazy_references(
+        self, schema, documents, lazy, trusted=False, track_changes=False
+    ):
+        """
+        Replaces the references of the fields in `lazy` by lazy references,
+        which are loaded together on first access, trusted and with change
+        tracking if so.
+        """
+        if not lazy:
+            return
+        loader = self._get_lazy_loader(trusted, track_changes)
+        references = get_plan(schema).references
+        for document in documents:
+            for field_name in lazy:
+                if document.get(field_name) is not None:
+                    document[field_name] = loader.add(
+                        references[field_name], document[field_name]
+                    )
+
+    def _get_lazy_loader(self, trusted=False, track_changes=False):
+        return LazyLoader(self, trusted, track_changes)
+
+    def _take_unresolved(
+        self, schema, documents, trusted=False, track_changes=False
+    ):
+        """
+        Takes the references dereferencing left as stored ids, i.e. cycles
+        and references beyond max_depth, out of documents, so that they can
+        be loaded. `_share_references` puts them back into the loaded objects
+        as lazy references, which are loaded like the documents.
+        """
+        unresolved = Unresolved(self._get_lazy_loader(trusted, track_changes))
+        seen = set()
+        pending = [(schema, document) for document in documents]
+        while pending:
+            schema, document = pending.pop()
+            if not isinstance(document, dict) or id(document) in seen:
+                continue
+            seen.add(id(document))
+            for field_name, reference in get_plan(schema).references.items():
+                value = document.get(field_name)
+                if isinstance(value, ObjectId):
+                    unresolved.add(
+                        document, field_name, None, reference, value
+                    )
+                    document[field_name] = None
+                    continue
+                if not isinstance(value, list):
+                    value = [value]
+                elif any(isinstance(item, ObjectId) for item in value):
+                    for index, item in enumerate(value):
+                        if isinstance(item, ObjectId):
+                            unresolved.add(
+                                document, field_name, index, reference, item
+                            )
+                    value = document[field_name] = [
+                        item
+                        for item in value
+                        if not isinstance(item, ObjectId)
+                    ]
+                pending.extend(
+                    (reference.schema, item)
+                    for item in value
+                    if isinstance(item, dict)
+                )
+        return unresolved
+
+    def _to_object(
+        self,
+        schema,
+        document,
+        projection=None,
+        lazy=(),
+        trusted=False,
+        track_changes=False,
+    ):
+        document = self._dereference(schema, document, projection, lazy)
+        self._set_lazy_references(
+            schema, [document], lazy, trusted, track_changes
+        )
+        unresolved = self._take_unresolved(
+            schema, [document], trusted, track_changes
+        )
+        obj = self._load(
+            self._get_load_schema(schema, projection, lazy), document, trusted
+        )
+        self._share_references(
+            schema, [obj], [document], projection, unresolved=unresolved
+        )
+        return obj
+
+    def _share_references(
+        self,
+        schema,
+        objs,
+        documents,
+        projection=None,
+        shared=None,
+        unresolved=None,
+    ):
+        """
+        Replaces the copies marshmallow loads of an entity referenced more
+        than once by the first one, so that all references to an entity
+        within objs, including objs themselves, are the same object. Like in
+        ReferenceGraph, entities loaded with different projections aren't the
+        same. Objects loaded from the copies embedded in documents, see
+        Meta.embed, are marked as partial instead, and aren't shared, even
+        when loaded through a repository that doesn't embed them.
+
+        The references taken out of documents by `_take_unresolved` are put
+        back as cyclic references to the objects they refer to, or as lazy
+        references if these weren't loaded.
+        """
+        if shared is None:
+            shared = {}
+        plan = get_plan(schema)
+        if plan.declares_id:
+            for obj in objs:
+                obj_id = None if obj is None else _get_value(obj, "id")
+                if obj_id is not None:
+                    shared.setdefault(
+                        (plan.collection_name, projection, obj_id), obj
+                    )
+        for obj, document in zip(objs, documents):
+            if obj is None or not isinstance(document, dict):
+                continue
+            for field_name, reference in plan.references.items():
+                value = _get_value(obj, field_name)
+                if value is None or isinstance(value, LazyReference):
+                    continue
+                items = value if isinstance(value, list) else [value]
+                nested_projection = (
+                    None
+                    if projection is None
+                    else projection.get_nested(field_name)
                 )
-                if "id" in reference_schema._declared_fields:
-                    reference_fields[field_name] = field
-                elif document:
-                    nested_objs = document[field_name]
-                    nested_obj = (
-                        nested_objs[0]
-                        if reference_schema.many is True
-                        else nested_objs
+                stored = document.get(field_name)
+                stored_items = stored if isinstance(stored, list) else [stored]
+                for index, (item, stored_item) in enumerate(
+                    zip(items, stored_items)
+                ):
+                    if isinstance(stored_item, EmbeddedCopy):
+                        mark_partial(item)
+                        continue
+                    key = (
+                        reference.collection_name,
+                        nested_projection,
+                        _get_value(item, "id"),
                     )
-                    if isinstance(nested_obj, ObjectId):
-                        """
-                        When we encounter an ObjectId in a nested document, we
-                        are assuming we are dealing with a dereferenced field.
-                        """
-                        reference_fields[field_name] = field
-        return reference_fields
-
-    def _to_object(self, schema, document):
+                    if reference.declares_id and key[2] is not None:
+                        if key in shared:
+                            if isinstance(value, list):
+                                value[index] = shared[key]
+                            else:
+                                _set_value(obj, field_name, shared[key])
+                            continue
+                        shared[key] = item
+                    self._share_references(
+                        reference.schema,
+                        [item],
+                        [stored_item],
+                        nested_projection,
+                        shared,
+                        unresolved,
+                    )
+            if unresolved is not None:
+                self._put_back_unresolved(
+                    obj, document, projection, shared, unresolved
+                )
+        return objs
+
+    @staticmethod
+    def _put_back_unresolved(obj, document, projection, shared, unresolved):
+        for field_name, index, reference, value in unresolved.pop(document):
+            key = (
+                reference.collection_name,
+                None
+                if projection is None
+                else projection.get_nested(field_name),
+                str(value),
+            )
+            if key in shared:
+                lazy_reference = CyclicReference(reference, value, shared[key])
+            else:
+                lazy_reference = unresolved.get_lazy_reference(
+                    reference, value
+                )
+            if index is None:
+                _set_value(obj, field_name, lazy_reference)
+            else:
+                _get_value(obj, field_name).insert(index, lazy_reference)
+
+
+def _get_value(obj, name):
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def _set_value(obj, name, value):
+    if isinstance(obj, dict):
+        obj[name] = value
+    else:
         try:
-            return schema.load(self._dereference(schema, document))
-        except marshmallow.exceptions.ValidationError as exc:
-            """
-            An ugly hack to support marshmallow_oneofschema.
-
-            When provided with a master schema, we don't have the
-            _declared_fields of the subschemas. Here we delete the 'id' value
-            from the document and try again.
-            """
-            if exc.messages == {"id": ["Unknown field."]} and "id" in document:
-                document.pop("id")
-                return schema.load(self._dereference(schema, document))
-            raise exc
+            setattr(obj, name, value)
+        except AttributeError:
+            # e.g. frozen dataclasses keep their own copy
+            pass
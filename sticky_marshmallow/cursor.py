@@ -1,29 +1,488 @@
+import collections
+import copy
+import itertools
+import weakref
+
 import pymongo
+from bson import json_util
+from sticky_marshmallow.cache import get_query_cache
 from sticky_marshmallow.core import Core
+from sticky_marshmallow.instrumentation import span
+from sticky_marshmallow.pagination import (
+    decode_token,
+    DEFAULT_PAGE_SIZE,
+    get_keyset_filter,
+    get_sort_keys,
+    Page,
+    split_page,
+)
+from sticky_marshmallow.plan import get_plan, get_referenced_collections
+from sticky_marshmallow.prefetch import Prefetcher
+from sticky_marshmallow.projection import Projection
+
+
+# Matches the size of the first batch returned by the MongoDB server
+DEFAULT_BATCH_SIZE = 101
+
+JOIN_SERVER = "server"
 
 
 class Cursor:
-    def __init__(self, schema, collection, filter):
+    core_class = Core
+
+    def __init__(
+        self,
+        schema,
+        collection,
+        filter,
+        join=None,
+        lazy=(),
+        track_changes=False,
+        trusted=False,
+        core=None,
+    ):
+        if join not in (None, JOIN_SERVER):
+            raise ValueError(f"Unknown join mode '{join}'")
         self._schema = schema
         self._filter = filter
         self._collection = collection
-        self._pymongo_cursor = self._collection.find(filter)
+        self._join = join
+        self._projection = None
+        self._lazy = tuple(lazy)
+        self._track_changes = track_changes
+        self._trusted = trusted
+        self._as_dicts = False
+        self._cached = False
+        self._cached_documents = None
+        self._prefetch_batches = None
+        self._prefetcher = None
+        self._prefetched = collections.deque()
+        # References are fetched through core, so that they are read from the
+        # same database as collection
+        self._core = core if core is not None else self.core_class()
+        self._load_schema = Core._get_load_schema(schema, lazy=self._lazy)
+        # With a server side join the aggregation is only built on first use,
+        # when all cursor methods are known
+        self._pymongo_cursor = (
+            None if join == JOIN_SERVER else self._collection.find(filter)
+        )
         self._method_name = None
         self._method_chain = []
+        self._batch_size = DEFAULT_BATCH_SIZE
+        self._buffer = collections.deque()
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        document = next(self._pymongo_cursor)
-        return Core()._to_object(self._schema, document)
+        if not self._buffer:
+            self._buffer.extend(self._next_batch(self._batch_size))
+        if not self._buffer:
+            raise StopIteration
+        return self._buffer.popleft()
+
+    def _next_batch(self, size):
+        """
+        Hydrates up to `size` documents at once, so that references across
+        the whole batch are resolved with one query per collection.
+        """
+        if self._prefetch_batches and not self._cached:
+            return self._next_prefetched_batch(size)
+        with span("find", collection=get_plan(self._schema).collection_name):
+            if self._cached and get_query_cache() is not None:
+                return self._next_cached_batch(size)
+            documents = list(
+                itertools.islice(self._get_pymongo_cursor(), size)
+            )
+            return self._load_documents(documents)
+
+    def _next_cached_batch(self, size):
+        """
+        Like _next_batch, but the dereferenced documents of the whole query
+        are taken from the query cache, or fetched at once and cached.
+        """
+        if self._cached_documents is None:
+            cache = get_query_cache()
+            key = self._get_cache_key()
+            documents = cache.get(key)
+            if documents is None:
+                documents = list(self._get_pymongo_cursor())
+                self._dereference_documents(documents)
+                cache.set(
+                    key,
+                    self._get_cache_collections(),
+                    documents,
+                    self._core._db_alias,
+                )
+            self._cached_documents = iter(documents)
+        return self._load_dereferenced(
+            list(itertools.islice(self._cached_documents, size))
+        )
+
+    def _next_prefetched_batch(self, size):
+        """
+        Like _next_batch, but the documents are fetched and dereferenced
+        ahead by a Prefetcher, and only loaded here.
+        """
+        if self._prefetcher is None:
+            self._prefetcher = Prefetcher(
+                self._get_batch_fetcher(), self._prefetch_batches
+            )
+            weakref.finalize(self, self._prefetcher.stop)
+        while len(self._prefetched) < size:
+            documents = self._prefetcher.get()
+            if not documents:
+                break
+            self._prefetched.extend(documents)
+        return self._load_dereferenced(
+            [
+                self._prefetched.popleft()
+                for _ in range(min(size, len(self._prefetched)))
+            ]
+        )
+
+    def _get_batch_fetcher(self):
+        # Only refers to what it needs, not to self, see Prefetcher
+        pymongo_cursor = self._get_pymongo_cursor()
+        core = self._core
+        schema = self._schema
+        projection = self._projection
+        lazy = self._lazy
+        batch_size = self._batch_size
+        collection_name = get_plan(schema).collection_name
+
+        def fetch():
+            with span("prefetch", collection=collection_name):
+                documents = list(itertools.islice(pymongo_cursor, batch_size))
+                core._dereference_many(schema, documents, projection, lazy)
+                return documents
+
+        return fetch
+
+    def _get_cache_key(self):
+        return json_util.dumps(
+            [
+                self._core._db_alias,
+                self._collection.full_name,
+                self._filter,
+                self._method_chain,
+                None
+                if self._projection is None
+                else self._projection.to_mongo(self._schema),
+                sorted(self._lazy),
+                self._join,
+            ]
+        )
+
+    def _get_cache_collections(self):
+        return {
+            get_plan(self._schema).collection_name,
+            *get_referenced_collections(self._schema, self._lazy),
+        }
+
+    def _dereference_documents(self, documents):
+        self._core._dereference_many(
+            self._schema, documents, self._projection, self._lazy
+        )
+
+    def _load_documents(self, documents):
+        self._dereference_documents(documents)
+        return self._load_dereferenced(documents)
+
+    def _load_dereferenced(self, documents):
+        core = self._core
+        if self._as_dicts:
+            return documents
+        track_changes = self._track_changes and self._projection is None
+        core._set_lazy_references(
+            self._schema, documents, self._lazy, self._trusted, track_changes
+        )
+        unresolved = core._take_unresolved(
+            self._schema, documents, self._trusted, track_changes
+        )
+        objs = core._share_references(
+            self._schema,
+            [
+                core._load(self._load_schema, document, self._trusted)
+                for document in documents
+            ],
+            documents,
+            self._projection,
+            unresolved=unresolved,
+        )
+        if self._track_changes and self._projection is None:
+            for obj in objs:
+                core._set_snapshots(self._schema, obj)
+        return objs
+
+    def paginate(self, after=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Returns the Page of up to page_size objects following the page whose
+        `next` token is `after`, in the order of sort() with _id as the
+        tie-breaker. Pages are found with a range filter on the sort fields
+        instead of by skipping documents, so deep pages are as cheap as the
+        first one. skip() and limit() are ignored.
+        """
+        with span(
+            "paginate", collection=get_plan(self._schema).collection_name
+        ):
+            cursor, sort = self._get_page_cursor(after, page_size)
+            documents, next = split_page(
+                sort, list(cursor._get_pymongo_cursor()), page_size
+            )
+            return Page(cursor._load_documents(documents), next)
+
+    def _get_page_cursor(self, after, page_size):
+        """
+        Returns a copy of this cursor that fetches the page after the token
+        `after`, plus one document to tell whether there is a next page.
+        """
+        sort = None
+        for method_name, method_args, _ in self._method_chain:
+            if method_name == "sort":
+                sort = method_args[0]
+        sort = get_sort_keys(sort)
+        if self._projection is not None:
+            for field_name, _ in sort:
+                if field_name != "_id" and not self._projection.includes(
+                    field_name.split(".")[0]
+                ):
+                    raise ValueError(
+                        f"Can't paginate on '{field_name}', which is not "
+                        "fetched"
+                    )
+        filter = self._filter
+        if after is not None:
+            filter = {
+                "$and": [
+                    filter,
+                    get_keyset_filter(sort, decode_token(sort, after)),
+                ]
+            }
+        cursor = copy.copy(self)
+        cursor._filter = filter
+        cursor._buffer = collections.deque()
+        cursor._prefetch_batches = None
+        cursor._prefetcher = None
+        cursor._prefetched = collections.deque()
+        cursor._method_chain = [
+            (method_name, method_args, kwargs)
+            for method_name, method_args, kwargs in self._method_chain
+            if method_name not in ("limit", "skip", "sort")
+        ] + [("sort", [sort], {}), ("limit", [page_size + 1], {})]
+        cursor._pymongo_cursor = None
+        if self._join is None:
+            cursor._pymongo_cursor = cursor._get_find_cursor()
+        return cursor, sort
+
+    def only(self, *fields):
+        """
+        Only fetches and loads the given fields. Dotted names reach into
+        referenced entities, e.g. `only("title", "author.name")`.
+        """
+        return self._project(Projection(fields))
+
+    def exclude(self, *fields):
+        """
+        Fetches and loads all but the given fields. Excluded references are
+        not dereferenced.
+        """
+        return self._project(Projection(fields, exclude=True))
+
+    def lazy(self, *fields):
+        """
+        Loads the references of the given fields on first access instead,
+        together with those of the other objects of the same batch.
+        """
+        self._lazy += fields
+        self._load_schema = Core._get_load_schema(
+            self._schema, self._projection, self._lazy
+        )
+        return self
+
+    def cached(self):
+        """
+        Reads the query from the registered QueryCache, or caches it. Cached
+        queries are fetched as a whole on first iteration.
+        """
+        self._cached = True
+        return self
+
+    def prefetch(self, batches=2):
+        """
+        Fetches and dereferences up to `batches` batches ahead in a worker
+        thread, while the objects of the current batch are processed. Errors
+        of the worker are raised on iteration. Call close() when not
+        iterating to the end.
+        """
+        if batches < 1:
+            raise ValueError("Prefetch at least one batch")
+        self._prefetch_batches = batches
+        return self
+
+    def close(self):
+        """
+        Stops prefetching, if any, and closes the pymongo cursor.
+        """
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+        self._prefetched.clear()
+        self._buffer.clear()
+        if self._pymongo_cursor is not None:
+            self._pymongo_cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def trusted(self):
+        """
+        Loads documents without validating them, see
+        sticky_marshmallow.trusted.
+        """
+        self._trusted = True
+        return self
+
+    def as_dicts(self):
+        """
+        Yields the dereferenced documents instead of loading them.
+        """
+        self._as_dicts = True
+        return self
+
+    def _project(self, projection):
+        self._projection = projection
+        self._load_schema = Core._get_load_schema(
+            self._schema, projection, self._lazy
+        )
+        if self._join is None:
+            self._pymongo_cursor = self._get_find_cursor()
+        return self
+
+    def _get_find_cursor(self):
+        pymongo_cursor = self._collection.find(
+            self._filter,
+            None
+            if self._projection is None
+            else self._projection.to_mongo(self._schema),
+        )
+        for method_name, method_args, kwargs in self._method_chain:
+            pymongo_cursor = getattr(pymongo_cursor, method_name)(
+                *method_args, **kwargs
+            )
+        return pymongo_cursor
+
+    def _get_pymongo_cursor(self):
+        if self._pymongo_cursor is None:
+            self._pymongo_cursor = self._collection.aggregate(
+                self._get_pipeline(), batchSize=self._batch_size
+            )
+        return self._pymongo_cursor
+
+    def _get_pipeline(self):
+        """
+        Translates the filter and cursor methods into an aggregation pipeline
+        that joins in all referenced documents.
+        """
+        return (
+            [{"$match": self._filter}]
+            + self._get_stages()
+            + self._core._get_lookup_stages(
+                self._schema, projection=self._projection, lazy=self._lazy
+            )
+        )
+
+    def _get_stages(self):
+        stages = []
+        for method_name, method_args, _ in self._method_chain:
+            if method_name == "sort":
+                stages.append({"$sort": dict(method_args[0])})
+            elif method_name == "skip":
+                stages.append({"$skip": method_args[0]})
+            elif method_name == "limit" and method_args[0]:
+                stages.append({"$limit": method_args[0]})
+        if self._projection is not None:
+            stages.append(
+                {"$project": self._projection.to_mongo(self._schema)}
+            )
+        return stages
+
+    def _get_page_with_total_pipeline(self, estimated):
+        """
+        Returns the aggregation pipeline of page_with_total, and whether it
+        counts the documents as well.
+        """
+        stages = self._get_stages()
+        if self._join == JOIN_SERVER:
+            stages += self._core._get_lookup_stages(
+                self._schema, projection=self._projection, lazy=self._lazy
+            )
+        if estimated and not self._filter:
+            return [{"$match": {}}] + stages, False
+        return (
+            [
+                {"$match": self._filter},
+                {
+                    "$facet": {
+                        "items": stages or [{"$match": {}}],
+                        "total": [{"$count": "count"}],
+                    }
+                },
+            ],
+            True,
+        )
+
+    @staticmethod
+    def _get_facet_result(results):
+        result = results[0] if results else {"items": [], "total": []}
+        total = result["total"][0]["count"] if result["total"] else 0
+        return result["items"], total
+
+    def page_with_total(self, estimated=False):
+        """
+        Returns the Page of objects selected by sort(), skip() and limit(),
+        with `total` set to the number of documents matching the filter,
+        fetched with a single aggregation. All objects of the page have to
+        fit in one 16MB document. With estimated=True an unfiltered total is
+        read from the collection metadata with estimated_document_count().
+        """
+        with span(
+            "page_with_total",
+            collection=get_plan(self._schema).collection_name,
+        ):
+            pipeline, counts = self._get_page_with_total_pipeline(estimated)
+            results = list(self._collection.aggregate(pipeline))
+            if counts:
+                documents, total = self._get_facet_result(results)
+            else:
+                documents = results
+                total = self._collection.estimated_document_count()
+            return Page(self._load_documents(documents), total=total)
+
+    def iter_batches(self, n=None):
+        """
+        Yields lists of up to `n` loaded objects.
+        """
+        size = n or self._batch_size
+        while True:
+            batch = [
+                self._buffer.popleft()
+                for _ in range(min(size, len(self._buffer)))
+            ]
+            if len(batch) < size:
+                batch.extend(self._next_batch(size - len(batch)))
+            if not batch:
+                return
+            yield batch
 
     def __getattr__(self, name, *args, **kwargs):
         """
         Guido is not a fan of method chaining:
         https://mail.python.org/pipermail/python-dev/2003-October/038855.html
         """
-        if name in ("close", "find", "limit", "skip", "sort"):
+        if name in ("batch_size", "find", "limit", "skip", "sort"):
             self._method_name = name
             return self
         raise AttributeError(
@@ -47,10 +506,14 @@ class Cursor:
             else:
                 method_args = args
 
+            if self._method_name == "batch_size":
+                self._batch_size = args[0]
+
             self._method_chain.append((self._method_name, method_args, kwargs))
-            self._pymongo_cursor = getattr(
-                self._pymongo_cursor, self._method_name
-            )(*method_args, **kwargs)
+            if self._join is None:
+                self._pymongo_cursor = getattr(
+                    self._pymongo_cursor, self._method_name
+                )(*method_args, **kwargs)
         return self
 
     def count(self):
@@ -0,0 +1,127 @@
+import collections
+import threading
+import weakref
+
+from pymongo import UpdateMany
+
+from sticky_marshmallow.plan import get_schema_class
+
+
+__all__ = ["get_embedding_stats", "reset_embedding_stats"]
+
+# Maps the collection name of entities to the schemas, reference fields and
+# copied field names of the repositories that embed copies of them, see
+# Meta.embed
+_embeddings = collections.defaultdict(dict)
+
+_stats = collections.Counter()
+_stats_lock = threading.Lock()
+
+# Holds id(obj) of the objects loaded from embedded copies
+_partial = set()
+
+
+def register_embedding(schema, reference, field_names):
+    _embeddings[reference.collection_name][
+        (get_schema_class(schema), reference.field_name, tuple(field_names))
+    ] = (schema, reference, field_names)
+
+
+def get_embeddings(collection_name):
+    """
+    Returns the (schema, reference, field names) of the fields that embed
+    copies of the entities of collection_name.
+    """
+    return list(_embeddings.get(collection_name, {}).values())
+
+
+def record(name, count=1):
+    with _stats_lock:
+        _stats[name] += count
+
+
+def get_embedding_stats():
+    """
+    Returns how many embedded copies were read instead of looked up, how
+    many bulk writes refreshed copies and how many documents they changed,
+    and how many copies were checked and found stale by
+    Repository.check_embedded.
+    """
+    with _stats_lock:
+        return {
+            name: _stats[name]
+            for name in ("reads", "refreshes", "refreshed", "checked", "stale")
+        }
+
+
+def reset_embedding_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def get_embedded_document(field_names, _id, dumped):
+    """
+    Returns the copy of field_names of a referenced entity stored in place
+    of its id.
+    """
+    return {
+        "_id": _id,
+        **{field_name: dumped.get(field_name) for field_name in field_names},
+    }
+
+
+class EmbeddedCopy(dict):
+    """
+    A referenced document as stored in place of its id, see Meta.embed,
+    rather than the entity itself. Objects loaded from one are partial.
+    """
+
+
+def mark_partial(obj):
+    """
+    Marks obj as loaded from an embedded copy. Partial objects are never
+    written when saving the entity that references them.
+    """
+    key = id(obj)
+    if key not in _partial:
+        try:
+            weakref.finalize(obj, _partial.discard, key)
+        except TypeError:
+            # Objects that can't be weakly referenced aren't marked
+            return
+        _partial.add(key)
+
+
+def is_partial(obj):
+    return id(obj) in _partial
+
+
+def is_stale(field_names, embedded, document):
+    return any(
+        embedded.get(field_name) != document.get(field_name)
+        for field_name in field_names
+    )
+
+
+def get_refresh(reference, field_names, _id, document):
+    """
+    Returns the UpdateMany that refreshes the copies of field_names of an
+    entity, stored as document, in the field of reference.
+    """
+    field_name = reference.field_name
+    if reference.many:
+        prefix = f"{field_name}.$[item]"
+        array_filters = [{"item._id": _id}]
+    else:
+        prefix = field_name
+        array_filters = None
+    return UpdateMany(
+        {f"{field_name}._id": _id},
+        {
+            "$set": {
+                f"{prefix}.{name}": document.get(name)
+                for name in field_names
+            }
+        },
+        array_filters=array_filters,
+    )
@@ -0,0 +1,196 @@
+import logging
+
+from bson import ObjectId
+
+from sticky_marshmallow.embedding import EmbeddedCopy
+from sticky_marshmallow.plan import get_plan
+
+
+logger = logging.getLogger(__name__)
+
+_VISITING = 1
+_VISITED = 2
+
+# Set on the documents joined in by a $lookup, see Core._get_lookup_stages
+JOINED = "_joined"
+
+
+class ReferenceGraph:
+    """
+    The documents of one dereferencing operation, e.g. a `get` or a cursor
+    batch. Documents are kept by the collection name and projection they
+    were fetched with and their _id, so that an entity referenced more than
+    once is fetched once, and the same document ends up in every field that
+    references it.
+
+    Levels of references are fetched in turn: `get_pending` returns what to
+    fetch, `add` takes the fetched documents. Beyond `max_depth` levels
+    nothing is fetched anymore. `assign` then puts the documents in place.
+    The documents being dereferenced are kept as well, so that a cycle back
+    to one of them ends in it. Referenced documents that were neither
+    fetched nor joined in were stored in place of their id, and become
+    EmbeddedCopy instances, whichever repository loads them.
+    """
+
+    def __init__(
+        self, core, schema, documents, projection=None, lazy=(), max_depth=None
+    ):
+        self._core = core
+        self._schema = schema
+        self._roots = documents
+        self._max_depth = max_depth
+        self._documents = {}
+        root_key = (get_plan(schema).collection_name, projection)
+        for document in documents:
+            if document is not None and "_id" in document:
+                self._documents[(root_key, document["_id"])] = document
+        # The (key, _id) of references beyond max_depth
+        self._unfetched = set()
+        self._schemas = {}
+        # Maps id() of each document to its (field name, key) references
+        self._references = {}
+        self._states = {}
+        self._level = [(schema, documents, projection, lazy)]
+        self._pending = None
+        self.depth = 0
+        self.truncated = False
+        self.cycles = 0
+        self._collection_name = get_plan(schema).collection_name
+
+    def get_pending(self):
+        """
+        Returns the references of the next level and, per referenced
+        collection, the schema and the ids that weren't fetched before. None
+        when there are no references left.
+        """
+        if not self._level:
+            return None
+        references = []
+        schemas = {}
+        ids = {}
+        for schema, documents, projection, lazy in self._level:
+            (
+                level_references,
+                level_schemas,
+                level_ids,
+            ) = self._core._collect_references(
+                schema, documents, projection, lazy
+            )
+            references.extend(level_references)
+            for key, key_ids in level_ids.items():
+                schemas.setdefault(key, level_schemas[key])
+                self._schemas.setdefault(key, level_schemas[key])
+                ids.setdefault(key, set()).update(key_ids)
+        for document, field_name, key in references:
+            self._references.setdefault(id(document), []).append(
+                (field_name, key)
+            )
+        ids = {
+            key: [_id for _id in key_ids if (key, _id) not in self._documents]
+            for key, key_ids in ids.items()
+        }
+        ids = {key: key_ids for key, key_ids in ids.items() if key_ids}
+        if (
+            ids
+            and self._max_depth is not None
+            and self.depth >= self._max_depth
+        ):
+            self.truncated = True
+            self._unfetched.update(
+                (key, _id) for key, key_ids in ids.items() for _id in key_ids
+            )
+            ids = {}
+        self._level = []
+        self._pending = (references, schemas)
+        return references, schemas, ids
+
+    def add(self, fetched):
+        """
+        Adds the documents fetched for the pending level, per key. These and
+        the documents that were already embedded (e.g. by a `$lookup`) make
+        up the next level.
+        """
+        references, schemas = self._pending
+        level = {}
+        for key, documents in fetched.items():
+            for _id, document in documents.items():
+                self._documents[(key, _id)] = document
+                level.setdefault(key, {})[id(document)] = document
+        for document, field_name, key in references:
+            value = document[field_name]
+            items = value if isinstance(value, list) else [value]
+            for index, item in enumerate(items):
+                if not isinstance(item, dict):
+                    continue
+                if not item.pop(JOINED, False) and "_id" in item:
+                    item = items[index] = EmbeddedCopy(item)
+                level.setdefault(key, {})[id(item)] = item
+            if not isinstance(value, list):
+                document[field_name] = items[0]
+        self._level = [
+            (schemas[key], list(documents.values()), key[1], ())
+            for key, documents in level.items()
+        ]
+        self.depth += 1
+
+    def assign(self):
+        """
+        Replaces the references in the documents by the fetched documents,
+        depth first. References to a document that is still being assigned
+        (i.e. cycles) and references beyond max_depth are left as their
+        stored ids, see Core._take_unresolved. Dangling references are
+        dropped from lists and replaced by None otherwise.
+        """
+        for document in self._roots:
+            if document is not None and id(document) not in self._states:
+                self._visit(document, self._schema)
+        if self.truncated:
+            logger.warning(
+                "Stopped dereferencing '%s' at the maximum depth of %d",
+                self._collection_name,
+                self._max_depth,
+            )
+        if self.cycles:
+            logger.debug(
+                "Cut off %d cyclic references of '%s'",
+                self.cycles,
+                self._collection_name,
+            )
+        return self._roots
+
+    def _visit(self, document, schema):
+        self._states[id(document)] = _VISITING
+        for field_name, key in self._references.pop(id(document), ()):
+            value = document[field_name]
+            if isinstance(value, list):
+                items = (self._resolve(item, key) for item in value)
+                document[field_name] = [
+                    item for item in items if item is not None
+                ]
+            else:
+                document[field_name] = self._resolve(value, key)
+        if "_id" in document:
+            _id = document.pop("_id")
+            # Schemas without an id, e.g. some types of a
+            # marshmallow_oneofschema schema, would fail on an unknown field
+            if get_plan(schema).loads_id(document):
+                document["id"] = str(_id)
+        self._states[id(document)] = _VISITED
+
+    def _resolve(self, value, key):
+        if value is None:
+            return None
+        if isinstance(value, dict):
+            document = value
+        else:
+            _id = ObjectId(value)
+            document = self._documents.get((key, _id))
+            if document is None:
+                return _id if (key, _id) in self._unfetched else None
+        state = self._states.get(id(document))
+        if state == _VISITING:
+            self.cycles += 1
+            return document.get("_id")
+        if state is None:
+            self._visit(document, self._schemas[key])
+        return document
@@ -0,0 +1,201 @@
+import threading
+import warnings
+
+import pymongo
+
+
+__all__ = ["ensure_indexes", "UnindexedFilterWarning"]
+
+# Repository classes with a schema, in order of definition
+_repositories = []
+
+# Maps (db alias, collection name) to the keys of the collection's indexes
+_index_keys = {}
+_index_keys_lock = threading.Lock()
+
+
+class UnindexedFilterWarning(UserWarning):
+    pass
+
+
+def register_repository(repository_class):
+    _repositories.append(repository_class)
+
+
+def get_index_model(spec):
+    """
+    Returns the pymongo.IndexModel of an index in Meta.indexes, which is
+    either an IndexModel, a field name, a list of field names or a dict of
+    `fields` and IndexModel options such as unique, expireAfterSeconds or
+    partialFilterExpression. Field names prefixed with "-" are descending,
+    (field name, index type) tuples are passed on as they are.
+    """
+    if isinstance(spec, pymongo.IndexModel):
+        return spec
+    if isinstance(spec, str):
+        spec = {"fields": [spec]}
+    elif isinstance(spec, (list, tuple)):
+        spec = {"fields": spec}
+    options = dict(spec)
+    keys = [_get_index_key(field) for field in options.pop("fields")]
+    return pymongo.IndexModel(keys, **options)
+
+
+def _get_index_key(field):
+    if isinstance(field, tuple):
+        return field
+    direction = (
+        pymongo.DESCENDING if field.startswith("-") else pymongo.ASCENDING
+    )
+    field_name = field.lstrip("-")
+    return ("_id" if field_name == "id" else field_name, direction)
+
+
+def get_index_models(meta):
+    """
+    Returns the index models declared by a repository's Meta, starting with
+    a unique index on the primary key fields unless Meta.unique_primary_key
+    is False.
+    """
+    models = []
+    primary_key = getattr(meta, "primary_key", ["id"])
+    if list(primary_key) != ["id"] and getattr(
+        meta, "unique_primary_key", True
+    ):
+        models.append(
+            pymongo.IndexModel(
+                [_get_index_key(field) for field in primary_key], unique=True
+            )
+        )
+    models.extend(
+        get_index_model(spec) for spec in getattr(meta, "indexes", ())
+    )
+    return models
+
+
+def get_pending_indexes(repositories, is_async=False):
+    """
+    Returns the collection and the index models by name of each (db alias,
+    collection name) of the given repositories, or of all repository classes
+    defined so far that are async if is_async or synchronous if not.
+    """
+    if repositories is None:
+        repositories = [
+            repository
+            for repository in _repositories
+            if repository._is_async == is_async
+        ]
+    pending = {}
+    for repository in repositories:
+        if isinstance(repository, type):
+            repository = repository()
+        if repository._is_async != is_async:
+            raise TypeError(
+                f"{type(repository).__name__} is "
+                f"{'not ' if is_async else ''}async, use "
+                f"sticky_marshmallow.{'indexes' if is_async else 'aio'}"
+                ".ensure_indexes instead"
+            )
+        collection = repository.collection
+        key = (repository.Meta.db_alias, collection.name)
+        models = pending.setdefault(key, (collection, {}))[1]
+        for model in get_index_models(repository.Meta):
+            models.setdefault(model.document["name"], model)
+    return pending
+
+
+def get_missing_indexes(models, index_information):
+    return [
+        model
+        for name, model in models.items()
+        if name not in index_information
+    ]
+
+
+def ensure_indexes(repositories=None):
+    """
+    Creates the indexes of the given repositories, or of all repository
+    classes defined so far, that don't exist yet. Indexes of repositories
+    sharing a collection are created together, with one command per
+    collection. Returns the names of the created indexes per collection.
+    Async repositories are left to sticky_marshmallow.aio.ensure_indexes.
+    """
+    created = {}
+    for key, (collection, models) in get_pending_indexes(
+        repositories
+    ).items():
+        missing = get_missing_indexes(models, collection.index_information())
+        if missing:
+            created[collection.name] = collection.create_indexes(missing)
+        forget_index_keys(key)
+    return created
+
+
+def forget_index_keys(key):
+    with _index_keys_lock:
+        _index_keys.pop(key, None)
+
+
+def get_cached_index_keys(db_alias, collection_name):
+    """
+    Returns the index keys fetched before for the collection, or None.
+    """
+    with _index_keys_lock:
+        return _index_keys.get((db_alias, collection_name))
+
+
+def set_index_keys(db_alias, collection_name, index_information):
+    """
+    Caches and returns the field names of each index in index_information.
+    """
+    index_keys = [
+        [field_name for field_name, _ in list(index["key"])]
+        for index in index_information.values()
+    ]
+    with _index_keys_lock:
+        _index_keys[(db_alias, collection_name)] = index_keys
+    return index_keys
+
+
+def get_index_keys(db_alias, collection):
+    """
+    Returns the field names of each index of collection, fetched once.
+    """
+    index_keys = get_cached_index_keys(db_alias, collection.name)
+    if index_keys is None:
+        index_keys = set_index_keys(
+            db_alias, collection.name, collection.index_information()
+        )
+    return index_keys
+
+
+def is_supported(filter, index_keys):
+    """
+    Returns whether an index can be used for filter, i.e. whether the first
+    field of any index is filtered on. Empty filters and filters on
+    operators only are considered supported.
+    """
+    field_names = {
+        "_id" if field_name == "id" else field_name
+        for field_name in filter
+        if not field_name.startswith("$")
+    }
+    if not field_names:
+        return True
+    return any(keys and keys[0] in field_names for keys in index_keys)
+
+
+def check_filter(db_alias, collection, filter):
+    warn_unindexed(
+        collection.name, filter, get_index_keys(db_alias, collection)
+    )
+
+
+def warn_unindexed(collection_name, filter, index_keys, stacklevel=5):
+    if not is_supported(filter, index_keys):
+        warnings.warn(
+            f"No index of '{collection_name}' supports the filter on "
+            f"{sorted(filter)}",
+            UnindexedFilterWarning,
+            stacklevel=stacklevel,
+        )
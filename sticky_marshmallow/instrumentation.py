@@ -0,0 +1,271 @@
+import collections
+import contextlib
+import contextvars
+import threading
+import time
+import warnings
+
+from pymongo import monitoring
+
+
+__all__ = [
+    "CommandListener",
+    "get_instrumentation",
+    "Instrumentation",
+    "NPlusOneError",
+    "NPlusOneWarning",
+    "register_instrumentation",
+    "span",
+]
+
+_instrumentation = None
+
+_current_span = contextvars.ContextVar("sticky_marshmallow_span", default=None)
+
+_no_span = contextlib.nullcontext()
+
+
+def get_instrumentation():
+    return _instrumentation
+
+
+def register_instrumentation(instrumentation):
+    """
+    Registers the instrumentation that records the spans of all repositories.
+    Pass None to disable it.
+    """
+    global _instrumentation
+    _instrumentation = instrumentation
+
+
+def span(name, **attributes):
+    """
+    Opens a span of the registered instrumentation, if any. Spans nest, and
+    a span without a parent is one logical operation for N+1 detection, so
+    e.g. a request handler can be wrapped in a span of its own.
+    """
+    if _instrumentation is None:
+        return _no_span
+    return _instrumentation.span(name, **attributes)
+
+
+def record_query_by_id(collection_name):
+    if _instrumentation is not None:
+        _instrumentation.record_query_by_id(collection_name)
+
+
+class NPlusOneWarning(UserWarning):
+    pass
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+class Span:
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.root = self if parent is None else parent.root
+        self.commands = 0
+        self.seconds = None
+        # Only kept on root spans
+        self.queries_by_id = collections.Counter()
+
+    def __repr__(self):
+        return f"<Span {self.name} {self.attributes!r}>"
+
+
+class Instrumentation:
+    """
+    Records the number and duration of sticky-marshmallow's operations and
+    of the MongoDB commands sent through a client created with
+    CommandListener, e.g.
+
+        connect("test", event_listeners=[CommandListener()])
+
+    When one logical operation queries a collection by _id more than
+    `max_queries_by_id` times, an NPlusOneWarning is emitted, or with
+    `strict` an NPlusOneError is raised before the query is sent.
+    """
+
+    def __init__(
+        self, max_queries_by_id=None, strict=False, clock=time.perf_counter
+    ):
+        self.max_queries_by_id = max_queries_by_id
+        self.strict = strict
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pending_commands = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.operations = collections.defaultdict(
+                lambda: {"count": 0, "seconds": 0.0, "commands": 0}
+            )
+            self.commands = collections.defaultdict(
+                lambda: {"count": 0, "seconds": 0.0, "failures": 0}
+            )
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                "operations": {
+                    name: dict(stats)
+                    for name, stats in self.operations.items()
+                },
+                "commands": {
+                    f"{command_name} {collection_name}": dict(stats)
+                    for (
+                        command_name,
+                        collection_name,
+                    ), stats in self.commands.items()
+                },
+            }
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        span = Span(name, attributes, _current_span.get())
+        token = _current_span.set(span)
+        started = self._clock()
+        try:
+            yield span
+        finally:
+            span.seconds = self._clock() - started
+            _current_span.reset(token)
+            with self._lock:
+                stats = self.operations[name]
+                stats["count"] += 1
+                stats["seconds"] += span.seconds
+                stats["commands"] += span.commands
+
+    def record_query_by_id(self, collection_name):
+        current_span = _current_span.get()
+        if current_span is None or self.max_queries_by_id is None:
+            return
+        root = current_span.root
+        root.queries_by_id[collection_name] += 1
+        count = root.queries_by_id[collection_name]
+        if count <= self.max_queries_by_id:
+            return
+        message = (
+            f"'{root.name}' queried '{collection_name}' by _id {count} times, "
+            f"more than the maximum of {self.max_queries_by_id}"
+        )
+        if self.strict:
+            raise NPlusOneError(message)
+        # Only warn once per operation and collection
+        if count == self.max_queries_by_id + 1:
+            warnings.warn(message, NPlusOneWarning, stacklevel=2)
+
+    def command_started(self, event):
+        command_name = event.command_name
+        collection_name = event.command.get(
+            "collection" if command_name == "getMore" else command_name
+        )
+        if not isinstance(collection_name, str):
+            collection_name = ""
+        current_span = _current_span.get()
+        while current_span is not None:
+            current_span.commands += 1
+            current_span = current_span.parent
+        with self._lock:
+            self._pending_commands[
+                (event.connection_id, event.request_id)
+            ] = (command_name, collection_name)
+
+    def command_finished(self, event, failed=False):
+        with self._lock:
+            key = self._pending_commands.pop(
+                (event.connection_id, event.request_id), None
+            )
+            if key is None:
+                return
+            stats = self.commands[key]
+            stats["count"] += 1
+            stats["seconds"] += event.duration_micros / 1e6
+            if failed:
+                stats["failures"] += 1
+
+    def to_prometheus(self, prefix="sticky_marshmallow"):
+        """
+        Returns the recorded counters in the Prometheus text format.
+        """
+        stats = self.stats
+        lines = []
+        metrics = [
+            ("operations_total", "Operations", "operations", "count"),
+            (
+                "operation_seconds_total",
+                "Time spent in operations",
+                "operations",
+                "seconds",
+            ),
+            (
+                "operation_commands_total",
+                "Commands sent by operations",
+                "operations",
+                "commands",
+            ),
+            ("commands_total", "Commands", "commands", "count"),
+            (
+                "command_seconds_total",
+                "Time spent in commands",
+                "commands",
+                "seconds",
+            ),
+            (
+                "command_failures_total",
+                "Failed commands",
+                "commands",
+                "failures",
+            ),
+        ]
+        for name, description, kind, stat in metrics:
+            name = f"{prefix}_{name}"
+            lines.append(f"# HELP {name} {description}.")
+            lines.append(f"# TYPE {name} counter")
+            for key, values in sorted(stats[kind].items()):
+                if kind == "operations":
+                    labels = {"operation": key}
+                else:
+                    command_name, _, collection_name = key.partition(" ")
+                    labels = {
+                        "command": command_name,
+                        "collection": collection_name,
+                    }
+                lines.append(
+                    f"{name}{{{_format_labels(labels)}}} {values[stat]}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    return ",".join(
+        '{}="{}"'.format(
+            k,
+            v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for k, v in labels.items()
+    )
+
+
+class CommandListener(monitoring.CommandListener):
+    """
+    Passes the commands of a client on to the registered instrumentation.
+    """
+
+    def started(self, event):
+        if _instrumentation is not None:
+            _instrumentation.command_started(event)
+
+    def succeeded(self, event):
+        if _instrumentation is not None:
+            _instrumentation.command_finished(event)
+
+    def failed(self, event):
+        if _instrumentation is not None:
+            _instrumentation.command_finished(event, failed=True)
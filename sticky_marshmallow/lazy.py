@@ -0,0 +1,234 @@
+from bson import ObjectId
+from marshmallow import fields
+
+from sticky_marshmallow.plan import get_schema_class
+
+
+_lazy_schemas = {}
+
+
+def get_lazy_schema_class(schema, field_names):
+    """
+    Returns a subclass of schema that passes the values of field_names
+    through as they are, so that lazy references end up in the loaded object.
+    """
+    schema_class = get_schema_class(schema)
+    key = (schema_class, frozenset(field_names))
+    try:
+        return _lazy_schemas[key]
+    except KeyError:
+        lazy_schema_class = _lazy_schemas[key] = type(
+            schema_class.__name__,
+            (schema_class,),
+            {
+                field_name: fields.Raw(allow_none=True)
+                for field_name in field_names
+            },
+        )
+        return lazy_schema_class
+
+
+def is_unloaded(value):
+    """
+    Whether value is stored as it was loaded when saving, i.e. a lazy
+    reference that was never accessed, or a cyclic reference.
+    """
+    if isinstance(value, CyclicReference):
+        return True
+    return isinstance(value, LazyReference) and not value.is_loaded
+
+
+def unwrap(value):
+    """
+    Returns the value a loaded lazy reference stands in for.
+    """
+    if isinstance(value, LazyReference):
+        return value._resolve()
+    return value
+
+
+class LazyLoader:
+    """
+    Loads the lazy references created while loading one batch of documents.
+    The first lazy reference accessed loads all others that are still
+    pending, with one query per referenced collection. Entities are loaded
+    like the batch: trusted, with change tracking and sharing the objects
+    of entities referenced more than once.
+    """
+
+    def __init__(self, core, trusted=False, track_changes=False):
+        self._core = core
+        self._trusted = trusted
+        self._track_changes = track_changes
+        self._pending = []
+
+    def add(self, reference, value, many=None):
+        if many is None:
+            many = reference.many
+        lazy_class = LazyList if many else LazyReference
+        lazy_reference = lazy_class(self, reference, value)
+        self._pending.append(lazy_reference)
+        return lazy_reference
+
+    def load(self):
+        pending, self._pending = self._pending, []
+        schemas = {}
+        ids = {}
+        for lazy_reference in pending:
+            collection_name = lazy_reference.reference.collection_name
+            schemas.setdefault(
+                collection_name, lazy_reference.reference.schema
+            )
+            ids.setdefault(collection_name, set()).update(lazy_reference.ids)
+
+        core = self._core
+        objs = {}
+        shared = {}
+        for collection_name, collection_ids in ids.items():
+            schema = schemas[collection_name]
+            found = core._find_by_ids(schema, collection_ids)
+            documents = list(found.values())
+            core._dereference_many(schema, documents)
+            item_schema = schema.__class__()
+            unresolved = core._take_unresolved(
+                item_schema, documents, self._trusted, self._track_changes
+            )
+            loaded = core._share_references(
+                item_schema,
+                [
+                    core._load(item_schema, document, self._trusted)
+                    for document in documents
+                ],
+                documents,
+                shared=shared,
+                unresolved=unresolved,
+            )
+            for _id, obj in zip(found, loaded):
+                if self._track_changes:
+                    core._set_snapshots(item_schema, obj)
+                objs[(collection_name, _id)] = obj
+
+        for lazy_reference in pending:
+            collection_name = lazy_reference.reference.collection_name
+            lazy_reference._set_value(
+                [
+                    objs[(collection_name, _id)]
+                    for _id in lazy_reference.ids
+                    if (collection_name, _id) in objs
+                ]
+            )
+
+
+class LazyReference:
+    """
+    Stands in for a referenced entity until it is first accessed.
+    """
+
+    def __init__(self, loader, reference, value):
+        self.__dict__.update(
+            _loader=loader,
+            reference=reference,
+            stored_value=value,
+            ids=self._get_ids(value),
+            is_loaded=False,
+            _value=None,
+        )
+
+    @staticmethod
+    def _get_ids(value):
+        return [ObjectId(value)]
+
+    def _set_value(self, objs):
+        self.__dict__.update(_value=objs[0] if objs else None, is_loaded=True)
+
+    def _resolve(self):
+        if not self.is_loaded:
+            if self._loader is None:
+                raise RuntimeError(
+                    f"Can't load the reference to {self.stored_value!r} "
+                    f"in '{self.reference.field_name}' lazily"
+                )
+            self._loader.load()
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+    def __eq__(self, other):
+        return unwrap(self) == unwrap(other)
+
+    def __bool__(self):
+        return bool(self._resolve())
+
+    def __repr__(self):
+        if self.is_loaded:
+            return repr(self._value)
+        return f"<{self.__class__.__name__} {self.stored_value!r}>"
+
+
+class CyclicReference(LazyReference):
+    """
+    Stands in for an entity referenced by itself, or by an entity it
+    references, and resolves to the object it was loaded as. It is saved as
+    the id it was stored as, the entity itself is saved through the
+    reference it was loaded by.
+    """
+
+    def __init__(self, reference, value, obj):
+        super().__init__(None, reference, value)
+        self._set_value([obj])
+
+
+class Unresolved:
+    """
+    The references left as stored ids by dereferencing, i.e. cycles and
+    references beyond max_depth, taken out of documents to load them. See
+    Core._take_unresolved and Core._share_references.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        # Maps id() of each document to its (field name, index, reference,
+        # stored id), with an index for the items of lists
+        self._references = {}
+
+    def add(self, document, field_name, index, reference, value):
+        self._references.setdefault(id(document), []).append(
+            (field_name, index, reference, value)
+        )
+
+    def pop(self, document):
+        return self._references.pop(id(document), ())
+
+    def get_lazy_reference(self, reference, value):
+        if self.loader is None:
+            return LazyReference(None, reference, value)
+        return self.loader.add(reference, value, many=False)
+
+
+class LazyList(LazyReference):
+    """
+    Stands in for a list of referenced entities until it is first accessed.
+    """
+
+    @staticmethod
+    def _get_ids(value):
+        return [ObjectId(oid) for oid in value]
+
+    def _set_value(self, objs):
+        self.__dict__.update(_value=objs, is_loaded=True)
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __len__(self):
+        return len(self._resolve())
+
+    def __getitem__(self, index):
+        return self._resolve()[index]
+
+    def __setitem__(self, index, value):
+        self._resolve()[index] = value
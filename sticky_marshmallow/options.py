@@ -0,0 +1,110 @@
+from sticky_marshmallow.plan import CASCADES, get_plan, get_schema_class, SAVE
+
+
+# Maps schema classes to the options of the first repository defined for
+# them, which apply where their entities are nested in those of another
+# schema
+_options = {}
+
+_defaults = {}
+
+
+class Options:
+    """
+    The settings of a repository's Meta that change how the entities of its
+    schema are saved and loaded. Unlike the SchemaPlan, which only reflects
+    the schema, they belong to the repository, so that repositories sharing
+    a schema keep their own.
+    """
+
+    def __init__(
+        self, schema, primary_key=("id",), cascade=None, embed=None
+    ):
+        self.schema_class = get_schema_class(schema)
+        self.primary_key = list(primary_key)
+        self.cascade = self._get_cascade(cascade or {})
+        self.embed = self._get_embed(embed or {})
+
+    @classmethod
+    def from_meta(cls, meta):
+        return cls(
+            meta.schema,
+            getattr(meta, "primary_key", ["id"]),
+            getattr(meta, "cascade", None),
+            getattr(meta, "embed", None),
+        )
+
+    def _get_cascade(self, cascade):
+        """
+        Returns the cascade policy of each reference field, given as a dict of
+        field names and policies. Fields left out are saved with their entity.
+        """
+        references = get_plan(self.schema_class).references
+        for field_name, policy in cascade.items():
+            if field_name not in references:
+                raise ValueError(
+                    f"'{field_name}' isn't a reference field of "
+                    f"{self.schema_class.__name__}"
+                )
+            if policy not in CASCADES:
+                raise ValueError(
+                    f"Unknown cascade policy '{policy}' of '{field_name}', "
+                    f"expected one of {', '.join(CASCADES)}"
+                )
+        return {
+            field_name: cascade.get(field_name, SAVE)
+            for field_name in references
+        }
+
+    def _get_embed(self, embed):
+        """
+        Returns the fields of the referenced entities to store copies of next
+        to their ids, given as a dict of reference field names and lists of
+        field names of the referenced schema.
+        """
+        references = get_plan(self.schema_class).references
+        for field_name, field_names in embed.items():
+            reference = references.get(field_name)
+            if reference is None or not reference.declares_id:
+                raise ValueError(
+                    f"'{field_name}' isn't a reference field of "
+                    f"{self.schema_class.__name__} with an id"
+                )
+            unknown = set(field_names) - set(
+                reference.schema._declared_fields
+            )
+            if unknown or "id" in field_names:
+                raise ValueError(
+                    f"Can't embed {sorted(unknown or ['id'])} of "
+                    f"'{field_name}'"
+                )
+        return {
+            field_name: list(field_names)
+            for field_name, field_names in embed.items()
+            if field_names
+        }
+
+    def get_cascaded_fields(self, policy):
+        return [
+            field_name
+            for field_name, field_policy in self.cascade.items()
+            if field_policy == policy
+        ]
+
+
+def register_options(options):
+    _options.setdefault(options.schema_class, options)
+
+
+def get_options(schema):
+    """
+    Returns the options of the first repository defined for schema, or the
+    defaults if there is none.
+    """
+    schema_class = get_schema_class(schema)
+    options = _options.get(schema_class)
+    if options is None:
+        options = _defaults.get(schema_class)
+        if options is None:
+            options = _defaults[schema_class] = Options(schema_class)
+    return options
@@ -0,0 +1,118 @@
+import base64
+import binascii
+
+import pymongo
+from bson import json_util
+
+
+DEFAULT_PAGE_SIZE = 20
+
+
+class Page:
+    """
+    A page of loaded objects. `next` is the continuation token of the
+    following page, None on the last page. `total` is the number of matching
+    documents, if it was counted.
+    """
+
+    def __init__(self, items, next=None, total=None):
+        self.items = items
+        self.next = next
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return f"<Page of {len(self.items)} next={self.next!r}>"
+
+
+def get_sort_keys(sort):
+    """
+    Returns the sort keys, ending with _id as the tie-breaker.
+    """
+    sort = list(sort or [])
+    if "_id" not in [field_name for field_name, _ in sort]:
+        direction = sort[-1][1] if sort else pymongo.ASCENDING
+        sort.append(("_id", direction))
+    return sort
+
+
+def get_value(document, field_name):
+    value = document
+    for name in field_name.split("."):
+        value = value.get(name) if isinstance(value, dict) else None
+    return value
+
+
+def encode_token(sort, document):
+    return base64.urlsafe_b64encode(
+        json_util.dumps(
+            {
+                "sort": sort,
+                "after": [
+                    get_value(document, field_name) for field_name, _ in sort
+                ],
+            }
+        ).encode()
+    ).decode()
+
+
+def decode_token(sort, token):
+    """
+    Returns the sort values a token continues after. Raises ValueError for
+    tokens that weren't returned for the same sort.
+    """
+    try:
+        data = json_util.loads(base64.urlsafe_b64decode(token.encode()))
+    except (binascii.Error, ValueError, TypeError, AttributeError):
+        raise ValueError("Invalid continuation token")
+    if not isinstance(data, dict) or [list(key) for key in sort] != data.get(
+        "sort"
+    ):
+        raise ValueError("Continuation token of a different sort")
+    return data["after"]
+
+
+def split_page(sort, documents, page_size):
+    """
+    Returns the documents of a page, fetched with one document extra, and
+    the token of the next page.
+    """
+    if len(documents) > page_size:
+        documents = documents[:page_size]
+        return documents, encode_token(sort, documents[-1])
+    return documents, None
+
+
+def get_keyset_filter(sort, values):
+    """
+    Returns the filter for the documents sorted after values. Null and
+    missing values sort before all others, but aren't matched by $gt or $lt.
+    """
+    clauses = []
+    for index, (field_name, direction) in enumerate(sort):
+        equal = {
+            previous_field_name: value
+            for (previous_field_name, _), value in zip(
+                sort[:index], values[:index]
+            )
+        }
+        value = values[index]
+        if direction == pymongo.ASCENDING:
+            condition = {"$gt": value} if value is not None else {"$ne": None}
+            clauses.append({**equal, field_name: condition})
+        # Nothing sorts after null in descending order, only its ties follow
+        elif value is not None:
+            clauses.append({**equal, field_name: {"$lt": value}})
+            if field_name != "_id":
+                clauses.append({**equal, field_name: None})
+    return {"$or": clauses}
+
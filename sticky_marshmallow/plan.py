@@ -0,0 +1,180 @@
+import inspect
+
+from bson import ObjectId
+from marshmallow import fields
+
+from sticky_marshmallow.utils.case import snake_case
+
+
+_plans = {}
+
+# Cascade policies of reference fields, see Meta.cascade
+SAVE = "save"
+REF_ONLY = "ref_only"
+DELETE = "delete"
+NONE = "none"
+CASCADES = (SAVE, REF_ONLY, DELETE, NONE)
+
+
+def get_schema_class(schema):
+    # Allows both the schema class and an instance to be passed
+    return schema if inspect.isclass(schema) else schema.__class__
+
+
+def get_plan(schema):
+    schema_class = get_schema_class(schema)
+    try:
+        return _plans[schema_class]
+    except KeyError:
+        plan = _plans[schema_class] = SchemaPlan(schema_class)
+        return plan
+
+
+def get_referenced_collections(schema, lazy=()):
+    """
+    Returns the names of the collections that documents of schema may
+    reference, directly or through other references, except through the
+    fields in lazy.
+    """
+    collection_names = set()
+    seen = set()
+    pending = [(get_schema_class(schema), lazy)]
+    while pending:
+        schema_class, lazy = pending.pop()
+        if schema_class in seen:
+            continue
+        seen.add(schema_class)
+        for field_name, reference in get_plan(schema_class).references.items():
+            if field_name in lazy:
+                continue
+            if reference.may_reference:
+                collection_names.add(reference.collection_name)
+            for nested_schema in [reference.schema] + list(
+                getattr(reference.schema, "type_schemas", {}).values()
+            ):
+                pending.append((get_schema_class(nested_schema), ()))
+    return collection_names
+
+
+class Reference:
+    """
+    A `fields.Nested` field of a schema whose values may be stored in their
+    own collection.
+    """
+
+    def __init__(self, field_name, field):
+        self.field_name = field_name
+        self.field = field
+        self.schema = field.schema
+        self.many = self.schema.many is True
+        self.collection_name = get_plan(self.schema).collection_name
+        self.declares_id = "id" in self.schema._declared_fields
+        # Maps the types of a marshmallow_oneofschema schema to whether their
+        # schema declares an id
+        self.type_schemas = {
+            type_name: "id" in type_schema._declared_fields
+            for type_name, type_schema in getattr(
+                self.schema, "type_schemas", {}
+            ).items()
+        }
+
+    @property
+    def may_reference(self):
+        """
+        Whether values of this field are stored as references at all.
+        """
+        return self.declares_id or any(self.type_schemas.values())
+
+    def is_entity(self, obj):
+        """
+        Whether obj is stored in a collection of its own rather than embedded.
+        With marshmallow_oneofschema this depends on the type of each object.
+        """
+        if self.declares_id:
+            return True
+        return bool(self.type_schemas.get(self.schema.get_obj_type(obj)))
+
+    def is_reference(self, obj=None, document=None):
+        if self.declares_id:
+            return True
+        if obj is not None and self.type_schemas:
+            nested_objs = getattr(obj, self.field_name)
+            if nested_objs:
+                nested_objs = nested_objs if self.many else [nested_objs]
+                if any(map(self.is_entity, nested_objs)):
+                    return True
+        if document:
+            nested_objs = document.get(self.field_name)
+            if nested_objs:
+                nested_objs = nested_objs if self.many else [nested_objs]
+                """
+                When we encounter an ObjectId in a nested document, we are
+                assuming we are dealing with a dereferenced field. An embedded
+                document with an _id was joined in by a $lookup. Lists of a
+                marshmallow_oneofschema schema may mix both with embedded
+                documents.
+                """
+                if any(
+                    isinstance(nested_obj, ObjectId)
+                    or (isinstance(nested_obj, dict) and "_id" in nested_obj)
+                    for nested_obj in nested_objs
+                ):
+                    return True
+        return False
+
+
+class SchemaPlan:
+    """
+    Everything sticky-marshmallow needs to know about a schema to persist
+    it, worked out once per schema class.
+    """
+
+    def __init__(self, schema_class):
+        self.schema_class = schema_class
+        self.collection_name = snake_case(
+            schema_class.__name__.replace("Schema", "")
+        )
+        self.declares_id = "id" in schema_class._declared_fields
+        # The type schemas of a marshmallow_oneofschema schema
+        self.type_schemas = getattr(schema_class, "type_schemas", None)
+        self.references = {}
+        self._dump_schema = None
+        _plans[schema_class] = self
+        for field_name, field in schema_class._declared_fields.items():
+            if isinstance(field, fields.Nested):
+                self.references[field_name] = Reference(field_name, field)
+
+    def loads_id(self, document):
+        """
+        Whether document is loaded with a schema that declares an id. For a
+        marshmallow_oneofschema schema, that is the schema of the type stored
+        in the document.
+        """
+        if self.type_schemas is None:
+            return self.declares_id
+        type_schema = self.type_schemas.get(
+            document.get(self.schema_class.type_field)
+        )
+        return type_schema is not None and "id" in type_schema._declared_fields
+
+    def get_dump_schema(self):
+        """
+        Returns an instance of the schema without the fields that may hold
+        references, which are dumped item by item when saving.
+        """
+        if self._dump_schema is None:
+            self._dump_schema = self.schema_class(
+                exclude=[
+                    field_name
+                    for field_name, reference in self.references.items()
+                    if reference.may_reference
+                ]
+            )
+        return self._dump_schema
+
+    def get_reference_fields(self, obj=None, document=None):
+        return {
+            field_name: reference.field
+            for field_name, reference in self.references.items()
+            if reference.is_reference(obj=obj, document=document)
+        }
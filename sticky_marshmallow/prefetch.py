@@ -0,0 +1,125 @@
+import contextvars
+import queue
+import threading
+
+
+# How often a worker blocked on a full queue checks whether it was stopped
+_POLL_INTERVAL = 0.1
+
+DONE = object()
+
+
+class _Error:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class Channel:
+    """
+    Hands the items a worker produces to a consumer through a queue of up
+    to `size` items. The worker blocks while the queue is full, until the
+    consumer takes an item or `stopped` is set. Several workers may share a
+    channel, each ending with DONE.
+    """
+
+    def __init__(self, size, stopped):
+        self._queue = queue.Queue(maxsize=size)
+        self._stopped = stopped
+
+    def produce(self, items):
+        """
+        Puts the items of an iterable in the queue, then DONE, in a worker.
+        Exceptions raised by the iterable are raised by `get` instead.
+        """
+        items = iter(items)
+        try:
+            while not self._stopped.is_set():
+                item = next(items, DONE)
+                if not self._put(item) or item is DONE:
+                    return
+        except BaseException as exception:
+            self._put(_Error(exception))
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self):
+        """
+        Returns the next item, or DONE when a worker is done.
+        """
+        item = self._queue.get()
+        if isinstance(item, _Error):
+            raise item.exception
+        return item
+
+    def clear(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+
+class Prefetcher:
+    """
+    Calls `fetch` in a worker thread until it returns an empty list, keeping
+    up to `size` of its results queued for the consumer. The worker blocks
+    while the queue is full, so it never gets further ahead than that.
+    Exceptions raised by `fetch` are raised by `get` instead.
+
+    `fetch` must not refer to the cursor it fetches for, so that an
+    abandoned cursor is collected and can stop its worker.
+    """
+
+    def __init__(self, fetch, size=2):
+        self._stopped = threading.Event()
+        self._channel = Channel(size, self._stopped)
+        self._done = False
+        # Spans of the worker nest in the span the cursor was first used in
+        self._thread = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._channel.produce, iter(fetch, [])),
+            name="sticky-marshmallow-prefetch",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def get(self):
+        """
+        Returns the next list of fetched documents, or an empty list once
+        they are exhausted or the prefetcher was closed.
+        """
+        if self._done:
+            return []
+        try:
+            item = self._channel.get()
+        except BaseException:
+            self._done = True
+            raise
+        if item is DONE:
+            self._done = True
+            return []
+        return item
+
+    def stop(self):
+        """
+        Tells the worker to stop without waiting for it.
+        """
+        self._stopped.set()
+
+    def close(self):
+        """
+        Stops the worker, discards what it prefetched and waits for it to
+        finish the fetch in progress.
+        """
+        self.stop()
+        self._done = True
+        self._channel.clear()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
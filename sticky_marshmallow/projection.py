@@ -0,0 +1,113 @@
+from sticky_marshmallow.plan import get_plan
+
+
+class Projection:
+    """
+    A set of (dotted) field names to either include or exclude. Dotted names
+    may reach into referenced entities, e.g. "author.name", in which case the
+    projection of the referenced documents is derived from them.
+    """
+
+    def __init__(self, fields, exclude=False):
+        self.exclude = exclude
+        # Maps field names to the projection of their subfields, or None to
+        # project the field as a whole
+        self.fields = {}
+        for field in fields:
+            field_name, _, subfield = field.partition(".")
+            if not subfield:
+                self.fields[field_name] = None
+            elif self.fields.get(field_name, ()) is not None:
+                self.fields.setdefault(field_name, []).append(subfield)
+        self.fields = {
+            field_name: None
+            if subfields is None
+            else Projection(subfields, exclude=exclude)
+            for field_name, subfields in self.fields.items()
+        }
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Projection)
+            and self.exclude == other.exclude
+            and self.fields == other.fields
+        )
+
+    def __hash__(self):
+        return hash((self.exclude, frozenset(self.fields.items())))
+
+    def __repr__(self):
+        mode = "exclude" if self.exclude else "only"
+        return f"{self.__class__.__name__}({mode}={self.fields!r})"
+
+    def includes(self, field_name):
+        """
+        Whether the field is fetched at all.
+        """
+        if self.exclude:
+            return not (
+                field_name in self.fields and self.fields[field_name] is None
+            )
+        return field_name in self.fields
+
+    def get_nested(self, field_name):
+        """
+        Returns the projection of the documents referenced by field_name.
+        """
+        return self.fields.get(field_name)
+
+    def get_paths(self, prefix=""):
+        for field_name, projection in self.fields.items():
+            path = f"{prefix}{field_name}"
+            if projection is None:
+                yield path
+            else:
+                yield from projection.get_paths(f"{path}.")
+
+    def to_mongo(self, schema):
+        """
+        Returns the MongoDB projection of the documents of schema. Subfields
+        of references are left to the projection of the referenced
+        collection.
+        """
+        references = get_plan(schema).references
+        value = 0 if self.exclude else 1
+        projection = {}
+        for field_name, nested in self.fields.items():
+            reference = references.get(field_name)
+            if nested is None:
+                projection[field_name] = value
+            elif reference is not None and reference.may_reference:
+                if not self.exclude:
+                    projection[field_name] = value
+            else:
+                projection.update(
+                    (f"{field_name}.{path}", value)
+                    for path in nested.get_paths()
+                )
+        return projection
+
+    def get_schema_kwargs(self, schema):
+        """
+        Returns the only/exclude arguments of the partial schema to load the
+        projected documents with.
+        """
+        if self.exclude:
+            return {"exclude": tuple(self.get_paths())}
+        return {"only": tuple(self._get_only_paths(schema))}
+
+    def _get_only_paths(self, schema, prefix=""):
+        # The id is always loaded for entities that declare one
+        if get_plan(schema).declares_id and "id" not in self.fields:
+            yield f"{prefix}id"
+        references = get_plan(schema).references
+        for field_name, nested in self.fields.items():
+            path = f"{prefix}{field_name}"
+            if nested is None:
+                yield path
+            elif field_name in references:
+                yield from nested._get_only_paths(
+                    references[field_name].schema, f"{path}."
+                )
+            else:
+                yield from nested.get_paths(f"{path}.")
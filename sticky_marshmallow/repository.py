@@ -1,13 +1,88 @@
-import datetime
-from bson import ObjectId
+import collections
+import concurrent.futures
+import contextlib
+import itertools
+import os
+import threading
+import time
 
+from bson import json_util, ObjectId
+from pymongo import ReplaceOne, UpdateOne
+
+from sticky_marshmallow.cache import get_entity_cache, get_query_cache
+from sticky_marshmallow.connection import DEFAULT_ALIAS
 from sticky_marshmallow.core import Core
 
-from sticky_marshmallow.cursor import Cursor
+from sticky_marshmallow.cursor import Cursor, JOIN_SERVER
+from sticky_marshmallow.embedding import (
+    get_embeddings,
+    get_refresh,
+    is_partial,
+    is_stale,
+    register_embedding,
+)
+from sticky_marshmallow.embedding import record as record_embedding
+from sticky_marshmallow.indexes import (
+    check_filter,
+    ensure_indexes,
+    register_repository,
+)
+from sticky_marshmallow.instrumentation import span
+from sticky_marshmallow.lazy import is_unloaded, unwrap
+from sticky_marshmallow.options import (
+    get_options,
+    Options,
+    register_options,
+)
+from sticky_marshmallow.plan import DELETE, get_plan, get_schema_class
+from sticky_marshmallow.prefetch import Channel, DONE
+from sticky_marshmallow.projection import Projection
+from sticky_marshmallow.tracking import get_snapshot, get_update, set_snapshot
 
 
 __all__ = ["Repository"]
 
+DEFAULT_BATCH_SIZE = 1000
+
+# Ids sampled per partition to estimate the boundaries of Repository.scan
+SAMPLES_PER_PARTITION = 100
+
+# Batches each partition of Repository.scan loads ahead of the consumer
+SCAN_QUEUE_SIZE = 2
+
+Write = collections.namedtuple(
+    "Write",
+    [
+        "schema",
+        "obj",
+        "filter",
+        "update",
+        "snapshot",
+        "obj_id_from_document",
+        "document",
+    ],
+)
+
+
+@contextlib.contextmanager
+def _open(file, mode):
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, mode) as fp:
+            yield fp
+    else:
+        yield file
+
+
+def _get_transfer_stats(counts, started):
+    documents = sum(counts.values())
+    seconds = time.perf_counter() - started
+    return {
+        "documents": documents,
+        "collections": dict(counts),
+        "seconds": seconds,
+        "docs_per_second": documents / seconds if seconds else 0.0,
+    }
+
 
 class DoesNotExist(Exception):
     pass
@@ -19,6 +94,10 @@ class MultipleObjectsReturned(Exception):
 
 class Meta(object):
     schema = None
+    db_alias = DEFAULT_ALIAS
+    read_alias = None
+    read_preference = None
+    max_depth = None
 
 
 class BaseRepository(type):
@@ -55,13 +134,38 @@ class BaseRepository(type):
         for k, v in meta_data.items():
             setattr(new_class.Meta, k, v)
 
+        # Compile the persistence plan of the schema up front
+        if new_class.Meta.schema is not None:
+            plan = get_plan(new_class.Meta.schema)
+            new_class._options = Options.from_meta(new_class.Meta)
+            register_options(new_class._options)
+            for field_name, field_names in new_class._options.embed.items():
+                register_embedding(
+                    new_class.Meta.schema,
+                    plan.references[field_name],
+                    field_names,
+                )
+            register_repository(new_class)
+
         return new_class
 
 
-class Repository(Core, metaclass=BaseRepository):
+class RepositoryMixin:
+    """
+    The parts of a repository that don't touch the database, shared by
+    Repository and sticky_marshmallow.aio.AsyncRepository.
+    """
+
+    _is_async = False
+
     def __init__(self, *args, **kwargs):
+        kwargs.setdefault("db_alias", self.Meta.db_alias)
+        kwargs.setdefault("read_alias", self.Meta.read_alias)
+        kwargs.setdefault("read_preference", self.Meta.read_preference)
+        kwargs.setdefault("max_depth", self.Meta.max_depth)
         super().__init__(*args, **kwargs)
         self._collection = None
+        self._read_collection = None
 
     @property
     def collection(self):
@@ -71,77 +175,890 @@ class Repository(Core, metaclass=BaseRepository):
 
         return self._collection
 
-    def _get_primary_key_filter(self, document):
-        primary_key_fields = getattr(self.Meta, "primary_key", ["id"])
+    @property
+    def read_collection(self):
+        """
+        The collection `get` and `find` read from, see Meta.read_alias and
+        Meta.read_preference.
+        """
+        if self._read_collection is None:
+            schema = self.Meta.schema()
+            self._read_collection = self._get_read_collection_from_schema(
+                schema
+            )
+
+        return self._read_collection
+
+    def _get_options(self, schema):
+        """
+        Entities of the repository's own schema are saved with its Meta,
+        see sticky_marshmallow.options.
+        """
+        if get_schema_class(schema) is get_schema_class(self.Meta.schema):
+            return self._options
+        return get_options(schema)
+
+    def _get_primary_key_filter(self, schema, document):
+        primary_key_fields = self._get_options(schema).primary_key
         filter = {k: document.get(k) for k in primary_key_fields}
         if "id" in filter:
             filter["_id"] = ObjectId(filter.pop("id"))
         return filter
 
-    def _save_recursive(self, schema, obj):
-        dates = {
-            k: v
-            for k, v in obj.__dict__.items()
-            if isinstance(v, datetime.datetime)
-        }
-        document = {**schema.dump(obj), **dates}
+    @staticmethod
+    def _set_id(obj, document, obj_id, obj_id_from_document):
+        if obj_id is None and obj_id_from_document is not None:
+            obj_id = ObjectId(obj_id_from_document)
+        if hasattr(obj, "id"):
+            obj.id = str(obj_id) if obj_id else None
+        document["_id"] = obj_id
+        return obj_id
+
+    def _span(self, name):
+        return span(
+            name,
+            collection=self._get_collection_name_from_schema(self.Meta.schema),
+        )
+
+    def _tracks_changes(self):
+        return getattr(self.Meta, "track_changes", False)
+
+    def _get_update(self, schema, obj, document, filter):
+        """
+        Returns the $set/$unset update to save obj with, which is empty when
+        obj did not change. Returns None when obj has to be replaced as a
+        whole, because it wasn't loaded or saved before or because its
+        primary key changed.
+        """
+        snapshot = get_snapshot(obj)
+        if (
+            snapshot is None
+            or self._get_primary_key_filter(schema, snapshot) != filter
+        ):
+            return None
+        return get_update(snapshot, document)
+
+    def _is_trusted(self):
+        return getattr(self.Meta, "trusted", False)
+
+    def _track(self, obj, snapshot, obj_id):
+        if get_snapshot(obj) is None and not self._tracks_changes():
+            return
+        if "id" in snapshot:
+            snapshot["id"] = str(obj_id) if obj_id else None
+        set_snapshot(obj, snapshot)
+
+    def _get_refreshes(self, schema, obj_id, document, update):
+        """
+        Returns the parent schemas and writes that refresh the copies of the
+        entity written as document embedded in other documents, see
+        Meta.embed. Copies are left alone when update didn't change any of
+        their fields.
+        """
+        refreshes = []
+        if obj_id is None:
+            return refreshes
+        for parent_schema, reference, field_names in get_embeddings(
+            self._get_collection_name_from_schema(schema)
+        ):
+            if update is not None and not any(
+                field_name in update.get(operator, {})
+                for operator in ("$set", "$unset")
+                for field_name in field_names
+            ):
+                continue
+            refreshes.append(
+                (
+                    parent_schema,
+                    get_refresh(reference, field_names, obj_id, document),
+                )
+            )
+        return refreshes
+
+    def _get_bulk_refreshes(self, writes, ids):
+        return [
+            refresh
+            for write in writes
+            if write.obj_id_from_document is not None
+            for refresh in self._get_refreshes(
+                write.schema, ids[id(write.obj)], write.document, write.update
+            )
+        ]
+
+    @staticmethod
+    def _group_refreshes(refreshes):
+        grouped = {}
+        for parent_schema, write in refreshes:
+            collection_name = get_plan(parent_schema).collection_name
+            grouped.setdefault(collection_name, (parent_schema, []))[1].append(
+                write
+            )
+        return list(grouped.values())
+
+    def _collect_entities(self, schema, obj, entities):
+        """
+        Registers obj and every entity it references in `entities`, keyed by
+        object identity so that shared entities are only written once.
+        Returns the height of obj in the object graph, leaves being 0.
+        """
+        key = id(obj)
+        if key in entities:
+            return entities[key][2]
+        height = 0
         for field_name, field in self._get_reference_fields(
             schema, obj=obj
         ).items():
             reference_field = getattr(obj, field_name)
-            if reference_field is not None:
-                if isinstance(reference_field, list):
-                    document[field_name] = [
-                        self._save_recursive(
-                            field.schema.__class__(many=False), item
-                        )["_id"]
-                        for item in reference_field
-                    ]
-                else:
-                    document[field_name] = self._save_recursive(
-                        field.schema, reference_field
-                    )["_id"]
-        filter = self._get_primary_key_filter(document)
-        obj_id_from_document = document.pop("id", None)
-        result = self._get_collection_from_schema(schema).replace_one(
-            filter, document, upsert=True
+            if reference_field is not None and not is_unloaded(
+                reference_field
+            ):
+                nested_schema, items = self._get_nested_items(
+                    field, unwrap(reference_field)
+                )
+                reference = get_plan(schema).references[field_name]
+                policy = self._get_options(schema).cascade[field_name]
+                for item in items:
+                    if is_unloaded(item) or not (
+                        reference.is_entity(item)
+                        and not is_partial(item)
+                        and self._is_cascaded(policy, reference, item)
+                    ):
+                        continue
+                    height = max(
+                        height,
+                        self._collect_entities(nested_schema, item, entities)
+                        + 1,
+                    )
+        entities[key] = (schema, obj, height)
+        return height
+
+    def _get_bulk_writes(self, entities, height, ids, batch_size):
+        """
+        Returns the collection and the writes of each bulk write needed to
+        save the entities at the given height of the object graph.
+        """
+        pending = {}
+        for schema, obj, entity_height in entities:
+            if entity_height != height:
+                continue
+            document = self._to_document(
+                schema, obj, lambda _, item: ids[id(item)]
+            )
+            filter = self._get_primary_key_filter(schema, document)
+            write = Write(
+                schema=schema,
+                obj=obj,
+                filter=filter,
+                update=self._get_update(schema, obj, document, filter),
+                snapshot=dict(document),
+                obj_id_from_document=document.pop("id", None),
+                document=document,
+            )
+            if write.update == {}:
+                # Unchanged entities are not written at all
+                ids[id(obj)] = self._set_id(
+                    obj, document, None, write.obj_id_from_document
+                )
+                continue
+            pending.setdefault(
+                self._get_collection_name_from_schema(schema), []
+            ).append(write)
+        for writes in pending.values():
+            collection = self._get_collection_from_schema(writes[0].schema)
+            for start in range(0, len(writes), batch_size):
+                yield collection, writes[start : start + batch_size]
+
+    @staticmethod
+    def _get_bulk_operations(writes):
+        return [
+            ReplaceOne(write.filter, write.document, upsert=True)
+            if write.update is None
+            else UpdateOne(write.filter, write.update)
+            for write in writes
+        ]
+
+    @staticmethod
+    def _get_unmatched(writes, result):
+        """
+        Returns the indexes of the updates among writes if some write matched
+        no document, e.g. because it was deleted since it was loaded. These
+        are re-sent as replaces, which rewrite the same document where the
+        update did match.
+        """
+        if result.matched_count + result.upserted_count >= len(writes):
+            return []
+        return [
+            index
+            for index, write in enumerate(writes)
+            if write.update is not None
+        ]
+
+    @staticmethod
+    def _get_resent(writes, unmatched):
+        return [writes[index]._replace(update=None) for index in unmatched]
+
+    @staticmethod
+    def _merge_resent(writes, result, unmatched, resent, resent_result):
+        """
+        Returns writes with the re-sent writes in place of the unmatched
+        ones, and the ids upserted by index.
+        """
+        upserted_ids = dict(result.upserted_ids or {})
+        if not resent:
+            return writes, upserted_ids
+        writes = list(writes)
+        resent_ids = resent_result.upserted_ids or {}
+        for resent_index, index in enumerate(unmatched):
+            writes[index] = resent[resent_index]
+            if resent_index in resent_ids:
+                upserted_ids[index] = resent_ids[resent_index]
+        return writes, upserted_ids
+
+    def _set_bulk_ids(self, writes, upserted_ids, ids):
+        for index, write in enumerate(writes):
+            obj_id = ids[id(write.obj)] = self._set_id(
+                write.obj,
+                write.document,
+                upserted_ids.get(index),
+                write.obj_id_from_document,
+            )
+            self._track(write.obj, write.snapshot, obj_id)
+            self._invalidate_cached_documents(write.schema, [obj_id])
+
+    def _get_lazy_fields(self):
+        return tuple(getattr(self.Meta, "lazy", ()))
+
+    def _get_joined_pipeline(self, schema, filter, projection=None):
+        pipeline = [{"$match": filter}, {"$limit": 2}]
+        if projection is not None:
+            pipeline.append({"$project": projection.to_mongo(schema)})
+        pipeline.extend(
+            self._get_lookup_stages(
+                schema, projection=projection, lazy=self._get_lazy_fields()
+            )
         )
-        obj_id = (
-            result.upserted_id
-            if hasattr(result, "upserted_id")
-            else result.inserted_id
-            if hasattr(result, "inserted_id")
+        return pipeline
+
+    @staticmethod
+    def _add_cascaded_deletes(documents, deletes):
+        """
+        Adds the ids documents reference through fields with a "delete"
+        cascade to deletes. Returns the schemas and filters of the entities
+        found for the first time, whose references are deleted in turn.
+        """
+        found = {}
+        for schema, field_names, schema_documents in documents:
+            plan = get_plan(schema)
+            for document in schema_documents:
+                for field_name in field_names:
+                    reference = plan.references[field_name]
+                    _, ids = deletes.setdefault(
+                        reference.collection_name, (reference.schema, set())
+                    )
+                    for _id in Core._get_stored_ids(
+                        document.get(field_name)
+                    ):
+                        if _id not in ids:
+                            ids.add(_id)
+                            found.setdefault(
+                                reference.collection_name,
+                                (reference.schema, set()),
+                            )[1].add(_id)
+        return [
+            (schema, {"_id": {"$in": list(ids)}})
+            for schema, ids in found.values()
+        ]
+
+
+class Repository(RepositoryMixin, Core, metaclass=BaseRepository):
+    def _check_filter(self, filter):
+        """
+        Warns when no index supports filter, see Meta.check_indexes.
+        """
+        if getattr(self.Meta, "check_indexes", False):
+            check_filter(
+                self._read_alias or self._db_alias,
+                self.read_collection,
+                filter,
+            )
+
+    def _save_recursive(self, schema, obj):
+        with span("save", collection=get_plan(schema).collection_name):
+            document = self._to_document(
+                schema,
+                obj,
+                lambda nested_schema, item: self._save_recursive(
+                    nested_schema, item
+                )["_id"],
+            )
+            filter = self._get_primary_key_filter(schema, document)
+            update = self._get_update(schema, obj, document, filter)
+            snapshot = dict(document)
+            obj_id_from_document = document.pop("id", None)
+            collection = self._get_collection_from_schema(schema)
+            obj_id = None
+            if update:
+                result = collection.update_one(filter, update)
+                # The document was deleted since it was loaded
+                if result.matched_count == 0:
+                    update = None
+            if update is None:
+                result = collection.replace_one(filter, document, upsert=True)
+                obj_id = (
+                    result.upserted_id
+                    if hasattr(result, "upserted_id")
+                    else result.inserted_id
+                    if hasattr(result, "inserted_id")
+                    else None
+                )
+            obj_id = self._set_id(obj, document, obj_id, obj_id_from_document)
+            self._track(obj, snapshot, obj_id)
+            if update != {}:
+                self._invalidate_cached_documents(schema, [obj_id])
+            # New entities have no copies to refresh yet
+            if update != {} and obj_id_from_document is not None:
+                self._refresh_embedded(
+                    self._get_refreshes(schema, obj_id, document, update)
+                )
+            return document
+
+    def _refresh_embedded(self, refreshes):
+        """
+        Refreshes embedded copies with one unordered bulk write per parent
+        collection.
+        """
+        for parent_schema, writes in self._group_refreshes(refreshes):
+            result = self._get_collection_from_schema(
+                parent_schema
+            ).bulk_write(writes, ordered=False)
+            self._invalidate_cached_documents(parent_schema)
+            record_embedding("refreshes")
+            record_embedding("refreshed", result.modified_count)
+
+    def _bulk_save(self, entities, batch_size):
+        ids = {}
+        refreshes = []
+        for height in sorted({height for _, _, height in entities}):
+            for collection, writes in self._get_bulk_writes(
+                entities, height, ids, batch_size
+            ):
+                writes, upserted_ids = self._bulk_write(collection, writes)
+                self._set_bulk_ids(writes, upserted_ids, ids)
+                refreshes.extend(self._get_bulk_refreshes(writes, ids))
+        self._refresh_embedded(refreshes)
+
+    def _bulk_write(self, collection, writes):
+        """
+        Sends writes as an unordered bulk write, re-sending the updates that
+        may have matched nothing, see _get_unmatched. Returns the writes as
+        sent last and the ids upserted by index.
+        """
+        result = collection.bulk_write(
+            self._get_bulk_operations(writes), ordered=False
+        )
+        unmatched = self._get_unmatched(writes, result)
+        resent = self._get_resent(writes, unmatched)
+        resent_result = (
+            collection.bulk_write(
+                self._get_bulk_operations(resent), ordered=False
+            )
+            if resent
             else None
         )
-        if obj_id is None and obj_id_from_document is not None:
-            obj_id = ObjectId(obj_id_from_document)
-        if hasattr(obj, "id"):
-            obj.id = str(obj_id) if obj_id else None
-        document["_id"] = obj_id
-        return document
+        return self._merge_resent(
+            writes, result, unmatched, resent, resent_result
+        )
 
-    def get(self, id=None, **filter):
-        schema = self.Meta.schema()
-        if id is not None:
-            filter["_id"] = ObjectId(id)
-        count = self.collection.count_documents(filter)
-        if count > 1:
+    def _get_object(self, schema, document, projection=None):
+        obj = self._to_object(
+            schema,
+            document,
+            projection,
+            self._get_lazy_fields(),
+            self._is_trusted(),
+            self._tracks_changes() and projection is None,
+        )
+        # Partially loaded objects can't be compared to what is stored
+        if self._tracks_changes() and projection is None:
+            self._set_snapshots(schema, obj)
+        return obj
+
+    def get(self, id=None, join=None, fields=None, **filter):
+        """
+        Passing `fields` only fetches and loads those fields, see
+        Cursor.only().
+        """
+        with self._span("get"):
+            schema = self.Meta.schema()
+            projection = None if fields is None else Projection(fields)
+            if id is not None:
+                filter["_id"] = ObjectId(id)
+            self._check_filter(filter)
+            if join == JOIN_SERVER:
+                return self._get_joined(schema, filter, projection)
+            if join is not None:
+                raise ValueError(f"Unknown join mode '{join}'")
+            if list(filter) == ["_id"]:
+                document = self._find_by_ids(
+                    schema, [filter["_id"]], projection
+                ).get(filter["_id"])
+                if document is None:
+                    raise self.DoesNotExist()
+                return self._get_object(schema, document, projection)
+            # Fetching two documents is enough to detect duplicates
+            documents = list(
+                self.read_collection.find(
+                    filter,
+                    None
+                    if projection is None
+                    else projection.to_mongo(schema),
+                ).limit(2)
+            )
+            if len(documents) > 1:
+                raise self.MultipleObjectsReturned()
+            if not documents:
+                raise self.DoesNotExist()
+            return self._get_object(schema, documents[0], projection)
+
+    def _get_joined(self, schema, filter, projection=None):
+        """
+        Fetches the object graph with a single aggregation.
+        """
+        documents = list(
+            self.read_collection.aggregate(
+                self._get_joined_pipeline(schema, filter, projection)
+            )
+        )
+        if len(documents) > 1:
             raise self.MultipleObjectsReturned()
-        if count == 0:
+        if not documents:
             raise self.DoesNotExist()
-        document = self.collection.find_one(filter)
-        return self._to_object(schema, document)
+        return self._get_object(schema, documents[0], projection)
+
+    def find(self, join=None, **filter):
+        """
+        With join="server", referenced documents are joined in by the
+        server with $lookup stages instead of being fetched separately.
+        """
+        self._check_filter(filter)
+        return self._get_cursor(filter, join)
 
-    def find(self, **filter):
+    def _get_cursor(self, filter, join=None):
         schema = self.Meta.schema()
-        return Cursor(schema=schema, collection=self.collection, filter=filter)
+        return Cursor(
+            schema=schema,
+            collection=self.read_collection,
+            filter=filter,
+            join=join,
+            lazy=self._get_lazy_fields(),
+            track_changes=self._tracks_changes(),
+            trusted=self._is_trusted(),
+            core=self,
+        )
+
+    def scan(
+        self,
+        fn=None,
+        partitions=4,
+        ordered=True,
+        executor=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        in_flight=4,
+        **filter,
+    ):
+        """
+        Loads the documents matching filter in `partitions` ranges of _id,
+        each with its own cursor, in executor: a thread pool with a worker
+        per partition in flight by default. Yields the batches of up to
+        batch_size objects, or fn(batch) of each batch, which then runs in the
+        workers. Ordered batches come in _id order, unordered ones as they
+        are loaded.
+
+        Ranges are estimated from a sample of ids. At most `in_flight`
+        partitions are loaded at once, the next one starts as one is done.
+        Workers hand over their batches through queues of SCAN_QUEUE_SIZE
+        batches per partition in flight and wait while these are full, so
+        memory stays bounded however large the partitions are.
+
+        Workers are threads sharing the connections of this process, so
+        executor can't be a ProcessPoolExecutor. Scans overlap the round
+        trips to the database, while loading the documents, like fn, holds
+        the GIL and so runs on one core at a time.
+        """
+        if partitions < 1 or in_flight < 1:
+            raise ValueError("Scan at least one partition at a time")
+        if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+            raise TypeError("Scans use the connections of this process")
+        self._check_filter(filter)
+        ranges = iter(self._get_partitions(filter, partitions))
+        own_executor = executor is None
+        if own_executor:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                min(in_flight, partitions)
+            )
+        stopped = threading.Event()
+        # Unordered batches come through a single channel shared by all
+        # partitions in flight
+        shared = (
+            None
+            if ordered
+            else Channel(SCAN_QUEUE_SIZE * in_flight, stopped)
+        )
+        channels = collections.deque()
+        futures = []
+
+        def submit():
+            partition = next(ranges, None)
+            if partition is None:
+                return False
+            channel = shared
+            if channel is None:
+                channel = Channel(SCAN_QUEUE_SIZE, stopped)
+                channels.append(channel)
+            futures.append(
+                executor.submit(
+                    channel.produce,
+                    self._scan_partition(
+                        {"$and": [filter, partition]} if filter else partition,
+                        fn,
+                        ordered,
+                        batch_size,
+                    ),
+                )
+            )
+            return True
+
+        try:
+            running = sum(submit() for _ in range(in_flight))
+            if ordered:
+                while channels:
+                    yield from iter(channels.popleft().get, DONE)
+                    submit()
+            else:
+                while running:
+                    result = shared.get()
+                    if result is DONE:
+                        running -= 1
+                        running += submit()
+                    else:
+                        yield result
+        finally:
+            stopped.set()
+            for future in futures:
+                future.cancel()
+            if own_executor:
+                executor.shutdown()
+
+    def _scan_partition(self, filter, fn, ordered, batch_size):
+        """
+        Loads one partition of scan, in a worker of its executor.
+        """
+        cursor = self._get_cursor(filter).batch_size(batch_size)
+        if ordered:
+            cursor = cursor.sort("_id")
+        for batch in cursor.iter_batches():
+            yield batch if fn is None else fn(batch)
+
+    def _get_partitions(self, filter, partitions):
+        """
+        Returns the filters on _id ranges that split the documents matching
+        filter into about `partitions` equal parts.
+        """
+        ids = sorted(
+            document["_id"]
+            for document in self.read_collection.aggregate(
+                [
+                    {"$match": filter},
+                    {"$sample": {"size": partitions * SAMPLES_PER_PARTITION}},
+                    {"$project": {"_id": True}},
+                ]
+            )
+        )
+        bounds = sorted(
+            {ids[len(ids) * i // partitions] for i in range(1, partitions)}
+            if ids
+            else ()
+        )
+        return [
+            {
+                "_id": {
+                    operator: bound
+                    for operator, bound in (("$gte", lower), ("$lt", upper))
+                    if bound is not None
+                }
+            }
+            if lower is not None or upper is not None
+            else {}
+            for lower, upper in zip([None] + bounds, bounds + [None])
+        ]
+
+    def ensure_indexes(self):
+        """
+        Creates the indexes declared in Meta.indexes and the unique index of
+        Meta.primary_key if they don't exist yet. See
+        sticky_marshmallow.indexes.ensure_indexes to do so for all
+        repositories at once.
+        """
+        return ensure_indexes([self])
+
+    def check_embedded(self, refresh=False, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Compares the copies embedded in the stored documents, see Meta.embed,
+        with the entities they were copied from, batch_size documents at a
+        time. Returns the number of copies checked and found stale per field.
+        With refresh, stale copies of existing entities are refreshed.
+        """
+        results = {}
+        references = get_plan(self.Meta.schema).references
+        for field_name, field_names in self._options.embed.items():
+            reference = references[field_name]
+            checked = stale = 0
+            cursor = self.collection.find(
+                {field_name: {"$ne": None}}, [field_name]
+            )
+            while True:
+                documents = list(itertools.islice(cursor, batch_size))
+                if not documents:
+                    break
+                copies = [
+                    copy
+                    for document in documents
+                    for copy in (
+                        document[field_name]
+                        if reference.many
+                        else [document[field_name]]
+                    )
+                    if isinstance(copy, dict) and "_id" in copy
+                ]
+                sources = self._find_by_ids(
+                    reference.schema, list({copy["_id"] for copy in copies})
+                )
+                refreshes = {}
+                for copy in copies:
+                    checked += 1
+                    source = sources.get(copy["_id"])
+                    if source is None or is_stale(field_names, copy, source):
+                        stale += 1
+                        if refresh and source is not None:
+                            refreshes[copy["_id"]] = (
+                                self.Meta.schema,
+                                get_refresh(
+                                    reference, field_names, copy["_id"], source
+                                ),
+                            )
+                self._refresh_embedded(list(refreshes.values()))
+            record_embedding("checked", checked)
+            record_embedding("stale", stale)
+            results[field_name] = {"checked": checked, "stale": stale}
+        return results
 
     def save(self, obj):
         self._save_recursive(schema=self.Meta.schema(), obj=obj)
         return obj
 
+    def save_many(self, objs, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Saves many objects with unordered bulk writes, grouped per collection
+        and written level by level so that referenced entities get their ids
+        before the documents referencing them are written.
+        """
+        with self._span("save_many"):
+            objs = list(objs)
+            schema = self.Meta.schema()
+            entities = {}
+            for obj in objs:
+                self._collect_entities(schema, obj, entities)
+            self._bulk_save(list(entities.values()), batch_size)
+            return objs
+
+    def export_jsonl(
+        self, file, batch_size=DEFAULT_BATCH_SIZE, references=False, **filter
+    ):
+        """
+        Streams the stored documents matching filter to file, a path or a text
+        file, as JSON lines of {"collection": ..., "document": ...}, holding
+        no more than batch_size documents at a time. With references=True,
+        the entities they reference are written as well, each once and before
+        the documents referencing them; only their ids are kept in memory.
+        Returns the number of documents written per collection and the
+        throughput in documents per second.
+        """
+        schema = self.Meta.schema()
+        started = time.perf_counter()
+        counts = collections.Counter()
+        exported = set()
+        cursor = self.read_collection.find(filter).batch_size(batch_size)
+        with _open(file, "w") as fp:
+            while True:
+                documents = list(itertools.islice(cursor, batch_size))
+                if not documents:
+                    break
+                if references:
+                    self._export_references(
+                        fp, schema, documents, exported, counts, batch_size
+                    )
+                self._write_jsonl(
+                    fp,
+                    self._get_collection_name_from_schema(schema),
+                    documents,
+                    counts,
+                )
+        return _get_transfer_stats(counts, started)
+
+    def _export_references(
+        self, fp, schema, documents, exported, counts, batch_size
+    ):
+        references, schemas, ids = self._collect_references(schema, documents)
+        # Entities stored with a copy, see Meta.embed, are exported like
+        # those stored by id. Embedded documents may hold references too.
+        embedded = {}
+        for document, field_name, key in references:
+            value = document[field_name]
+            ids[key].update(self._get_stored_ids(value))
+            values = value if isinstance(value, list) else [value]
+            embedded.setdefault(key, []).extend(
+                v for v in values if isinstance(v, dict) and "_id" not in v
+            )
+        for key, embedded_documents in embedded.items():
+            if embedded_documents:
+                self._export_references(
+                    fp,
+                    schemas[key],
+                    embedded_documents,
+                    exported,
+                    counts,
+                    batch_size,
+                )
+        for key, key_ids in ids.items():
+            collection_name = key[0]
+            key_ids = sorted(
+                _id
+                for _id in key_ids
+                if (collection_name, _id) not in exported
+            )
+            exported.update((collection_name, _id) for _id in key_ids)
+            collection = self._get_read_collection_from_schema(schemas[key])
+            for start in range(0, len(key_ids), batch_size):
+                referenced = list(
+                    collection.find(
+                        {"_id": {"$in": key_ids[start : start + batch_size]}}
+                    )
+                )
+                self._export_references(
+                    fp, schemas[key], referenced, exported, counts, batch_size
+                )
+                self._write_jsonl(fp, collection_name, referenced, counts)
+
+    @staticmethod
+    def _write_jsonl(fp, collection_name, documents, counts):
+        for document in documents:
+            fp.write(
+                json_util.dumps(
+                    {"collection": collection_name, "document": document}
+                )
+                + "\n"
+            )
+        counts[collection_name] += len(documents)
+
+    def import_jsonl(self, file, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Upserts the documents of a file written by export_jsonl by their _id,
+        streaming it with unordered bulk writes of up to batch_size documents
+        per collection. Returns the same statistics as export_jsonl.
+        """
+        started = time.perf_counter()
+        counts = collections.Counter()
+        pending = {}
+        with _open(file, "r") as fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+                entry = json_util.loads(line)
+                collection_name = entry["collection"]
+                writes = pending.setdefault(collection_name, [])
+                writes.append(entry["document"])
+                if len(writes) >= batch_size:
+                    self._import_batch(
+                        collection_name, pending.pop(collection_name), counts
+                    )
+        for collection_name, documents in pending.items():
+            self._import_batch(collection_name, documents, counts)
+        return _get_transfer_stats(counts, started)
+
+    def _import_batch(self, collection_name, documents, counts):
+        self.get_db()[collection_name].bulk_write(
+            [
+                ReplaceOne({"_id": document["_id"]}, document, upsert=True)
+                for document in documents
+            ],
+            ordered=False,
+        )
+        counts[collection_name] += len(documents)
+        query_cache = get_query_cache()
+        if query_cache is not None:
+            query_cache.invalidate_collection(collection_name, self._db_alias)
+        cache = get_entity_cache()
+        if cache is not None:
+            for document in documents:
+                cache.invalidate(
+                    collection_name, document["_id"], self._db_alias
+                )
+
+    def _get_cascaded_deletes(self, filter):
+        """
+        Returns the schema of and the ids to delete from each collection
+        together with the documents matching filter, i.e. the entities they
+        reference through fields with a "delete" cascade, recursively. Each
+        level of references is found with one query per collection.
+        """
+        deletes = {}
+        level = [(self.Meta.schema, filter)]
+        while level:
+            documents = []
+            for schema, filter in level:
+                field_names = self._get_options(schema).get_cascaded_fields(
+                    DELETE
+                )
+                if field_names:
+                    collection = self._get_collection_from_schema(schema)
+                    documents.append(
+                        (
+                            schema,
+                            field_names,
+                            collection.find(filter, field_names),
+                        )
+                    )
+            level = self._add_cascaded_deletes(documents, deletes)
+        return deletes
+
+    def _delete_cascaded(self, deletes):
+        for schema, ids in deletes.values():
+            if ids:
+                self._get_collection_from_schema(schema).delete_many(
+                    {"_id": {"$in": list(ids)}}
+                )
+                self._invalidate_cached_documents(schema, ids)
+
     def delete(self, obj):
-        self.collection.delete_one({"_id": ObjectId(obj.id)})
+        """
+        Deletes obj, and the entities it references through fields with a
+        "delete" cascade.
+        """
+        with self._span("delete"):
+            _id = ObjectId(obj.id)
+            deletes = self._get_cascaded_deletes({"_id": _id})
+            self.collection.delete_one({"_id": _id})
+            self._invalidate_cached_documents(self.Meta.schema, [_id])
+            self._delete_cascaded(deletes)
 
     def delete_many(self, **filter):
-        self.collection.delete_many(filter)
+        """
+        Deletes the documents matching filter, and the entities they
+        reference through fields with a "delete" cascade. These are removed
+        with one delete_many per collection.
+        """
+        with self._span("delete_many"):
+            deletes = self._get_cascaded_deletes(filter)
+            self.collection.delete_many(filter)
+            self._invalidate_cached_documents(self.Meta.schema)
+            self._delete_cascaded(deletes)
@@ -0,0 +1,38 @@
+import weakref
+
+
+# Maps id(obj) to the document obj was last loaded or saved as
+_snapshots = {}
+
+
+def get_snapshot(obj):
+    return _snapshots.get(id(obj))
+
+
+def set_snapshot(obj, document):
+    key = id(obj)
+    if key not in _snapshots:
+        try:
+            weakref.finalize(obj, _snapshots.pop, key, None)
+        except TypeError:
+            # Objects that can't be weakly referenced aren't tracked
+            return
+    _snapshots[key] = dict(document)
+
+
+def get_update(snapshot, document):
+    """
+    Returns the $set/$unset update that turns snapshot into document.
+    """
+    update = {}
+    changed = {
+        k: v
+        for k, v in document.items()
+        if k != "id" and (k not in snapshot or snapshot[k] != v)
+    }
+    removed = {k: "" for k in snapshot if k != "id" and k not in document}
+    if changed:
+        update["$set"] = changed
+    if removed:
+        update["$unset"] = removed
+    return update
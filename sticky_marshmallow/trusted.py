@@ -0,0 +1,140 @@
+"""
+Loads documents that were written by sticky-marshmallow itself, and are
+therefore known to be valid, without marshmallow's validation.
+"""
+import datetime
+
+import marshmallow
+from marshmallow import fields
+from marshmallow.decorators import POST_LOAD
+
+from sticky_marshmallow.plan import get_schema_class
+
+
+# Fields whose stored value is the loaded value
+_IDENTITY_FIELDS = (
+    fields.Raw,
+    fields.String,
+    fields.Integer,
+    fields.Float,
+    fields.Boolean,
+)
+
+_loaders = {}
+
+
+def get_trusted_loader(schema):
+    """
+    Returns a function that turns a dereferenced document into what
+    schema.load would return, compiled once per schema class and set of load
+    fields. Validators, required and unknown field checks and pre_load hooks
+    are skipped, post_load hooks are run.
+    """
+    if hasattr(schema, "type_schemas"):
+        key = (get_schema_class(schema),)
+    else:
+        key = (get_schema_class(schema), tuple(schema.load_fields))
+    try:
+        return _loaders[key]
+    except KeyError:
+        loader = _loaders[key] = (
+            _compile_one_of(schema)
+            if hasattr(schema, "type_schemas")
+            else _compile(schema)
+        )
+        return loader
+
+
+def _compile(schema):
+    specs = [
+        (
+            field.data_key if field.data_key is not None else field_name,
+            field.attribute or field_name,
+            _get_converter(field_name, field),
+            field.load_default,
+        )
+        for field_name, field in schema.load_fields.items()
+    ]
+
+    def load(document):
+        data = {}
+        for data_key, attribute, convert, load_default in specs:
+            if data_key in document:
+                value = document[data_key]
+                if value is not None and convert is not None:
+                    value = convert(value, document)
+            elif load_default is marshmallow.missing:
+                continue
+            else:
+                value = (
+                    load_default() if callable(load_default) else load_default
+                )
+            data[attribute] = value
+        return schema._invoke_load_processors(
+            POST_LOAD, data, many=False, original_data=document, partial=None
+        )
+
+    return load
+
+
+def _compile_one_of(schema):
+    """
+    Compiles a loader for a marshmallow_oneofschema schema, which dispatches
+    on the type field of each document.
+    """
+    loaders = {}
+
+    def load(document):
+        type_name = document.get(schema.type_field)
+        try:
+            loader = loaders[type_name]
+        except (KeyError, TypeError):
+            type_schema = schema.type_schemas.get(type_name)
+            if type_schema is None:
+                # Let marshmallow_oneofschema report the error
+                return schema.load(document)
+            if isinstance(type_schema, type):
+                type_schema = type_schema()
+            loader = loaders[type_name] = get_trusted_loader(type_schema)
+        return loader(document)
+
+    return load
+
+
+def _get_converter(field_name, field):
+    field_class = type(field)
+    if field_class in _IDENTITY_FIELDS:
+        return None
+    if field_class is fields.Nested:
+        return _get_nested_converter(field)
+    if isinstance(field, fields.DateTime):
+        # Datetimes are stored as such, see Core._to_document
+        return lambda value, document: (
+            value
+            if isinstance(value, datetime.datetime)
+            else field._deserialize(value, field_name, document)
+        )
+    if field_class is fields.List and type(field.inner) is fields.Nested:
+        convert_item = _get_nested_converter(field.inner)
+        return lambda value, document: [
+            convert_item(item, document) for item in value
+        ]
+    return lambda value, document: field._deserialize(
+        value, field_name, document
+    )
+
+
+def _get_nested_converter(field):
+    # The nested loader is compiled on first use, as field.schema may refer
+    # back to the schema being compiled
+    loader = None
+
+    def convert(value, document):
+        nonlocal loader
+        if loader is None:
+            loader = get_trusted_loader(field.schema)
+        if field.many:
+            return [None if item is None else loader(item) for item in value]
+        return loader(value)
+
+    return convert
@@ -0,0 +1,349 @@
+import asyncio
+import warnings
+
+import pytest
+from marshmallow import fields, Schema
+from sticky_marshmallow import aio, connection, get_db
+from sticky_marshmallow.aio import AsyncCursor, AsyncRepository
+from sticky_marshmallow.cache import (
+    EntityCache,
+    QueryCache,
+    register_entity_cache,
+    register_query_cache,
+)
+from sticky_marshmallow.indexes import ensure_indexes, UnindexedFilterWarning
+from sticky_marshmallow.tracking import get_snapshot
+
+from tests.db import connect
+from tests.test_cascade import _make_post, PostRepository, PostSchema
+from tests.test_book_repository import (
+    _clean,
+    Author,
+    AuthorSchema,
+    Book,
+    BookSchema,
+    Review,
+)
+
+
+class AsyncCursorStandIn:
+    """
+    An in-process stand-in for an async driver cursor.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        method = getattr(self._cursor, name)
+
+        def chain(*args, **kwargs):
+            self._cursor = method(*args, **kwargs)
+            return self
+
+        return chain
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        try:
+            return next(self._cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class AsyncCollectionStandIn:
+    def __init__(self, collection):
+        self._collection = collection
+        self.name = collection.name
+        self.full_name = collection.full_name
+
+    def find(self, *args, **kwargs):
+        return AsyncCursorStandIn(self._collection.find(*args, **kwargs))
+
+    def aggregate(self, *args, **kwargs):
+        return AsyncCursorStandIn(self._collection.aggregate(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            return method(*args, **kwargs)
+
+        return call
+
+
+class AsyncDatabaseStandIn:
+    def __init__(self, db):
+        self._db = db
+
+    def __getitem__(self, name):
+        return AsyncCollectionStandIn(self._db[name])
+
+
+class AsyncBookRepository(AsyncRepository):
+    class Meta:
+        schema = BookSchema
+
+
+class AsyncAuthorRepository(AsyncRepository):
+    class Meta:
+        schema = AuthorSchema
+
+
+class AsyncPostRepository(AsyncRepository):
+    class Meta:
+        schema = PostSchema
+        cascade = PostRepository.Meta.cascade
+
+
+class AsyncTrackedBookRepository(AsyncRepository):
+    class Meta:
+        schema = BookSchema
+        track_changes = True
+
+
+class TaskSchema(Schema):
+    id = fields.Str()
+    status = fields.Str()
+    title = fields.Str()
+
+
+class AsyncTaskRepository(AsyncRepository):
+    class Meta:
+        schema = TaskSchema
+        indexes = ["status"]
+        check_indexes = True
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class TestAsyncRepository:
+    def setup(self):
+        connect()
+        _clean()
+        self._dbs = connection._dbs
+        connection._dbs = {
+            connection.DEFAULT_ALIAS: AsyncDatabaseStandIn(get_db())
+        }
+
+    def teardown(self):
+        connection._dbs = self._dbs
+        _clean()
+
+    def _save_book(self, title="Nineteen Eighty-Four"):
+        book = Book(
+            id=None,
+            title=title,
+            author=Author(id=None, name="George Orwell"),
+            reviews=[Review(id=None, rating=5), Review(id=None, rating=4)],
+        )
+        return _run(AsyncBookRepository().save(book))
+
+    def test_save_and_get(self):
+        book = self._save_book()
+        assert book.id is not None
+        book = _run(AsyncBookRepository().get(book.id))
+        assert isinstance(book, Book)
+        assert book.author.name == "George Orwell"
+        assert [review.rating for review in book.reviews] == [5, 4]
+
+    def test_get_reads_through_cache(self):
+        book = self._save_book()
+        cache = EntityCache()
+        register_entity_cache(cache)
+        try:
+            _run(AsyncBookRepository().get(book.id))
+            # The book, its author and its two reviews
+            assert cache.misses == 4
+            book = _run(AsyncBookRepository().get(book.id))
+            assert book.author.name == "George Orwell"
+            assert cache.hits == 4
+        finally:
+            register_entity_cache(None)
+
+    def test_find_cached(self):
+        self._save_book()
+        cache = QueryCache()
+        register_query_cache(cache)
+
+        async def find():
+            cursor = AsyncBookRepository().find().cached()
+            return [book async for book in cursor]
+
+        try:
+            assert [book.title for book in _run(find())] == [
+                "Nineteen Eighty-Four"
+            ]
+            books = _run(find())
+            assert books[0].author.name == "George Orwell"
+            assert cache.hits == 1
+            self._save_book("Animal Farm")
+            assert len(_run(find())) == 2
+        finally:
+            register_query_cache(None)
+
+    def test_get_does_not_exist(self):
+        repo = AsyncBookRepository()
+        with pytest.raises(repo.DoesNotExist):
+            _run(repo.get("5e8f8f8f8f8f8f8f8f8f8f8f"))
+
+    def test_find(self):
+        self._save_book("Nineteen Eighty-Four")
+        self._save_book("Animal Farm")
+
+        async def titles():
+            cursor = AsyncBookRepository().find().sort("title")
+            assert isinstance(cursor, AsyncCursor)
+            return [book.title async for book in cursor]
+
+        assert _run(titles()) == ["Animal Farm", "Nineteen Eighty-Four"]
+
+    def test_iter_batches(self):
+        self._save_book("Nineteen Eighty-Four")
+        self._save_book("Animal Farm")
+
+        async def batches():
+            cursor = AsyncBookRepository().find()
+            return [len(batch) async for batch in cursor.iter_batches(1)]
+
+        assert _run(batches()) == [1, 1]
+
+    def test_count_and_delete(self):
+        book = self._save_book()
+        repo = AsyncBookRepository()
+        assert _run(repo.find().count()) == 1
+        _run(repo.delete(book))
+        assert _run(repo.find().count()) == 0
+        assert _run(AsyncAuthorRepository().find().count()) == 1
+
+    def test_delete_many_cascade(self):
+        repo = AsyncPostRepository()
+        _run(repo.save_many([_make_post("One"), _make_post("Two")]))
+        _run(repo.delete_many(title="One"))
+        db = get_db()
+        assert _run(db["comment"].count_documents({})) == 2
+        assert _run(db["attachment"].count_documents({})) == 1
+        assert _run(db["user"].count_documents({})) == 2
+        for name in ("post", "comment", "attachment", "user"):
+            _run(db[name].delete_many({}))
+
+    def test_paginate(self):
+        for title in ("Animal Farm", "Burmese Days", "Coming Up for Air"):
+            self._save_book(title)
+
+        async def pages():
+            cursor = AsyncBookRepository().find().sort("title")
+            first = await cursor.paginate(page_size=2)
+            second = await cursor.paginate(after=first.next, page_size=2)
+            return first, second
+
+        first, second = _run(pages())
+        assert [book.title for book in first] == [
+            "Animal Farm",
+            "Burmese Days",
+        ]
+        assert [book.title for book in second] == ["Coming Up for Air"]
+        assert second.next is None
+
+    def test_page_with_total(self):
+        for title in ("Animal Farm", "Burmese Days", "Coming Up for Air"):
+            self._save_book(title)
+        cursor = AsyncBookRepository().find().sort("title").skip(1).limit(1)
+        page = _run(cursor.page_with_total())
+        assert [book.title for book in page] == ["Burmese Days"]
+        assert page.items[0].author.name == "George Orwell"
+        assert page.total == 3
+
+    def test_track_changes(self):
+        book = self._save_book()
+        repo = AsyncTrackedBookRepository()
+        assert get_snapshot(_run(repo.get(book.id))) is not None
+
+        async def find():
+            return [book async for book in repo.find()]
+
+        assert get_snapshot(_run(find())[0]) is not None
+        assert get_snapshot(_run(AsyncBookRepository().get(book.id))) is None
+
+    def test_deleted_document_is_replaced(self):
+        book = self._save_book()
+        repo = AsyncTrackedBookRepository()
+        book = _run(repo.get(book.id))
+        _run(repo.collection.delete_many({}))
+        book.title = "1984"
+        _run(repo.save(book))
+        assert _run(repo.get(book.id)).title == "1984"
+
+    def test_get_fields(self):
+        repo = AsyncPostRepository()
+        post = _run(repo.save(_make_post()))
+        post = _run(repo.get(post.id, fields=["title"]))
+        assert post.title == "Cascades"
+        assert post.author is None
+        assert post.comments == []
+        with pytest.raises(ValueError):
+            _run(repo.get(post.id, join="client"))
+        db = get_db()
+        for name in ("post", "comment", "attachment", "user"):
+            _run(db[name].delete_many({}))
+
+    def test_lazy_is_not_supported(self):
+        with pytest.raises(TypeError):
+            AsyncBookRepository().find().lazy("reviews")
+        with pytest.raises(TypeError):
+            AsyncBookRepository().find().prefetch()
+        with pytest.raises(ValueError):
+
+            class AsyncLazyBookRepository(AsyncRepository):
+                class Meta:
+                    schema = BookSchema
+                    lazy = ["reviews"]
+
+
+class TestAsyncIndexes:
+    def setup(self):
+        connect()
+        get_db()["task"].drop()
+        self._dbs = connection._dbs
+
+    def teardown(self):
+        connection._dbs = self._dbs
+        get_db()["task"].drop()
+
+    def _use_async_driver(self):
+        connection._dbs = {
+            connection.DEFAULT_ALIAS: AsyncDatabaseStandIn(get_db())
+        }
+
+    def test_mixed_registry(self):
+        ensure_indexes()
+        assert "status_1" not in get_db()["task"].index_information()
+        with pytest.raises(TypeError):
+            ensure_indexes([AsyncTaskRepository])
+        self._use_async_driver()
+        assert _run(aio.ensure_indexes())["task"] == ["status_1"]
+        assert _run(AsyncTaskRepository().ensure_indexes()) == {}
+
+    def test_check_indexes(self):
+        get_db()["task"].insert_one({"status": "open", "title": "Write"})
+        self._use_async_driver()
+        _run(AsyncTaskRepository().ensure_indexes())
+
+        async def titles(**filter):
+            cursor = AsyncTaskRepository().find(**filter)
+            return [task["title"] async for task in cursor]
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            assert _run(titles(status="open")) == ["Write"]
+            _run(AsyncTaskRepository().get(status="open"))
+        with pytest.warns(UnindexedFilterWarning, match="'task'.*'title'"):
+            _run(titles(title="Write"))
+        with pytest.warns(UnindexedFilterWarning):
+            _run(AsyncTaskRepository().get(title="Write"))
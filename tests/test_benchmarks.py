@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from benchmarks.__main__ import main
+from benchmarks.runner import percentile, run
+from benchmarks.schemas import count_nodes, make_graph
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([1], 90) == 1
+
+
+def test_make_graph():
+    root = make_graph(2, 3, 10)
+    assert len(root.children) == 3
+    assert len(root.children[0].children) == 3
+    assert root.children[0].children[0].children is None
+    assert root.payload == "x" * 10
+    assert count_nodes(2, 3) == 13
+
+
+class TestRun:
+    def setup(self):
+        pytest.importorskip("mongomock")
+
+    def test_run(self):
+        results = {
+            result["operation"]: result
+            for result in run(
+                "memory", depth=2, fan_out=2, size=10, iterations=3
+            )
+        }
+        assert list(results) == ["save", "get", "find", "delete"]
+        # One write per node, one query per level
+        assert results["save"]["round_trips"] == 7
+        assert results["get"]["round_trips"] == 3
+        assert results["find"]["round_trips"] == 3
+        assert results["delete"]["round_trips"] == 1
+        for result in results.values():
+            assert result["calls"] == 2
+            assert result["depth"] == 2
+            assert result["fan_out"] == 2
+            assert result["size"] == 10
+            assert result["peak_memory"] > 0
+            assert set(result["latency"]) == {
+                "p50",
+                "p90",
+                "p99",
+                "min",
+                "max",
+                "mean",
+            }
+
+    def test_main(self, tmp_path):
+        output = tmp_path / "results.json"
+        main(
+            [
+                "--backend",
+                "memory",
+                "--depth",
+                "0",
+                "1",
+                "--fan-out",
+                "2",
+                "--iterations",
+                "2",
+                "--output",
+                str(output),
+            ]
+        )
+        report = json.loads(output.read_text())
+        assert report["environment"]["backend"] == "memory"
+        assert len(report["results"]) == 8
@@ -3,7 +3,10 @@ from typing import List
 
 import pytest
 from marshmallow import fields, post_load, Schema
-from sticky_marshmallow import Repository
+from bson import ObjectId
+from pymongo import ReadPreference
+from sticky_marshmallow import get_db, register_db, Repository
+from sticky_marshmallow.core import Core
 from sticky_marshmallow.cursor import Cursor
 
 from tests.db import connect
@@ -125,6 +128,56 @@ class TestBookRepository:
         repo.save(book)
         assert repo.get(book.id).author is None
 
+    def test_dereference_keeps_order(self):
+        reviews = [Review(id=None, rating=rating) for rating in range(5)]
+        book = Book(
+            id=None,
+            title="Nineteen Eighty-Four",
+            author=Author(id=None, name="George Orwell"),
+            reviews=list(reversed(reviews)),
+        )
+        repo = BookRepository()
+        repo.save(book)
+        book = repo.get(book.id)
+        assert [review.rating for review in book.reviews] == [4, 3, 2, 1, 0]
+
+    def test_dereference_skips_missing_references(self):
+        book = Book(
+            id=None,
+            title="Nineteen Eighty-Four",
+            author=Author(id=None, name="George Orwell"),
+            reviews=[Review(id=None, rating=5), Review(id=None, rating=4)],
+        )
+        repo = BookRepository()
+        repo.save(book)
+        ReviewRepository().delete(book.reviews[0])
+        AuthorRepository().delete(book.author)
+        book = repo.get(book.id)
+        assert book.author is None
+        assert [review.rating for review in book.reviews] == [4]
+
+    def test_get_by_filter_is_one_query(self):
+        repo = BookRepository()
+        for title in ("Nineteen Eighty-Four", "Animal Farm", "Animal Farm"):
+            repo.save(Book(id=None, title=title, author=None, reviews=None))
+        calls = []
+        collection = repo.read_collection
+
+        class Collection:
+            def __getattr__(self, name):
+                calls.append(name)
+                return getattr(collection, name)
+
+        repo._read_collection = Collection()
+        assert repo.get(title="Nineteen Eighty-Four").title == (
+            "Nineteen Eighty-Four"
+        )
+        with pytest.raises(repo.MultipleObjectsReturned):
+            repo.get(title="Animal Farm")
+        with pytest.raises(repo.DoesNotExist):
+            repo.get(title="Burmese Days")
+        assert calls == ["find", "find", "find"]
+
 
 class TestCursor:
     def setup(self):
@@ -160,3 +213,218 @@ class TestCursor:
         cursor = BookRepository().find().sort("-title")
         assert next(cursor).title == "The Great Gatsby"
         assert next(cursor).title == "Nineteen Eighty-Four"
+
+    def test_iter_batches(self):
+        batches = list(BookRepository().find().iter_batches(1))
+        assert [[book.title for book in batch] for batch in batches] == [
+            ["Nineteen Eighty-Four"],
+            ["The Great Gatsby"],
+        ]
+
+    def test_iter_batches_after_next(self):
+        cursor = BookRepository().find().batch_size(2)
+        assert next(cursor).title == "Nineteen Eighty-Four"
+        batches = list(cursor.iter_batches(5))
+        assert [[book.title for book in batch] for batch in batches] == [
+            ["The Great Gatsby"]
+        ]
+
+
+class TestSaveMany:
+    def setup(self):
+        _clean()
+
+    def teardown(self):
+        _clean()
+
+    def test_save_many(self):
+        author = Author(id=None, name="George Orwell")
+        books = [
+            Book(
+                id=None,
+                title=title,
+                author=author,
+                reviews=[Review(id=None, rating=5), Review(id=None, rating=4)],
+            )
+            for title in ("Nineteen Eighty-Four", "Animal Farm")
+        ]
+        repo = BookRepository()
+        repo.save_many(books, batch_size=3)
+        assert all(book.id is not None for book in books)
+        assert author.id is not None
+        assert AuthorRepository().find().count() == 1
+        assert ReviewRepository().find().count() == 4
+        book = repo.get(books[1].id)
+        assert book.title == "Animal Farm"
+        assert book.author.name == "George Orwell"
+        assert [review.rating for review in book.reviews] == [5, 4]
+
+    def test_save_many_updates_existing(self):
+        book = Book(id=None, title="Animal Farm", author=None, reviews=None)
+        repo = BookRepository()
+        repo.save(book)
+        book.title = "Nineteen Eighty-Four"
+        repo.save_many([book])
+        assert repo.find().count() == 1
+        assert repo.get(book.id).title == "Nineteen Eighty-Four"
+
+
+class TestServerJoin:
+    def setup(self):
+        _clean()
+        self.repo = BookRepository()
+        self.book = self.repo.save(
+            Book(
+                id=None,
+                title="Nineteen Eighty-Four",
+                author=Author(id=None, name="George Orwell"),
+                reviews=[
+                    Review(id=None, rating=rating) for rating in (3, 5, 4)
+                ],
+            )
+        )
+        self.repo.save(
+            Book(id=None, title="Animal Farm", author=None, reviews=None)
+        )
+
+    def teardown(self):
+        _clean()
+
+    def test_get(self):
+        book = self.repo.get(self.book.id, join="server")
+        assert book.author == self.book.author
+        assert book.reviews == self.book.reviews
+
+    def test_find(self):
+        books = list(self.repo.find(join="server").sort("-title"))
+        assert [book.title for book in books] == [
+            "Nineteen Eighty-Four",
+            "Animal Farm",
+        ]
+        assert books[0].author.name == "George Orwell"
+        assert [review.rating for review in books[0].reviews] == [3, 5, 4]
+        assert books[1].author is None
+        assert books[1].reviews is None
+
+    def test_duplicate_references(self):
+        review = self.book.reviews[0]
+        self.book.reviews = [review, self.book.reviews[1], review]
+        self.repo.save(self.book)
+        book = self.repo.get(self.book.id, join="server")
+        assert [review.rating for review in book.reviews] == [3, 5, 3]
+
+    def test_joined_values(self):
+        found, missing = ObjectId(), ObjectId()
+        collection = get_db()["joined"]
+        collection.delete_many({})
+        collection.insert_one(
+            {
+                "many": [{"qux": "e"}, found, missing, found],
+                "_joined_many": [{"_id": found}],
+                "one": missing,
+                "_joined_one": [],
+            }
+        )
+        document = collection.aggregate(
+            [
+                {
+                    "$project": {
+                        "_id": 0,
+                        "many": {
+                            "$map": {
+                                "input": "$many",
+                                "as": "item",
+                                "in": Core._get_joined_item(
+                                    "_joined_many", "$$item"
+                                ),
+                            }
+                        },
+                        "one": Core._get_joined_item(
+                            "_joined_one", {"$ifNull": ["$one", None]}
+                        ),
+                        "none": Core._get_joined_item(
+                            "_joined_one", {"$ifNull": ["$none", None]}
+                        ),
+                    }
+                }
+            ]
+        ).next()
+        collection.drop()
+        assert document == {
+            "many": [{"qux": "e"}, {"_id": found}, missing, {"_id": found}],
+            "one": missing,
+            "none": None,
+        }
+
+    def test_find_limit(self):
+        books = list(self.repo.find(join="server").sort("title").limit(1))
+        assert [book.title for book in books] == ["Animal Farm"]
+
+    def test_unknown_join(self):
+        with pytest.raises(ValueError):
+            self.repo.find(join="client")
+
+
+class ReplicaBookRepository(Repository):
+    class Meta:
+        schema = BookSchema
+        read_alias = "replica"
+        read_preference = ReadPreference.SECONDARY_PREFERRED
+
+
+class TestReadAlias:
+    def setup(self):
+        connect()
+        register_db(get_db().client["test_replica"], alias="replica")
+        _clean()
+        self.replica = get_db("replica")
+        for collection_name in ("book", "author", "review"):
+            self.replica[collection_name].delete_many({})
+
+    def teardown(self):
+        _clean()
+        for collection_name in ("book", "author", "review"):
+            self.replica[collection_name].delete_many({})
+
+    def test_writes_go_to_db_alias(self):
+        repo = ReplicaBookRepository()
+        repo.save(
+            Book(
+                id=None,
+                title="Animal Farm",
+                author=Author(id=None, name="George Orwell"),
+                reviews=None,
+            )
+        )
+        assert BookRepository().find().count() == 1
+        assert AuthorRepository().find().count() == 1
+        assert repo.find().count() == 0
+
+    def test_reads_go_to_read_alias(self):
+        book = BookRepository().save(
+            Book(
+                id=None,
+                title="Animal Farm",
+                author=Author(id=None, name="George Orwell"),
+                reviews=[Review(id=None, rating=5)],
+            )
+        )
+        for collection_name in ("book", "author", "review"):
+            self.replica[collection_name].insert_many(
+                get_db()[collection_name].find()
+            )
+        get_db()["author"].update_one(
+            {}, {"$set": {"name": "Eric Arthur Blair"}}
+        )
+        repo = ReplicaBookRepository()
+        assert repo.get(book.id).author.name == "George Orwell"
+        assert [b.author.name for b in repo.find()] == ["George Orwell"]
+        assert [r.rating for r in repo.get(book.id).reviews] == [5]
+
+    def test_read_preference(self):
+        repo = ReplicaBookRepository()
+        assert (
+            repo.read_collection.read_preference
+            == ReadPreference.SECONDARY_PREFERRED
+        )
+        assert repo.collection.read_preference == ReadPreference.PRIMARY
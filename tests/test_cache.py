@@ -0,0 +1,241 @@
+from bson import ObjectId
+from sticky_marshmallow import get_db, register_db
+from sticky_marshmallow.cache import (
+    EntityCache,
+    QueryCache,
+    register_entity_cache,
+    register_query_cache,
+)
+
+from tests.db import connect
+from tests.test_book_repository import (
+    _clean,
+    Author,
+    AuthorRepository,
+    Book,
+    BookRepository,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestEntityCache:
+    def test_lru_eviction(self):
+        cache = EntityCache(max_size=2)
+        cache.set("author", {"_id": 1})
+        cache.set("author", {"_id": 2})
+        assert cache.get("author", 1) == {"_id": 1}
+        cache.set("author", {"_id": 3})
+        assert cache.get("author", 2) is None
+        assert cache.get("author", 1) == {"_id": 1}
+        assert cache.stats == {
+            "size": 2,
+            "hits": 2,
+            "misses": 1,
+            "evictions": 1,
+            "expirations": 0,
+        }
+
+    def test_ttl(self):
+        clock = Clock()
+        cache = EntityCache(ttl=10, clock=clock)
+        cache.set("author", {"_id": 1})
+        clock.now = 9
+        assert cache.get("author", 1) == {"_id": 1}
+        clock.now = 10
+        assert cache.get("author", 1) is None
+        assert cache.expirations == 1
+
+    def test_returns_copies(self):
+        cache = EntityCache()
+        cache.set("author", {"_id": 1, "name": "George Orwell"})
+        cache.get("author", 1)["name"] = "Eric Blair"
+        assert cache.get("author", 1)["name"] == "George Orwell"
+
+    def test_invalidate_collection(self):
+        cache = EntityCache()
+        cache.set("author", {"_id": 1})
+        cache.set("book", {"_id": 1})
+        cache.invalidate_collection("author")
+        assert cache.get("author", 1) is None
+        assert cache.get("book", 1) == {"_id": 1}
+
+    def test_db_alias(self):
+        cache = EntityCache()
+        cache.set("author", {"_id": 1, "name": "George Orwell"})
+        cache.set("author", {"_id": 1, "name": "Eric Blair"}, "other")
+        assert cache.get("author", 1)["name"] == "George Orwell"
+        cache.invalidate_collection("author", "other")
+        assert cache.get("author", 1, "other") is None
+        assert cache.get("author", 1)["name"] == "George Orwell"
+
+
+class TestRepositoryCache:
+    def setup(self):
+        connect()
+        _clean()
+        self.cache = EntityCache()
+        register_entity_cache(self.cache)
+
+    def teardown(self):
+        register_entity_cache(None)
+        _clean()
+
+    def _save_book(self):
+        book = Book(
+            id=None,
+            title="Nineteen Eighty-Four",
+            author=Author(id=None, name="George Orwell"),
+            reviews=None,
+        )
+        return BookRepository().save(book)
+
+    def test_get_reads_through(self):
+        book = self._save_book()
+        BookRepository().get(book.id)
+        assert self.cache.misses == 2
+        assert BookRepository().get(book.id).author.name == "George Orwell"
+        assert self.cache.hits == 2
+
+    def test_save_invalidates(self):
+        book = self._save_book()
+        BookRepository().get(book.id)
+        book.author.name = "Eric Blair"
+        AuthorRepository().save(book.author)
+        assert BookRepository().get(book.id).author.name == "Eric Blair"
+
+    def test_delete_invalidates(self):
+        book = self._save_book()
+        BookRepository().get(book.id)
+        AuthorRepository().delete(book.author)
+        assert BookRepository().get(book.id).author is None
+        AuthorRepository().delete_many()
+        assert len(self.cache) == 1
+
+    def test_db_alias(self):
+        register_db(get_db().client["test_other"], alias="other")
+        other = get_db("other")["author"]
+        book = self._save_book()
+        other.insert_one(
+            {"_id": ObjectId(book.author.id), "name": "Eric Blair"}
+        )
+        try:
+            AuthorRepository().get(book.author.id)
+            author = AuthorRepository(db_alias="other").get(book.author.id)
+            assert author.name == "Eric Blair"
+            assert (
+                AuthorRepository().get(book.author.id).name
+                == "George Orwell"
+            )
+        finally:
+            other.delete_many({})
+
+
+class TestQueryCache:
+    def test_lru_eviction(self):
+        cache = QueryCache(max_bytes=100)
+        cache.set("a", ["book"], [{"title": "x" * 20}])
+        cache.set("b", ["book"], [{"title": "x" * 20}])
+        assert cache.get("a") == [{"title": "x" * 20}]
+        cache.set("c", ["book"], [{"title": "x" * 20}])
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.stats["evictions"] == 1
+        assert cache.stats["bytes"] <= 100
+        cache.set("d", ["book"], [{"title": "x" * 200}])
+        assert cache.get("d") is None
+
+    def test_ttl(self):
+        clock = Clock()
+        cache = QueryCache(ttl=10, clock=clock)
+        cache.set("a", ["book"], [])
+        clock.now = 9
+        assert cache.get("a") == []
+        clock.now = 10
+        assert cache.get("a") is None
+        assert cache.expirations == 1
+
+    def test_returns_copies(self):
+        cache = QueryCache()
+        cache.set("a", ["book"], [{"title": "Emma"}])
+        cache.get("a")[0]["title"] = "Persuasion"
+        assert cache.get("a") == [{"title": "Emma"}]
+
+    def test_invalidate_collection(self):
+        cache = QueryCache()
+        cache.set("a", ["book", "author"], [])
+        cache.set("b", ["review"], [])
+        cache.invalidate_collection("author")
+        assert cache.get("a") is None
+        assert cache.get("b") == []
+        assert cache.stats["invalidations"] == 1
+
+    def test_db_alias(self):
+        cache = QueryCache()
+        cache.set("a", ["book"], [], "other")
+        cache.invalidate_collection("book")
+        assert cache.get("a") == []
+        cache.invalidate_collection("book", "other")
+        assert cache.get("a") is None
+
+
+class TestRepositoryQueryCache:
+    def setup(self):
+        connect()
+        _clean()
+        self.cache = QueryCache()
+        register_query_cache(self.cache)
+        self.author = Author(id=None, name="George Orwell")
+        BookRepository().save_many(
+            [
+                Book(id=None, title=title, author=self.author, reviews=None)
+                for title in ("Animal Farm", "Burmese Days")
+            ]
+        )
+
+    def teardown(self):
+        register_query_cache(None)
+        _clean()
+
+    def _find(self):
+        return list(BookRepository().find().sort("title").limit(1).cached())
+
+    def test_hit(self):
+        assert [book.title for book in self._find()] == ["Animal Farm"]
+        BookRepository().collection.update_many(
+            {}, {"$set": {"title": "Changed"}}
+        )
+        assert [book.title for book in self._find()] == ["Animal Farm"]
+        assert self.cache.hits == 1
+        assert [
+            book.title for book in BookRepository().find().sort("title")
+        ] == ["Changed", "Changed"]
+
+    def test_query_shape(self):
+        self._find()
+        list(BookRepository().find().sort("title").limit(2).cached())
+        list(BookRepository().find(title="Burmese Days").cached())
+        assert self.cache.misses == 3
+        assert len(self.cache) == 3
+
+    def test_hits_are_fresh_objects(self):
+        first = self._find()
+        first[0].author.name = "Eric Blair"
+        second = self._find()
+        assert second[0].author.name == "George Orwell"
+        assert second[0] is not first[0]
+
+    def test_save_invalidates(self):
+        self._find()
+        self.author.name = "Eric Blair"
+        AuthorRepository().save(self.author)
+        assert self._find()[0].author.name == "Eric Blair"
+        BookRepository().delete_many(title="Animal Farm")
+        assert [book.title for book in self._find()] == ["Burmese Days"]
+        assert self.cache.hits == 0
@@ -0,0 +1,220 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import pytest
+from bson import ObjectId
+from marshmallow import fields, post_load, Schema
+from sticky_marshmallow import Repository
+
+from tests.db import connect
+
+
+@dataclass
+class User:
+    id: Optional[str] = None
+    name: Optional[str] = None
+
+
+@dataclass
+class Attachment:
+    id: Optional[str] = None
+    url: Optional[str] = None
+
+
+@dataclass
+class Comment:
+    id: Optional[str] = None
+    text: Optional[str] = None
+    attachments: List[Attachment] = field(default_factory=list)
+
+
+@dataclass
+class Post:
+    id: Optional[str] = None
+    title: Optional[str] = None
+    author: Optional[User] = None
+    editor: Optional[User] = None
+    comments: List[Comment] = field(default_factory=list)
+
+
+class UserSchema(Schema):
+    id = fields.Str(allow_none=True)
+    name = fields.Str()
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return User(**data)
+
+
+class AttachmentSchema(Schema):
+    id = fields.Str(allow_none=True)
+    url = fields.Str()
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return Attachment(**data)
+
+
+class CommentSchema(Schema):
+    id = fields.Str(allow_none=True)
+    text = fields.Str()
+    attachments = fields.Nested(AttachmentSchema, many=True)
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return Comment(**data)
+
+
+class PostSchema(Schema):
+    id = fields.Str(allow_none=True)
+    title = fields.Str()
+    author = fields.Nested(UserSchema, allow_none=True)
+    editor = fields.Nested(UserSchema, allow_none=True)
+    comments = fields.Nested(CommentSchema, many=True)
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return Post(**data)
+
+
+class PostRepository(Repository):
+    class Meta:
+        schema = PostSchema
+        cascade = {
+            "author": "ref_only",
+            "editor": "none",
+            "comments": "delete",
+        }
+
+
+class CommentRepository(Repository):
+    class Meta:
+        schema = CommentSchema
+        cascade = {"attachments": "delete"}
+
+
+class PlainPostRepository(Repository):
+    class Meta:
+        schema = PostSchema
+
+
+class UserRepository(Repository):
+    class Meta:
+        schema = UserSchema
+
+
+class AttachmentRepository(Repository):
+    class Meta:
+        schema = AttachmentSchema
+
+
+def _clean():
+    for repository in (
+        PostRepository,
+        CommentRepository,
+        UserRepository,
+        AttachmentRepository,
+    ):
+        repository().collection.delete_many({})
+
+
+def _make_post(title="Cascades", author=None):
+    return Post(
+        title=title,
+        author=author or User(name="Ann"),
+        comments=[
+            Comment(text="First", attachments=[Attachment(url="a.png")]),
+            Comment(text="Second"),
+        ],
+    )
+
+
+class TestCascade:
+    def setup(self):
+        connect()
+        _clean()
+
+    def teardown(self):
+        _clean()
+
+    def test_ref_only_inserts_unsaved(self):
+        post = PostRepository().save(_make_post())
+        assert post.author.id is not None
+        assert UserRepository().get(id=post.author.id).name == "Ann"
+
+    def test_ref_only_does_not_write(self):
+        author = UserRepository().save(User(name="Ann"))
+        author.name = "Changed"
+        post = PostRepository().save(_make_post(author=author))
+        assert UserRepository().get(id=author.id).name == "Ann"
+        stored = PostRepository().collection.find_one(
+            {"_id": ObjectId(post.id)}
+        )
+        assert stored["author"] == ObjectId(author.id)
+
+    def test_ref_only_save_many(self):
+        author = UserRepository().save(User(name="Ann"))
+        author.name = "Changed"
+        PostRepository().save_many(
+            [_make_post("One", author), _make_post("Two", author)]
+        )
+        assert UserRepository().get(id=author.id).name == "Ann"
+        assert UserRepository().collection.count_documents({}) == 1
+
+    def test_per_repository(self):
+        author = UserRepository().save(User(name="Ann"))
+        author.name = "Changed"
+        PostRepository().save(_make_post(author=author))
+        assert UserRepository().get(id=author.id).name == "Ann"
+        PlainPostRepository().save(_make_post(author=author))
+        assert UserRepository().get(id=author.id).name == "Changed"
+
+    def test_none(self):
+        post = _make_post()
+        post.editor = User(name="Bob")
+        with pytest.raises(ValueError):
+            PostRepository().save(post)
+        post.editor = UserRepository().save(User(name="Bob"))
+        post.editor.name = "Changed"
+        PostRepository().save(post)
+        assert PostRepository().get(id=post.id).editor.name == "Bob"
+
+    def test_delete(self):
+        post = PostRepository().save(_make_post())
+        PostRepository().save(_make_post("Other"))
+        PostRepository().delete(post)
+        assert CommentRepository().collection.count_documents({}) == 2
+        assert AttachmentRepository().collection.count_documents({}) == 1
+        assert UserRepository().collection.count_documents({}) == 2
+
+    def test_delete_many(self):
+        PostRepository().save_many(
+            [_make_post("One"), _make_post("Two"), _make_post("Three")]
+        )
+        PostRepository().delete_many(title={"$in": ["One", "Two"]})
+        assert PostRepository().collection.count_documents({}) == 1
+        assert CommentRepository().collection.count_documents({}) == 2
+        assert AttachmentRepository().collection.count_documents({}) == 1
+        assert UserRepository().collection.count_documents({}) == 3
+
+    def test_delete_without_cascade(self):
+        post = PostRepository().save(_make_post())
+        CommentRepository().delete(post.comments[1])
+        assert CommentRepository().collection.count_documents({}) == 1
+        UserRepository().delete(post.author)
+        assert PostRepository().collection.count_documents({}) == 1
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+
+            class InvalidPolicyRepository(Repository):
+                class Meta:
+                    schema = PostSchema
+                    cascade = {"comments": "sometimes"}
+
+        with pytest.raises(ValueError):
+
+            class InvalidFieldRepository(Repository):
+                class Meta:
+                    schema = PostSchema
+                    cascade = {"title": "delete"}
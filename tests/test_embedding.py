@@ -0,0 +1,203 @@
+import io
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import pytest
+from bson import json_util, ObjectId
+from marshmallow import fields, post_load, Schema
+from sticky_marshmallow import Repository
+from sticky_marshmallow.embedding import (
+    get_embedding_stats,
+    reset_embedding_stats,
+)
+
+from tests.db import connect
+
+
+@dataclass
+class Writer:
+    id: Optional[str] = None
+    name: Optional[str] = None
+    bio: Optional[str] = None
+
+
+@dataclass
+class Article:
+    id: Optional[str] = None
+    title: Optional[str] = None
+    writer: Optional[Writer] = None
+    coauthors: List[Writer] = field(default_factory=list)
+
+
+class WriterSchema(Schema):
+    id = fields.Str(allow_none=True)
+    name = fields.Str()
+    bio = fields.Str(allow_none=True)
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return Writer(**data)
+
+
+class ArticleSchema(Schema):
+    id = fields.Str(allow_none=True)
+    title = fields.Str()
+    writer = fields.Nested(WriterSchema, allow_none=True)
+    coauthors = fields.Nested(WriterSchema, many=True)
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return Article(**data)
+
+
+class ArticleRepository(Repository):
+    class Meta:
+        schema = ArticleSchema
+        embed = {"writer": ["name"], "coauthors": ["name"]}
+
+
+class PlainArticleRepository(Repository):
+    class Meta:
+        schema = ArticleSchema
+
+
+class WriterRepository(Repository):
+    class Meta:
+        schema = WriterSchema
+        track_changes = True
+
+
+def _clean():
+    ArticleRepository().collection.delete_many({})
+    WriterRepository().collection.delete_many({})
+
+
+class TestEmbedding:
+    def setup(self):
+        connect()
+        _clean()
+        reset_embedding_stats()
+        self.ann = Writer(name="Ann", bio="Writes")
+        self.bob = Writer(name="Bob")
+        self.article = ArticleRepository().save(
+            Article(title="Copies", writer=self.ann, coauthors=[self.bob])
+        )
+
+    def teardown(self):
+        _clean()
+
+    def _get_stored(self):
+        return ArticleRepository().collection.find_one(
+            {"_id": ObjectId(self.article.id)}
+        )
+
+    def test_stores_copy(self):
+        stored = self._get_stored()
+        assert stored["writer"] == {
+            "_id": ObjectId(self.ann.id),
+            "name": "Ann",
+        }
+        assert stored["coauthors"] == [
+            {"_id": ObjectId(self.bob.id), "name": "Bob"}
+        ]
+
+    def test_per_repository(self):
+        writer = Writer(name="Cat")
+        article = PlainArticleRepository().save(
+            Article(title="Ids", writer=writer)
+        )
+        stored = PlainArticleRepository().collection.find_one(
+            {"_id": ObjectId(article.id)}
+        )
+        assert stored["writer"] == ObjectId(writer.id)
+
+    def test_reads_copy(self):
+        WriterRepository().collection.delete_many({})
+        article = ArticleRepository().get(id=self.article.id)
+        assert article.writer == Writer(id=self.ann.id, name="Ann")
+        assert article.coauthors == [Writer(id=self.bob.id, name="Bob")]
+        assert get_embedding_stats()["reads"] == 2
+
+    def test_save_partial(self):
+        article = ArticleRepository().get(id=self.article.id)
+        article.title = "Changed"
+        ArticleRepository().save(article)
+        ArticleRepository().save_many([article])
+        stored = WriterRepository().collection.find_one(
+            {"_id": ObjectId(self.ann.id)}
+        )
+        assert stored["bio"] == "Writes"
+        assert self._get_stored()["writer"] == {
+            "_id": ObjectId(self.ann.id),
+            "name": "Ann",
+        }
+        assert get_embedding_stats()["refreshes"] == 0
+
+    def test_save_partial_per_repository(self):
+        article = PlainArticleRepository().get(id=self.article.id)
+        assert article.writer == Writer(id=self.ann.id, name="Ann")
+        article.title = "Changed"
+        PlainArticleRepository().save(article)
+        stored = WriterRepository().collection.find_one(
+            {"_id": ObjectId(self.ann.id)}
+        )
+        assert stored["bio"] == "Writes"
+        assert self._get_stored()["writer"] == ObjectId(self.ann.id)
+
+    def test_export_references(self):
+        fp = io.StringIO()
+        ArticleRepository().export_jsonl(fp, references=True)
+        entries = [
+            json_util.loads(line) for line in fp.getvalue().splitlines()
+        ]
+        assert [
+            (entry["collection"], entry["document"]["name"])
+            for entry in entries[:-1]
+        ] == [("writer", "Ann"), ("writer", "Bob")]
+        assert entries[-1]["document"]["_id"] == ObjectId(self.article.id)
+
+    def test_refresh(self):
+        self.ann.name = "Anna"
+        WriterRepository().save(self.ann)
+        self.bob.name = "Robert"
+        WriterRepository().save_many([self.bob])
+        stored = self._get_stored()
+        assert stored["writer"]["name"] == "Anna"
+        assert stored["coauthors"][0]["name"] == "Robert"
+        stats = get_embedding_stats()
+        assert stats["refreshes"] == 2
+        assert stats["refreshed"] == 2
+
+    def test_refresh_only_embedded_fields(self):
+        writer = WriterRepository().get(id=self.ann.id)
+        writer.bio = "Writes a lot"
+        WriterRepository().save(writer)
+        assert get_embedding_stats()["refreshes"] == 0
+
+    def test_check_embedded(self):
+        WriterRepository().collection.update_one(
+            {"_id": ObjectId(self.ann.id)}, {"$set": {"name": "Anna"}}
+        )
+        assert ArticleRepository().check_embedded() == {
+            "writer": {"checked": 1, "stale": 1},
+            "coauthors": {"checked": 1, "stale": 0},
+        }
+        ArticleRepository().check_embedded(refresh=True)
+        assert self._get_stored()["writer"]["name"] == "Anna"
+        assert ArticleRepository().check_embedded()["writer"]["stale"] == 0
+        assert get_embedding_stats()["stale"] == 2
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+
+            class InvalidFieldRepository(Repository):
+                class Meta:
+                    schema = ArticleSchema
+                    embed = {"title": ["name"]}
+
+        with pytest.raises(ValueError):
+
+            class InvalidEmbedRepository(Repository):
+                class Meta:
+                    schema = ArticleSchema
+                    embed = {"writer": ["email"]}
@@ -0,0 +1,180 @@
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from bson import ObjectId
+from marshmallow import fields, post_load, Schema
+from sticky_marshmallow import Repository
+from sticky_marshmallow.lazy import is_unloaded, unwrap
+
+from tests.db import connect
+from tests.test_book_repository import _clean, Author, Book, BookRepository
+
+
+@dataclass
+class Person:
+    id: Optional[str] = None
+    name: Optional[str] = None
+    manager: Optional["Person"] = None
+    friends: List["Person"] = field(default_factory=list)
+
+
+class PersonSchema(Schema):
+    id = fields.Str(allow_none=True)
+    name = fields.Str()
+    manager = fields.Nested("PersonSchema", allow_none=True)
+    friends = fields.Nested("PersonSchema", many=True)
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return Person(**data)
+
+
+class PersonRepository(Repository):
+    class Meta:
+        schema = PersonSchema
+
+
+class ShallowPersonRepository(Repository):
+    class Meta:
+        schema = PersonSchema
+        max_depth = 1
+
+
+class TestGraph:
+    def setup(self):
+        connect()
+        _clean()
+        PersonRepository().delete_many()
+
+    def teardown(self):
+        _clean()
+        PersonRepository().delete_many()
+
+    def _set_manager(self, person, manager):
+        PersonRepository().collection.update_one(
+            {"_id": ObjectId(person.id)},
+            {"$set": {"manager": ObjectId(manager.id)}},
+        )
+
+    def test_shared_reference_in_batch(self):
+        author = Author(id=None, name="Jane Austen")
+        BookRepository().save_many(
+            [
+                Book(id=None, title=title, author=author, reviews=None)
+                for title in ("Emma", "Persuasion")
+            ]
+        )
+        books = list(BookRepository().find())
+        assert books[0].author.name == "Jane Austen"
+        assert books[0].author is books[1].author
+
+    def test_diamond(self):
+        boss = Person(name="Boss")
+        person = Person(
+            name="Ann",
+            friends=[
+                Person(name="Bob", manager=boss),
+                Person(name="Cat", manager=boss),
+            ],
+        )
+        PersonRepository().save(person)
+        person = PersonRepository().get(id=person.id)
+        assert [friend.name for friend in person.friends] == ["Bob", "Cat"]
+        assert person.friends[0].manager.name == "Boss"
+        assert person.friends[0].manager is person.friends[1].manager
+
+    def test_cycle(self):
+        ann = PersonRepository().save(Person(name="Ann"))
+        bob = PersonRepository().save(Person(name="Bob"))
+        self._set_manager(ann, bob)
+        self._set_manager(bob, ann)
+        person = PersonRepository().get(id=ann.id)
+        assert person.manager.name == "Bob"
+        assert unwrap(person.manager.manager) is person
+
+    def test_save_cycle(self):
+        ann = PersonRepository().save(Person(name="Ann"))
+        bob = PersonRepository().save(Person(name="Bob"))
+        self._set_manager(ann, bob)
+        self._set_manager(bob, ann)
+        person = PersonRepository().get(id=ann.id)
+        person.manager.name = "Robert"
+        PersonRepository().save(person.manager)
+        PersonRepository().save(person)
+        stored = {
+            document["name"]: document["manager"]
+            for document in PersonRepository().collection.find()
+        }
+        assert stored == {
+            "Ann": ObjectId(bob.id),
+            "Robert": ObjectId(ann.id),
+        }
+
+    def test_self_reference_in_list(self):
+        ann = PersonRepository().save(Person(name="Ann"))
+        PersonRepository().collection.update_one(
+            {"_id": ObjectId(ann.id)},
+            {"$set": {"friends": [ObjectId(ann.id)]}},
+        )
+        person = PersonRepository().get(id=ann.id)
+        assert [friend.name for friend in person.friends] == ["Ann"]
+        assert unwrap(person.friends[0]) is person
+        PersonRepository().save(person)
+        document = PersonRepository().collection.find_one()
+        assert document["friends"] == [ObjectId(ann.id)]
+
+    def test_max_depth(self, caplog):
+        ann, bob, cat = [
+            PersonRepository().save(Person(name=name))
+            for name in ("Ann", "Bob", "Cat")
+        ]
+        self._set_manager(ann, bob)
+        self._set_manager(bob, cat)
+        assert (
+            PersonRepository().get(id=ann.id).manager.manager.name == "Cat"
+        )
+        with caplog.at_level(logging.WARNING, "sticky_marshmallow.graph"):
+            person = ShallowPersonRepository().get(id=ann.id)
+        assert person.manager.name == "Bob"
+        assert is_unloaded(person.manager.manager)
+        assert "maximum depth of 1" in caplog.text
+        assert person.manager.manager.name == "Cat"
+
+    def test_save_beyond_max_depth(self):
+        ann, bob, cat = [
+            PersonRepository().save(Person(name=name))
+            for name in ("Ann", "Bob", "Cat")
+        ]
+        self._set_manager(ann, bob)
+        self._set_manager(bob, cat)
+        PersonRepository().collection.update_one(
+            {"_id": ObjectId(bob.id)},
+            {"$set": {"friends": [ObjectId(cat.id), ObjectId(ann.id)]}},
+        )
+        person = ShallowPersonRepository().get(id=ann.id)
+        ShallowPersonRepository().save(person)
+        document = PersonRepository().collection.find_one(
+            {"_id": ObjectId(bob.id)}
+        )
+        assert document["manager"] == ObjectId(cat.id)
+        assert document["friends"] == [ObjectId(cat.id), ObjectId(ann.id)]
+
+    def test_shared_reference_with_projections(self):
+        ann, bob, cat = [
+            PersonRepository().save(Person(name=name))
+            for name in ("Ann", "Bob", "Cat")
+        ]
+        self._set_manager(ann, bob)
+        self._set_manager(bob, cat)
+        PersonRepository().collection.update_one(
+            {"_id": ObjectId(ann.id)},
+            {"$set": {"friends": [ObjectId(bob.id)]}},
+        )
+        person = PersonRepository().get(
+            id=ann.id, fields=["manager.name", "friends"]
+        )
+        assert person.manager.name == "Bob"
+        assert person.manager.manager is None
+        assert person.friends[0].manager.name == "Cat"
+        assert person.friends[0] is not person.manager
@@ -0,0 +1,119 @@
+import warnings
+
+import pymongo
+import pytest
+from marshmallow import fields, Schema
+from sticky_marshmallow import Repository
+from sticky_marshmallow.indexes import (
+    ensure_indexes,
+    get_index_model,
+    is_supported,
+    UnindexedFilterWarning,
+)
+
+from tests.db import connect
+
+
+class EventSchema(Schema):
+    id = fields.Str()
+    source = fields.Str()
+    key = fields.Str()
+    created = fields.DateTime()
+    status = fields.Str()
+
+
+class EventRepository(Repository):
+    class Meta:
+        schema = EventSchema
+        primary_key = ["source", "key"]
+        indexes = [
+            "status",
+            ["source", "-created"],
+            {"fields": ["created"], "expireAfterSeconds": 3600},
+            {
+                "fields": ["status", "key"],
+                "name": "open_key",
+                "partialFilterExpression": {"status": "open"},
+            },
+        ]
+        check_indexes = True
+
+
+class OtherEventRepository(Repository):
+    class Meta:
+        schema = EventSchema
+        indexes = [pymongo.IndexModel([("status", pymongo.ASCENDING)])]
+
+
+class TestGetIndexModel:
+    def test_field_name(self):
+        assert get_index_model("status").document["key"] == {"status": 1}
+
+    def test_compound(self):
+        model = get_index_model(["id", "-created"])
+        assert model.document["key"] == {"_id": 1, "created": -1}
+
+    def test_options(self):
+        model = get_index_model({"fields": ["a"], "unique": True})
+        assert model.document["unique"] is True
+
+    def test_index_type(self):
+        model = get_index_model([("location", "2dsphere")])
+        assert model.document["key"] == {"location": "2dsphere"}
+
+
+class TestIsSupported:
+    def test_supported(self):
+        assert is_supported({"a": 1, "b": 2}, [["_id"], ["b", "c"]])
+        assert is_supported({"id": 1}, [["_id"]])
+
+    def test_not_supported(self):
+        assert not is_supported({"c": 1}, [["_id"], ["b", "c"]])
+
+    def test_empty(self):
+        assert is_supported({}, [["_id"]])
+        assert is_supported({"$or": []}, [["_id"]])
+
+
+class TestEnsureIndexes:
+    def setup(self):
+        connect()
+        EventRepository().collection.drop()
+
+    def teardown(self):
+        EventRepository().collection.drop()
+
+    def test_creates_indexes(self):
+        created = ensure_indexes([EventRepository, OtherEventRepository])
+        assert sorted(created["event"]) == [
+            "created_1",
+            "open_key",
+            "source_1_created_-1",
+            "source_1_key_1",
+            "status_1",
+        ]
+        indexes = EventRepository().collection.index_information()
+        assert indexes["source_1_key_1"]["unique"] is True
+        assert indexes["created_1"]["expireAfterSeconds"] == 3600
+
+    def test_idempotent(self):
+        EventRepository().ensure_indexes()
+        assert EventRepository().ensure_indexes() == {}
+
+    def test_unique_primary_key(self):
+        EventRepository().ensure_indexes()
+        EventRepository().collection.insert_one({"source": "a", "key": "1"})
+        with pytest.raises(pymongo.errors.DuplicateKeyError):
+            EventRepository().collection.insert_one(
+                {"source": "a", "key": "1"}
+            )
+
+    def test_unindexed_filter(self):
+        EventRepository().ensure_indexes()
+        EventRepository().collection.insert_one({"source": "a", "key": "1"})
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            list(EventRepository().find(source="a"))
+            EventRepository().get(source="a", key="1")
+        with pytest.warns(UnindexedFilterWarning, match="'event'.*'key'"):
+            EventRepository().find(key="1")
@@ -0,0 +1,140 @@
+import types
+
+import pytest
+from sticky_marshmallow.instrumentation import (
+    CommandListener,
+    Instrumentation,
+    NPlusOneError,
+    NPlusOneWarning,
+    register_instrumentation,
+    span,
+)
+
+from tests.db import connect
+from tests.test_book_repository import (
+    _clean,
+    Author,
+    Book,
+    BookRepository,
+    Review,
+)
+
+
+def _event(command_name, command, request_id, duration_micros=1000):
+    return types.SimpleNamespace(
+        command_name=command_name,
+        command=command,
+        connection_id=("localhost", 27017),
+        request_id=request_id,
+        duration_micros=duration_micros,
+    )
+
+
+class TestInstrumentation:
+    def setup(self):
+        connect()
+        _clean()
+        self.books = BookRepository().save_many(
+            [
+                Book(
+                    id=None,
+                    title=title,
+                    author=Author(id=None, name="George Orwell"),
+                    reviews=[Review(id=None, rating=5)],
+                )
+                for title in ("Nineteen Eighty-Four", "Animal Farm")
+            ]
+        )
+        self.instrumentation = Instrumentation(max_queries_by_id=1)
+        register_instrumentation(self.instrumentation)
+
+    def teardown(self):
+        register_instrumentation(None)
+        _clean()
+
+    def test_operations(self):
+        repo = BookRepository()
+        repo.get(self.books[0].id)
+        list(repo.find())
+        operations = self.instrumentation.stats["operations"]
+        assert operations["get"]["count"] == 1
+        assert operations["find"]["count"] == 2
+        # One per referenced collection, for get and for the first batch
+        assert operations["dereference"]["count"] == 4
+        assert operations["get"]["seconds"] > 0
+
+    def test_save_per_entity(self):
+        BookRepository().save(
+            Book(
+                id=None,
+                title="Homage to Catalonia",
+                author=Author(id=None, name="George Orwell"),
+                reviews=None,
+            )
+        )
+        assert self.instrumentation.stats["operations"]["save"]["count"] == 2
+
+    def test_no_n_plus_one_within_batch(self, recwarn):
+        with span("handler"):
+            list(BookRepository().find())
+        assert not recwarn.list
+
+    def test_n_plus_one_warning(self):
+        repo = BookRepository()
+        with pytest.warns(NPlusOneWarning, match="'handler' queried 'book'"):
+            with span("handler"):
+                for book in self.books:
+                    repo.get(book.id)
+
+    def test_n_plus_one_strict(self):
+        self.instrumentation.strict = True
+        repo = BookRepository()
+        with pytest.raises(NPlusOneError):
+            with span("handler"):
+                for book in self.books:
+                    repo.get(book.id)
+
+    def test_separate_operations(self, recwarn):
+        repo = BookRepository()
+        for book in self.books:
+            repo.get(book.id)
+        assert not recwarn.list
+
+    def test_command_listener(self):
+        listener = CommandListener()
+        with span("handler"):
+            listener.started(_event("find", {"find": "book"}, 1))
+            listener.succeeded(_event("find", None, 1, 2000))
+            listener.started(_event("getMore", {"collection": "book"}, 2))
+            listener.failed(_event("getMore", None, 2))
+        stats = self.instrumentation.stats
+        assert stats["operations"]["handler"]["commands"] == 2
+        assert stats["commands"]["find book"] == {
+            "count": 1,
+            "seconds": 0.002,
+            "failures": 0,
+        }
+        assert stats["commands"]["getMore book"]["failures"] == 1
+
+    def test_to_prometheus(self):
+        BookRepository().get(self.books[0].id)
+        CommandListener().started(_event("find", {"find": "book"}, 1))
+        CommandListener().succeeded(_event("find", None, 1))
+        output = self.instrumentation.to_prometheus()
+        assert "# TYPE sticky_marshmallow_operations_total counter\n" in output
+        assert (
+            'sticky_marshmallow_operations_total{operation="get"} 1\n'
+            in output
+        )
+        assert (
+            "sticky_marshmallow_commands_total"
+            '{command="find",collection="book"} 1\n' in output
+        )
+
+    def test_reset(self):
+        BookRepository().get(self.books[0].id)
+        self.instrumentation.reset()
+        assert self.instrumentation.stats == {
+            "operations": {},
+            "commands": {},
+        }
@@ -0,0 +1,109 @@
+import io
+
+from bson import json_util
+from sticky_marshmallow import get_db
+
+from tests.db import connect
+from tests.test_book_repository import (
+    _clean,
+    Author,
+    AuthorRepository,
+    Book,
+    BookRepository,
+    Review,
+    ReviewRepository,
+)
+
+
+class TestJsonl:
+    def setup(self):
+        connect()
+        _clean()
+        orwell = Author(id=None, name="George Orwell")
+        self.books = BookRepository().save_many(
+            [
+                Book(
+                    id=None,
+                    title="Nineteen Eighty-Four",
+                    author=orwell,
+                    reviews=[Review(id=None, rating=5)],
+                ),
+                Book(
+                    id=None,
+                    title="Animal Farm",
+                    author=orwell,
+                    reviews=[Review(id=None, rating=4)],
+                ),
+                Book(id=None, title="Emma", author=None, reviews=None),
+            ]
+        )
+
+    def teardown(self):
+        _clean()
+
+    def _export(self, **kwargs):
+        fp = io.StringIO()
+        stats = BookRepository().export_jsonl(fp, **kwargs)
+        return fp.getvalue(), stats
+
+    def test_export(self):
+        output, stats = self._export(batch_size=2)
+        entries = [json_util.loads(line) for line in output.splitlines()]
+        assert [entry["collection"] for entry in entries] == ["book"] * 3
+        assert [entry["document"] for entry in entries] == list(
+            get_db()["book"].find()
+        )
+        assert stats["documents"] == 3
+        assert stats["collections"] == {"book": 3}
+        assert stats["docs_per_second"] > 0
+
+    def test_export_filter(self):
+        output, stats = self._export(title="Emma")
+        assert stats["documents"] == 1
+
+    def test_export_references(self):
+        output, stats = self._export(batch_size=1, references=True)
+        collection_names = [
+            json_util.loads(line)["collection"]
+            for line in output.splitlines()
+        ]
+        # Emma references nothing and was inserted first. The shared author
+        # is only written once, before the first book referencing it.
+        assert collection_names == [
+            "book",
+            "author",
+            "review",
+            "book",
+            "review",
+            "book",
+        ]
+        assert stats["collections"] == {"author": 1, "review": 2, "book": 3}
+
+    def test_import(self):
+        output, _ = self._export(references=True)
+        _clean()
+        stats = BookRepository().import_jsonl(
+            io.StringIO(output), batch_size=2
+        )
+        assert stats["documents"] == 6
+        assert AuthorRepository().find().count() == 1
+        assert ReviewRepository().find().count() == 2
+        book = BookRepository().get(self.books[0].id)
+        assert book == self.books[0]
+
+    def test_import_upserts(self):
+        output, _ = self._export()
+        get_db()["book"].update_many({}, {"$set": {"title": "Untitled"}})
+        BookRepository().import_jsonl(io.StringIO(output))
+        assert sorted(book.title for book in BookRepository().find()) == [
+            "Animal Farm",
+            "Emma",
+            "Nineteen Eighty-Four",
+        ]
+
+    def test_path(self, tmp_path):
+        path = tmp_path / "books.jsonl"
+        BookRepository().export_jsonl(path, references=True)
+        _clean()
+        assert BookRepository().import_jsonl(str(path))["documents"] == 6
+        assert BookRepository().find().count() == 3
@@ -0,0 +1,91 @@
+from sticky_marshmallow import Repository
+from sticky_marshmallow.lazy import LazyList, LazyReference
+from sticky_marshmallow.tracking import get_snapshot
+
+from tests.db import connect
+from tests.test_book_repository import (
+    _clean,
+    Author,
+    Book,
+    BookRepository,
+    BookSchema,
+    Review,
+)
+
+
+class LazyBookRepository(Repository):
+    class Meta:
+        schema = BookSchema
+        lazy = ["reviews"]
+
+
+class TrackedLazyBookRepository(Repository):
+    class Meta:
+        schema = BookSchema
+        lazy = ["reviews"]
+        track_changes = True
+
+
+class TestLazy:
+    def setup(self):
+        connect()
+        _clean()
+        for title in ("Animal Farm", "Nineteen Eighty-Four"):
+            BookRepository().save(
+                Book(
+                    id=None,
+                    title=title,
+                    author=Author(id=None, name="George Orwell"),
+                    reviews=[
+                        Review(id=None, rating=5),
+                        Review(id=None, rating=4),
+                    ],
+                )
+            )
+
+    def teardown(self):
+        _clean()
+
+    def test_get(self):
+        book = LazyBookRepository().get(title="Animal Farm")
+        assert isinstance(book.author, Author)
+        assert isinstance(book.reviews, LazyList)
+        assert not book.reviews.is_loaded
+        assert [review.rating for review in book.reviews] == [5, 4]
+        assert book.reviews.is_loaded
+
+    def test_batch_is_loaded_together(self):
+        books = list(LazyBookRepository().find().sort("title"))
+        assert len(books[0].reviews) == 2
+        assert books[1].reviews.is_loaded
+        assert [review.rating for review in books[1].reviews] == [5, 4]
+
+    def test_lazy_single_reference(self):
+        book = next(BookRepository().find().lazy("author"))
+        assert isinstance(book.author, LazyReference)
+        assert book.author.name == "George Orwell"
+        assert book.author == Author(id=book.author.id, name="George Orwell")
+
+    def test_save_does_not_load(self):
+        book = LazyBookRepository().get(title="Animal Farm")
+        book.title = "Animal Farm: A Fairy Story"
+        LazyBookRepository().save(book)
+        assert not book.reviews.is_loaded
+        book = BookRepository().get(book.id)
+        assert book.title == "Animal Farm: A Fairy Story"
+        assert [review.rating for review in book.reviews] == [5, 4]
+
+    def test_save_loaded(self):
+        book = LazyBookRepository().get(title="Animal Farm")
+        book.reviews[0].rating = 1
+        LazyBookRepository().save(book)
+        book = BookRepository().get(book.id)
+        assert [review.rating for review in book.reviews] == [1, 4]
+
+    def test_track_changes(self):
+        book = TrackedLazyBookRepository().get(title="Animal Farm")
+        assert get_snapshot(book.reviews[0])["rating"] == 5
+        book.reviews[0].rating = 1
+        TrackedLazyBookRepository().save(book)
+        book = BookRepository().get(book.id)
+        assert [review.rating for review in book.reviews] == [1, 4]
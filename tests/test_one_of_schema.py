@@ -42,8 +42,21 @@ class BSchema(BaseSchema):
     baz = fields.Str()
 
 
+@dataclass
+class C:
+    qux: str
+
+
+class CSchema(Schema):
+    qux = fields.Str()
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return C(**data)
+
+
 class FooSchema(OneOfSchema):
-    type_schemas = {"a": ASchema, "b": BSchema}
+    type_schemas = {"a": ASchema, "b": BSchema, "c": CSchema}
 
     def get_obj_type(self, obj):
         return obj.__class__.__name__.lower()
@@ -95,3 +108,32 @@ class TestOneOfSchema:
         master = Master(foos=[a])
         MasterRepository().save(master)
         MasterRepository().get()
+
+    def test_stores_type(self):
+        a = FooRepository().save(A(id=None, foo="x", bar="y"))
+        assert FooRepository().collection.find_one()["type"] == "a"
+        assert FooRepository().get(id=a.id) == a
+        assert list(FooRepository().find().trusted()) == [a]
+
+    def test_mixed_list(self):
+        a = A(id=None, foo="x", bar="y")
+        b = B(id=None, foo="x", baz="z")
+        master = Master(foos=[C(qux="e"), a, b])
+        MasterRepository().save(master)
+        foos = MasterRepository().collection.find_one()["foos"]
+        assert foos[0] == {"qux": "e", "type": "c"}
+        assert foos[1:] == [bson.ObjectId(a.id), bson.ObjectId(b.id)]
+        assert FooRepository().collection.count_documents({}) == 2
+        expected = {
+            "foos": [C(qux="e"), a, {"id": b.id, "foo": "x", "baz": "z"}]
+        }
+        assert MasterRepository().get() == expected
+        assert list(MasterRepository().find().trusted()) == [expected]
+
+    def test_mixed_list_server_join(self):
+        a = A(id=None, foo="x", bar="y")
+        master = Master(foos=[C(qux="e"), a, a])
+        MasterRepository().save(master)
+        expected = {"foos": [C(qux="e"), a, a]}
+        assert MasterRepository().get(join="server") == expected
+        assert list(MasterRepository().find(join="server")) == [expected]
@@ -0,0 +1,193 @@
+import pymongo
+import pytest
+from bson import ObjectId
+from sticky_marshmallow.pagination import (
+    decode_token,
+    encode_token,
+    get_keyset_filter,
+    get_sort_keys,
+    Page,
+)
+
+from tests.db import connect
+from tests.test_book_repository import _clean, Author, Book, BookRepository
+
+
+class TestTokens:
+    def test_round_trip(self):
+        sort = get_sort_keys([("title", pymongo.DESCENDING)])
+        _id = ObjectId()
+        token = encode_token(sort, {"_id": _id, "title": "Emma"})
+        assert isinstance(token, str)
+        assert decode_token(sort, token) == ["Emma", _id]
+
+    def test_different_sort(self):
+        token = encode_token(get_sort_keys(None), {"_id": ObjectId()})
+        with pytest.raises(ValueError):
+            decode_token(get_sort_keys([("title", 1)]), token)
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            decode_token(get_sort_keys(None), "not a token")
+
+
+class TestKeyset:
+    def test_sort_keys(self):
+        assert get_sort_keys(None) == [("_id", pymongo.ASCENDING)]
+        assert get_sort_keys([("a", pymongo.DESCENDING)]) == [
+            ("a", pymongo.DESCENDING),
+            ("_id", pymongo.DESCENDING),
+        ]
+
+    def test_filter(self):
+        sort = [("a", pymongo.ASCENDING), ("_id", pymongo.DESCENDING)]
+        assert get_keyset_filter(sort, [1, 2]) == {
+            "$or": [{"a": {"$gt": 1}}, {"a": 1, "_id": {"$lt": 2}}]
+        }
+
+    def test_null_filter(self):
+        sort = [("a", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+        assert get_keyset_filter(sort, [None, 2]) == {
+            "$or": [{"a": {"$ne": None}}, {"a": None, "_id": {"$gt": 2}}]
+        }
+        sort = [("a", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+        assert get_keyset_filter(sort, [None, 2]) == {
+            "$or": [{"a": None, "_id": {"$lt": 2}}]
+        }
+        assert get_keyset_filter(sort, [1, 2]) == {
+            "$or": [
+                {"a": {"$lt": 1}},
+                {"a": None},
+                {"a": 1, "_id": {"$lt": 2}},
+            ]
+        }
+
+
+class TestPaginate:
+    def setup(self):
+        connect()
+        _clean()
+        author = Author(id=None, name="Jane Austen")
+        self.books = BookRepository().save_many(
+            [
+                Book(id=None, title=title, author=author, reviews=None)
+                for title in (
+                    "Emma",
+                    "Persuasion",
+                    "Emma",
+                    "Sanditon",
+                    "Lady Susan",
+                )
+            ]
+        )
+
+    def teardown(self):
+        _clean()
+
+    def _paginate(self, cursor, page_size):
+        pages = []
+        token = None
+        while True:
+            page = cursor.paginate(after=token, page_size=page_size)
+            pages.append(page)
+            if not page.has_next:
+                return pages
+            token = page.next
+
+    def test_pages(self):
+        pages = self._paginate(BookRepository().find().sort("-title"), 2)
+        assert [[book.title for book in page] for page in pages] == [
+            ["Sanditon", "Persuasion"],
+            ["Lady Susan", "Emma"],
+            ["Emma"],
+        ]
+        assert pages[1].items[0].author.name == "Jane Austen"
+
+    def test_tie_breaker(self):
+        pages = self._paginate(BookRepository().find().sort("title"), 1)
+        ids = [page.items[0].id for page in pages]
+        assert len(pages) == 5
+        assert sorted(ids) == sorted(book.id for book in self.books)
+
+    def test_optional_sort_field(self):
+        BookRepository().save_many(
+            [
+                Book(id=None, title="Sense", author=None, reviews=None)
+                for _ in range(2)
+            ]
+        )
+        for sort in ("author", "-author"):
+            pages = self._paginate(BookRepository().find().sort(sort), 2)
+            books = [book for page in pages for book in page]
+            assert len({book.id for book in books}) == 7
+            assert [book.author for book in books].count(None) == 2
+
+    def test_without_sort(self):
+        pages = self._paginate(BookRepository().find(), 3)
+        assert [len(page) for page in pages] == [3, 2]
+
+    def test_filter_and_skip(self):
+        cursor = BookRepository().find(title="Emma").sort("title").skip(1)
+        pages = self._paginate(cursor, 1)
+        assert [len(page) for page in pages] == [1, 1]
+
+    def test_exact_page(self):
+        page = BookRepository().find().paginate(page_size=5)
+        assert len(page) == 5
+        assert page.next is None
+
+    def test_projection(self):
+        cursor = BookRepository().find().sort("title").only("title")
+        page = cursor.as_dicts().paginate(page_size=1)
+        assert [document["title"] for document in page] == ["Emma"]
+        with pytest.raises(ValueError):
+            BookRepository().find().sort("title").only("author").paginate()
+
+    def test_page(self):
+        page = Page([1, 2], next="token")
+        assert list(page) == [1, 2]
+        assert page.has_next
+
+
+class TestPageWithTotal:
+    def setup(self):
+        connect()
+        _clean()
+        author = Author(id=None, name="Jane Austen")
+        BookRepository().save_many(
+            [
+                Book(id=None, title=title, author=author, reviews=None)
+                for title in ("Emma", "Persuasion", "Sanditon")
+            ]
+        )
+
+    def teardown(self):
+        _clean()
+
+    def test_page_with_total(self):
+        cursor = BookRepository().find().sort("-title").skip(1).limit(1)
+        page = cursor.page_with_total()
+        assert [book.title for book in page] == ["Persuasion"]
+        assert page.items[0].author.name == "Jane Austen"
+        assert page.total == 3
+
+    def test_filtered(self):
+        page = BookRepository().find(title="Emma").page_with_total()
+        assert [book.title for book in page] == ["Emma"]
+        assert page.total == 1
+
+    def test_empty(self):
+        page = BookRepository().find(title="Mansfield Park").page_with_total()
+        assert page.items == []
+        assert page.total == 0
+
+    def test_estimated(self):
+        cursor = BookRepository().find().sort("title").limit(2)
+        page = cursor.page_with_total(estimated=True)
+        assert [book.title for book in page] == ["Emma", "Persuasion"]
+        assert page.total == 3
+        # Filtered totals are always counted
+        page = BookRepository().find(title="Emma").page_with_total(
+            estimated=True
+        )
+        assert page.total == 1
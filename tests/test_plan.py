@@ -0,0 +1,31 @@
+from sticky_marshmallow.options import get_options
+from sticky_marshmallow.plan import get_plan
+
+from tests.test_book_repository import (
+    AuthorSchema,
+    BookRepository,
+    BookSchema,
+    ReviewSchema,
+)
+from tests.test_primary_key import FooSchema
+
+
+class TestPlan:
+    def test_plan_is_cached_per_schema_class(self):
+        assert get_plan(BookSchema) is get_plan(BookSchema())
+
+    def test_collection_name(self):
+        assert get_plan(AuthorSchema).collection_name == "author"
+
+    def test_references(self):
+        references = get_plan(BookSchema).references
+        assert set(references) == {"author", "reviews"}
+        assert references["author"].collection_name == "author"
+        assert references["author"].many is False
+        assert references["reviews"].collection_name == "review"
+        assert references["reviews"].many is True
+
+    def test_options(self):
+        assert BookRepository.Meta.schema is BookSchema
+        assert get_options(ReviewSchema).primary_key == ["id"]
+        assert get_options(FooSchema).primary_key == ["bar", "baz"]
@@ -0,0 +1,89 @@
+import itertools
+import time
+
+import pytest
+from sticky_marshmallow.prefetch import Prefetcher
+
+from tests.db import connect
+from tests.test_book_repository import (
+    _clean,
+    Author,
+    AuthorRepository,
+    Book,
+    BookRepository,
+)
+
+
+class TestPrefetcher:
+    def test_back_pressure(self):
+        counter = itertools.count()
+
+        def fetch():
+            return [next(counter)]
+
+        prefetcher = Prefetcher(fetch, size=2)
+        time.sleep(0.2)
+        # Two queued, one waiting for room in the queue
+        assert next(counter) == 3
+        assert prefetcher.get() == [0]
+        prefetcher.close()
+        assert not prefetcher._thread.is_alive()
+        assert prefetcher.get() == []
+
+    def test_error(self):
+        def fetch():
+            raise RuntimeError("Lost connection")
+
+        prefetcher = Prefetcher(fetch)
+        with pytest.raises(RuntimeError):
+            prefetcher.get()
+        assert prefetcher.get() == []
+
+
+class TestCursorPrefetch:
+    def setup(self):
+        connect()
+        _clean()
+        author = AuthorRepository().save(Author(id=None, name="Jane Austen"))
+        BookRepository().save_many(
+            [
+                Book(id=None, title=str(i), author=author, reviews=None)
+                for i in range(5)
+            ]
+        )
+
+    def teardown(self):
+        _clean()
+
+    def test_find(self):
+        books = list(BookRepository().find().batch_size(2).prefetch())
+        assert [book.title for book in books] == ["0", "1", "2", "3", "4"]
+        assert all(book.author.name == "Jane Austen" for book in books)
+
+    def test_iter_batches(self):
+        cursor = BookRepository().find().batch_size(2).prefetch(1)
+        batches = list(cursor.iter_batches(3))
+        assert [[book.title for book in batch] for batch in batches] == [
+            ["0", "1", "2"],
+            ["3", "4"],
+        ]
+
+    def test_error(self, monkeypatch):
+        def fail(*args, **kwargs):
+            raise RuntimeError("Lost connection")
+
+        monkeypatch.setattr(BookRepository, "_dereference_many", fail)
+        cursor = BookRepository().find().prefetch()
+        with pytest.raises(RuntimeError):
+            next(cursor)
+
+    def test_close(self):
+        with BookRepository().find().batch_size(1).prefetch(1) as cursor:
+            assert next(cursor).title == "0"
+        assert not cursor._prefetcher._thread.is_alive()
+        with pytest.raises(StopIteration):
+            next(cursor)
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            BookRepository().find().prefetch(0)
@@ -25,6 +25,11 @@ class FooRepository(Repository):
         primary_key = ["bar", "baz"]
 
 
+class OtherFooRepository(Repository):
+    class Meta:
+        schema = FooSchema
+
+
 @dataclass
 class Bar:
     id: str
@@ -69,3 +74,13 @@ class TestPrimaryKey:
         foo.bar = "4"
         FooRepository().save(foo)
         assert FooRepository().find().count() == 2
+
+    def test_per_repository(self):
+        # OtherFooRepository, defined later, keeps the default primary key
+        foo = Foo(bar="1", baz="2", qux="3")
+        FooRepository().save(foo)
+        foo.qux = "4"
+        FooRepository().save(foo)
+        assert FooRepository().find().count() == 1
+        assert FooRepository().collection.find_one()["qux"] == "4"
+        assert OtherFooRepository._options.primary_key == ["id"]
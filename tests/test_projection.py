@@ -0,0 +1,153 @@
+from dataclasses import dataclass
+from typing import List
+
+from marshmallow import fields, post_load, Schema
+from sticky_marshmallow import Repository
+from sticky_marshmallow.projection import Projection
+
+from tests.db import connect
+
+
+@dataclass
+class Publisher:
+    id: str = None
+    name: str = None
+    country: str = None
+
+
+@dataclass
+class Chapter:
+    id: str = None
+    title: str = None
+    pages: int = None
+
+
+@dataclass
+class Novel:
+    id: str = None
+    title: str = None
+    summary: str = None
+    publisher: Publisher = None
+    chapters: List[Chapter] = None
+
+
+class PublisherSchema(Schema):
+    id = fields.Str()
+    name = fields.Str()
+    country = fields.Str()
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return Publisher(**data)
+
+
+class ChapterSchema(Schema):
+    id = fields.Str()
+    title = fields.Str()
+    pages = fields.Int()
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return Chapter(**data)
+
+
+class NovelSchema(Schema):
+    id = fields.Str()
+    title = fields.Str()
+    summary = fields.Str()
+    publisher = fields.Nested(PublisherSchema, allow_none=True)
+    chapters = fields.Nested(ChapterSchema, allow_none=True, many=True)
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return Novel(**data)
+
+
+class NovelRepository(Repository):
+    class Meta:
+        schema = NovelSchema
+
+
+class PublisherRepository(Repository):
+    class Meta:
+        schema = PublisherSchema
+
+
+class ChapterRepository(Repository):
+    class Meta:
+        schema = ChapterSchema
+
+
+def _clean():
+    NovelRepository().delete_many()
+    PublisherRepository().delete_many()
+    ChapterRepository().delete_many()
+
+
+class TestProjection:
+    def test_to_mongo(self):
+        projection = Projection(["title", "publisher.name", "chapters"])
+        assert projection.to_mongo(NovelSchema) == {
+            "title": 1,
+            "publisher": 1,
+            "chapters": 1,
+        }
+        assert projection.get_nested("publisher").to_mongo(
+            PublisherSchema
+        ) == {"name": 1}
+
+    def test_exclude_to_mongo(self):
+        projection = Projection(["summary", "publisher.country"], exclude=True)
+        assert projection.to_mongo(NovelSchema) == {"summary": 0}
+        assert projection.includes("publisher")
+        assert not projection.includes("summary")
+
+    def test_schema_kwargs(self):
+        projection = Projection(["title", "publisher.name"])
+        assert projection.get_schema_kwargs(NovelSchema) == {
+            "only": ("id", "title", "publisher.id", "publisher.name")
+        }
+
+
+class TestRepositoryProjection:
+    def setup(self):
+        connect()
+        _clean()
+        self.novel = NovelRepository().save(
+            Novel(
+                title="Nineteen Eighty-Four",
+                summary="Big Brother is watching you.",
+                publisher=Publisher(name="Secker & Warburg", country="UK"),
+                chapters=[Chapter(title="One", pages=20)],
+            )
+        )
+
+    def teardown(self):
+        _clean()
+
+    def test_only(self):
+        novel = next(NovelRepository().find().only("title"))
+        assert novel == Novel(id=self.novel.id, title="Nineteen Eighty-Four")
+
+    def test_only_referenced_fields(self):
+        novel = next(NovelRepository().find().only("title", "publisher.name"))
+        assert novel.summary is None
+        assert novel.chapters is None
+        assert novel.publisher == Publisher(
+            id=self.novel.publisher.id, name="Secker & Warburg"
+        )
+
+    def test_exclude(self):
+        novel = next(
+            NovelRepository().find().exclude("chapters", "publisher.country")
+        )
+        assert novel.title == "Nineteen Eighty-Four"
+        assert novel.chapters is None
+        assert novel.publisher.name == "Secker & Warburg"
+        assert novel.publisher.country is None
+
+    def test_get_fields(self):
+        novel = NovelRepository().get(self.novel.id, fields=["summary"])
+        assert novel == Novel(
+            id=self.novel.id, summary="Big Brother is watching you."
+        )
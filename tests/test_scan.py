@@ -0,0 +1,124 @@
+import concurrent.futures
+import time
+
+import pytest
+from sticky_marshmallow.repository import SCAN_QUEUE_SIZE
+
+from tests.db import connect
+from tests.test_book_repository import (
+    _clean,
+    Author,
+    AuthorRepository,
+    Book,
+    BookRepository,
+)
+
+
+def _get_titles(batches):
+    return [book.title for batch in batches for book in batch]
+
+
+class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+    submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(*args, **kwargs)
+
+
+class TestScan:
+    def setup(self):
+        connect()
+        _clean()
+        author = AuthorRepository().save(Author(id=None, name="Jane Austen"))
+        self.titles = [f"{i:02}" for i in range(20)]
+        BookRepository().save_many(
+            [
+                Book(id=None, title=title, author=author, reviews=None)
+                for title in self.titles
+            ]
+        )
+
+    def teardown(self):
+        _clean()
+
+    def test_partitions(self):
+        partitions = BookRepository()._get_partitions({}, 4)
+        assert len(partitions) == 4
+        assert "$gte" not in partitions[0]["_id"]
+        assert "$lt" not in partitions[-1]["_id"]
+        counts = [
+            BookRepository().collection.count_documents(partition)
+            for partition in partitions
+        ]
+        assert sum(counts) == 20
+        assert all(counts)
+
+    def test_ordered(self):
+        batches = list(BookRepository().scan(partitions=3, batch_size=4))
+        assert _get_titles(batches) == self.titles
+        assert all(len(batch) <= 4 for batch in batches)
+        assert batches[0][0].author.name == "Jane Austen"
+
+    def test_unordered(self):
+        titles = _get_titles(BookRepository().scan(ordered=False))
+        assert sorted(titles) == self.titles
+
+    def test_fn_and_filter(self):
+        counts = BookRepository().scan(len, title={"$lt": "10"})
+        assert sum(counts) == 10
+
+    def test_executor(self):
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            counts = BookRepository().scan(
+                len, partitions=8, executor=executor
+            )
+            assert sum(counts) == 20
+
+    def test_in_flight(self):
+        with CountingExecutor(2) as executor:
+            batches = BookRepository().scan(
+                partitions=8, in_flight=2, executor=executor
+            )
+            first = next(batches)
+            # The first partition is still being yielded
+            assert executor.submitted == 2
+            assert len(first) + len(_get_titles(batches)) == 20
+            assert executor.submitted == 8
+
+    def test_queue_size(self):
+        loaded = []
+
+        def load(batch):
+            loaded.append(batch)
+            return len(batch)
+
+        batches = BookRepository().scan(load, partitions=1, batch_size=1)
+        assert next(batches) == 1
+        time.sleep(0.2)
+        # The one yielded, the queued ones and one waiting for room
+        assert len(loaded) == 1 + SCAN_QUEUE_SIZE + 1
+        assert sum(batches) == 19
+        assert len(loaded) == 20
+
+    def test_more_partitions_than_documents(self):
+        BookRepository().delete_many(title={"$gt": "01"})
+        assert _get_titles(BookRepository().scan(partitions=8)) == [
+            "00",
+            "01",
+        ]
+
+    def test_empty(self):
+        _clean()
+        assert list(BookRepository().scan()) == []
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            list(BookRepository().scan(partitions=0))
+        with pytest.raises(ValueError):
+            list(BookRepository().scan(in_flight=0))
+
+    def test_process_pool(self):
+        with concurrent.futures.ProcessPoolExecutor(1) as executor:
+            with pytest.raises(TypeError):
+                list(BookRepository().scan(executor=executor))
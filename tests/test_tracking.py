@@ -0,0 +1,131 @@
+from sticky_marshmallow import Repository
+from sticky_marshmallow.tracking import get_snapshot, get_update
+
+from tests.db import connect
+from tests.test_book_repository import (
+    _clean,
+    Author,
+    AuthorRepository,
+    Book,
+    BookSchema,
+    Review,
+)
+
+
+class TrackedBookRepository(Repository):
+    class Meta:
+        schema = BookSchema
+        track_changes = True
+
+
+class CommandCounter:
+    """
+    Counts the write methods called on the collections of a repository.
+    """
+
+    def __init__(self, repo):
+        self.calls = []
+        get_collection = repo._get_collection_from_schema
+
+        def _get_collection_from_schema(schema):
+            return Collection(get_collection(schema), self.calls)
+
+        repo._get_collection_from_schema = _get_collection_from_schema
+
+
+class Collection:
+    def __init__(self, collection, calls):
+        self._collection = collection
+        self._calls = calls
+
+    def __getattr__(self, name):
+        if name in ("replace_one", "update_one", "bulk_write"):
+            self._calls.append((self._collection.name, name))
+        return getattr(self._collection, name)
+
+
+class TestGetUpdate:
+    def test_set_and_unset(self):
+        assert get_update(
+            {"id": "1", "a": 1, "b": 2, "c": 3}, {"id": "1", "a": 1, "b": 4}
+        ) == {"$set": {"b": 4}, "$unset": {"c": ""}}
+
+    def test_unchanged(self):
+        assert get_update({"id": "1", "a": 1}, {"id": "1", "a": 1}) == {}
+
+
+class TestTracking:
+    def setup(self):
+        connect()
+        _clean()
+        book = Book(
+            id=None,
+            title="Nineteen Eighty-Four",
+            author=Author(id=None, name="George Orwell"),
+            reviews=[Review(id=None, rating=5), Review(id=None, rating=4)],
+        )
+        self.book_id = TrackedBookRepository().save(book).id
+
+    def teardown(self):
+        _clean()
+
+    def test_snapshot(self):
+        book = TrackedBookRepository().get(self.book_id)
+        assert get_snapshot(book)["title"] == "Nineteen Eighty-Four"
+        assert get_snapshot(book.author)["name"] == "George Orwell"
+
+    def test_unchanged_is_not_written(self):
+        book = TrackedBookRepository().get(self.book_id)
+        repo = TrackedBookRepository()
+        counter = CommandCounter(repo)
+        repo.save(book)
+        assert counter.calls == []
+
+    def test_only_changes_are_written(self):
+        book = TrackedBookRepository().get(self.book_id)
+        book.reviews[1].rating = 1
+        repo = TrackedBookRepository()
+        counter = CommandCounter(repo)
+        repo.save(book)
+        assert counter.calls == [("review", "update_one")]
+        book = TrackedBookRepository().get(self.book_id)
+        assert [review.rating for review in book.reviews] == [5, 1]
+
+    def test_changed_reference(self):
+        book = next(TrackedBookRepository().find())
+        book.author = AuthorRepository().save(
+            Author(id=None, name="Eric Blair")
+        )
+        repo = TrackedBookRepository()
+        counter = CommandCounter(repo)
+        repo.save(book)
+        assert counter.calls == [
+            ("author", "replace_one"),
+            ("book", "update_one"),
+        ]
+        assert TrackedBookRepository().get(self.book_id).author.name == (
+            "Eric Blair"
+        )
+
+    def test_save_many(self):
+        book = TrackedBookRepository().get(self.book_id)
+        book.title = "1984"
+        repo = TrackedBookRepository()
+        counter = CommandCounter(repo)
+        repo.save_many([book])
+        assert counter.calls == [("book", "bulk_write")]
+        assert TrackedBookRepository().get(self.book_id).title == "1984"
+
+    def test_deleted_document_is_replaced(self):
+        book = TrackedBookRepository().get(self.book_id)
+        TrackedBookRepository().delete(book)
+        book.title = "1984"
+        TrackedBookRepository().save(book)
+        assert TrackedBookRepository().get(self.book_id).title == "1984"
+
+    def test_deleted_document_is_replaced_by_save_many(self):
+        book = TrackedBookRepository().get(self.book_id)
+        TrackedBookRepository().delete(book)
+        book.title = "1984"
+        TrackedBookRepository().save_many([book])
+        assert TrackedBookRepository().get(self.book_id).title == "1984"
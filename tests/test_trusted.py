@@ -0,0 +1,195 @@
+import datetime
+from dataclasses import dataclass
+from typing import List
+
+from marshmallow import fields, post_load, Schema, validate
+from marshmallow_oneofschema import OneOfSchema
+from sticky_marshmallow import Repository
+from sticky_marshmallow.trusted import get_trusted_loader
+
+from tests.db import connect
+
+
+@dataclass
+class Label:
+    id: str = None
+    name: str = None
+
+
+@dataclass
+class Track:
+    title: str = None
+    seconds: int = None
+
+
+@dataclass
+class Album:
+    id: str = None
+    title: str = None
+    released: datetime.datetime = None
+    format: str = None
+    label: Label = None
+    tracks: List[Track] = None
+
+
+class LabelSchema(Schema):
+    id = fields.Str()
+    name = fields.Str()
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return Label(**data)
+
+
+class TrackSchema(Schema):
+    title = fields.Str()
+    seconds = fields.Int()
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return Track(**data)
+
+
+class AlbumSchema(Schema):
+    id = fields.Str()
+    title = fields.Str(validate=validate.Length(max=10))
+    released = fields.DateTime()
+    format = fields.Str(load_default="LP")
+    label = fields.Nested(LabelSchema, allow_none=True)
+    tracks = fields.List(fields.Nested(TrackSchema))
+
+    @post_load
+    def make_object(self, data, **kwargs):
+        return Album(**data)
+
+
+class AlbumRepository(Repository):
+    class Meta:
+        schema = AlbumSchema
+
+
+class TrustedAlbumRepository(Repository):
+    class Meta:
+        schema = AlbumSchema
+        trusted = True
+
+
+class LabelRepository(Repository):
+    class Meta:
+        schema = LabelSchema
+
+
+class ASchema(Schema):
+    id = fields.Str()
+    a = fields.Int()
+
+
+class BSchema(Schema):
+    id = fields.Str()
+    b = fields.Int()
+
+
+class ABSchema(OneOfSchema):
+    type_schemas = {"a": ASchema, "b": BSchema}
+
+
+class TestTrustedLoader:
+    def test_load(self):
+        document = {
+            "id": "1",
+            "title": "Blue Train",
+            "released": "1958-01-01T00:00:00",
+            "label": {"id": "2", "name": "Blue Note"},
+            "tracks": [{"title": "Moment's Notice", "seconds": 550}],
+            "unknown": True,
+        }
+        album = get_trusted_loader(AlbumSchema())(document)
+        assert album == Album(
+            id="1",
+            title="Blue Train",
+            released=datetime.datetime(1958, 1, 1),
+            format="LP",
+            label=Label(id="2", name="Blue Note"),
+            tracks=[Track(title="Moment's Notice", seconds=550)],
+        )
+
+    def test_skips_validation(self):
+        album = get_trusted_loader(AlbumSchema())({"title": "A Love Supreme"})
+        assert album.title == "A Love Supreme"
+
+    def test_compiled_once_per_schema(self):
+        assert get_trusted_loader(AlbumSchema()) is get_trusted_loader(
+            AlbumSchema()
+        )
+        assert get_trusted_loader(
+            AlbumSchema(only=("title",))
+        ) is not get_trusted_loader(AlbumSchema())
+
+    def test_only(self):
+        album = get_trusted_loader(AlbumSchema(only=("title",)))(
+            {"title": "Blue Train", "format": "CD"}
+        )
+        assert album == Album(title="Blue Train")
+
+    def test_one_of_schema(self):
+        load = get_trusted_loader(ABSchema())
+        assert load({"type": "a", "id": "1", "a": 1}) == {"id": "1", "a": 1}
+        assert load({"type": "b", "id": "2", "b": 2}) == {"id": "2", "b": 2}
+
+
+class TestTrustedRepository:
+    def setup(self):
+        connect()
+        AlbumRepository().delete_many()
+        LabelRepository().delete_many()
+        self.album = AlbumRepository().save(
+            Album(
+                title="Blue Train",
+                released=datetime.datetime(1958, 1, 1),
+                format="CD",
+                label=Label(name="Blue Note"),
+                tracks=[Track(title="Moment's Notice", seconds=550)],
+            )
+        )
+
+    def teardown(self):
+        AlbumRepository().delete_many()
+        LabelRepository().delete_many()
+
+    def test_get(self):
+        assert TrustedAlbumRepository().get(self.album.id) == self.album
+
+    def test_find(self):
+        assert list(TrustedAlbumRepository().find()) == [self.album]
+        assert list(AlbumRepository().find().trusted()) == [self.album]
+
+    def test_skips_validation(self):
+        self.album.title = "Blue Train (Remastered)"
+        AlbumRepository().save(self.album)
+        album = TrustedAlbumRepository().get(self.album.id)
+        assert album.title == "Blue Train (Remastered)"
+
+    def test_find_projected(self):
+        albums = list(
+            AlbumRepository().find().only("title", "label.name").trusted()
+        )
+        assert albums == [
+            Album(
+                id=self.album.id,
+                title="Blue Train",
+                label=Label(id=self.album.label.id, name="Blue Note"),
+            )
+        ]
+
+    def test_as_dicts(self):
+        documents = list(AlbumRepository().find().as_dicts())
+        assert documents == [
+            {
+                "id": self.album.id,
+                "title": "Blue Train",
+                "released": datetime.datetime(1958, 1, 1),
+                "format": "CD",
+                "label": {"id": self.album.label.id, "name": "Blue Note"},
+                "tracks": [{"title": "Moment's Notice", "seconds": 550}],
+            }
+        ]